@@ -0,0 +1,328 @@
+# The PV module batch model parameter extractor class.
+#
+# The instance of this class extracts the single-diode model parameters of
+# many PV modules at once. It solves the same three data sheet equations as
+# PV_Module_Model_Parameter_Extractor, but the inputs are numpy arrays (one
+# element per module) and all modules are solved together by the vectorized
+# solver in batch_solver.py with the analytic Jacobian of the equations.
+#
+# Scalar inputs are broadcast, so e.g. the number of cells can be given once
+# for a catalog of modules with the same cell count. If all inputs are scalars,
+# the results are scalars too and the class can be used like the single
+# module extractor.
+#
+# Note that in the second equation, the series resistance being solved for is
+# used in the shunt current term.
+#
+# The solver settings are given by a precision tier (see precision_tiers.py),
+# and the achieved mismatch of each module is reported by get_solver_info().
+#
+# If a ResultStore is given to extract(), the modules already in the store are
+# not solved again, and the new solutions are written to the store in one
+# transaction.
+
+
+import numpy as np
+from batch_solver import solve_batch
+from precision_tiers import get_precision_tier
+
+class PV_Module_Batch_Extractor:
+
+    def __init__(self, v_oc_stc=44.9, i_sc_stc=8.53, v_mp=36.1, i_mp=8.04,
+    temp_coeff_i_perc=0.046, temp_coeff_v_perc=-0.33, n_cell=72,
+     di_dv_sc=-2.488e-3, di_dv_oc=-2.05,
+     temperature_c=25, solar_irr =1000):
+        self._solved = False # Initially, the parameters are not extracted yet.
+
+        # Some physical constants:
+        self._q = 1.6e-19 # the charge of an electron in SI unit
+        self._k = 1.38e-23 # Boltzmann constant in SI unit
+        self._stc_temp_k = 25.0 + 273.15 # STC condition temperature with unit K
+        self._stc_solar_irr = 1000 # STC condition solar irradiation with unit W/(m^2)
+
+        # If all inputs are scalars, the results are returned as scalars.
+        inputs = [v_oc_stc, i_sc_stc, v_mp, i_mp, temp_coeff_i_perc, temp_coeff_v_perc,
+            n_cell, di_dv_sc, di_dv_oc, temperature_c, solar_irr]
+        self._scalar = all(np.ndim(item) == 0 for item in inputs)
+        inputs = np.broadcast_arrays(*[np.atleast_1d(np.asarray(item, dtype=float)) for item in inputs])
+        self._n_modules = inputs[0].size
+
+        # Initialize:
+        (self._v_oc_stc, self._i_sc_stc, self._v_mp, self._i_mp, temp_coeff_i_perc,
+            temp_coeff_v_perc, self._n_cell, self._di_dv_sc, self._di_dv_oc,
+            self._temperature_c, self._solar_irr) = [item.ravel() for item in inputs]
+        self._temp_coeff_i_perc = temp_coeff_i_perc
+        self._temp_coeff_v_perc = temp_coeff_v_perc
+        # The temperature coefficient's unit is %/C, need to be converted.
+        self._temp_coeff_i = temp_coeff_i_perc / 100
+        self._temp_coeff_v = temp_coeff_v_perc / 100
+        self._temperature_k = self._temperature_c + 273.15 # convert temperature unit C to K
+        # The thermal voltage of the whole module at STC.
+        self._v_t_stc = self._n_cell * self._k * self._stc_temp_k / self._q
+
+        # The parameters that need to be extracted (one element per module):
+        self._i_ph = None # photon current
+        self._v_oc = None # the open circuit voltage in a different temperature
+        self._r_sh = None # shunt resistance
+        self._r_s = None # series resistance
+        self._a = None # diode ideality factor
+        self._i_o = None # diode reverse saturation current.
+        self._i_o_stc = None # i_o at STC.
+
+        # The solution of the nonlinear equations and the solver's information.
+        self._x = None
+        self._converged = None
+        self._n_iterations = None
+        self._mismatch = None # the largest error of the equations of each module
+
+    def _nonlinear_equations(self, x, index):
+        # The data sheet equations and their analytic Jacobian for the modules in index.
+        # x holds one row of (a, log(i_o), r_s) per module.
+        a, i_o, r_s = x[:, 0], np.exp(x[:, 1]), x[:, 2]
+        v_oc_stc = self._v_oc_stc[index]
+        i_sc_stc = self._i_sc_stc[index]
+        v_mp = self._v_mp[index]
+        i_mp = self._i_mp[index]
+        r_sh = self._r_sh[index]
+        a_v_t = a * self._v_t_stc[index]
+
+        x_1 = v_oc_stc / a_v_t
+        x_2 = (v_mp + r_s * i_mp) / a_v_t
+        exp_1 = np.exp(np.minimum(x_1, 700.0)) # avoid overflow
+        exp_2 = np.exp(np.minimum(x_2, 700.0))
+
+        f = np.empty((len(index), 3))
+        f[:, 0] = i_o * (exp_1 - 1) - (i_sc_stc - v_oc_stc / r_sh)
+        f[:, 1] = i_mp - i_sc_stc + i_o * (exp_2 - 1) + (v_mp + r_s * i_mp) / r_sh
+        f[:, 2] = r_s + 1 / self._di_dv_oc[index] + a_v_t / i_sc_stc
+
+        jacobian = np.zeros((len(index), 3, 3))
+        jacobian[:, 0, 0] = -i_o * exp_1 * x_1 / a
+        jacobian[:, 0, 1] = i_o * (exp_1 - 1)
+        jacobian[:, 1, 0] = -i_o * exp_2 * x_2 / a
+        jacobian[:, 1, 1] = i_o * (exp_2 - 1)
+        jacobian[:, 1, 2] = i_o * exp_2 * i_mp / a_v_t + i_mp / r_sh
+        jacobian[:, 2, 0] = self._v_t_stc[index] / i_sc_stc
+        jacobian[:, 2, 2] = 1.0
+        return f, jacobian
+
+    def _initial_values(self, a_init, r_s_init):
+        # The initial values of the unknowns, calculated in the same way as the
+        # single module extractor.
+        a_init = np.broadcast_to(np.asarray(a_init, dtype=float), (self._n_modules,))
+        r_s_init = np.broadcast_to(np.asarray(r_s_init, dtype=float), (self._n_modules,))
+        i_o_init = (self._i_sc_stc - self._v_oc_stc / self._r_sh)\
+             / np.exp(self._v_oc_stc / (a_init * self._v_t_stc))
+        return np.column_stack((a_init, np.log(i_o_init), r_s_init))
+
+    def _solver_settings(self, a_init, r_s_init):
+        # The solver settings of each module, used in the keys of the result store.
+        a_init = np.broadcast_to(np.asarray(a_init, dtype=float), (self._n_modules,))
+        r_s_init = np.broadcast_to(np.asarray(r_s_init, dtype=float), (self._n_modules,))
+        return [{"solver": "batch_single_diode", "a_init": a_init[module], "r_s_init": r_s_init[module]}
+            for module in range(self._n_modules)]
+
+    def get_datasheets(self):
+        # The data sheet inputs of each module that the STC solution depends on.
+        columns = {
+            "v_oc_stc": self._v_oc_stc,
+            "i_sc_stc": self._i_sc_stc,
+            "v_mp": self._v_mp,
+            "i_mp": self._i_mp,
+            "temp_coeff_i_perc": self._temp_coeff_i_perc,
+            "temp_coeff_v_perc": self._temp_coeff_v_perc,
+            "n_cell": self._n_cell,
+            "di_dv_sc": self._di_dv_sc,
+            "di_dv_oc": self._di_dv_oc,
+        }
+        columns = {item: column.tolist() for item, column in columns.items()}
+        return [{item: column[module] for item, column in columns.items()}
+            for module in range(self._n_modules)]
+
+    def _set_stc_solution(self, x):
+        self._a, self._i_o_stc, self._r_s = x[:, 0], np.exp(x[:, 1]), x[:, 2]
+
+    def extract(self, a_init = 1.3, r_s_init = 0.3, max_iter = None, result_store = None, metadata = None,
+        precision = "standard"):
+        # The initial values can be scalars or arrays with one element per module.
+        # metadata is an optional list with one dictionary (manufacturer, model) per module,
+        # stored with the solutions in the result store.
+        # precision is the name of a precision tier or a dictionary of solver settings.
+        # max_iter overrides the tier's iteration cap if given.
+        tier = get_precision_tier(precision)
+        if max_iter is not None:
+            tier["max_iter"] = max_iter
+        self._r_sh = -1.0 / self._di_dv_sc
+        self._x = self._initial_values(a_init, r_s_init)
+        self._converged = np.zeros(self._n_modules, dtype=bool)
+        self._n_iterations = np.zeros(self._n_modules, dtype=int)
+
+        # Look up the modules that were solved before.
+        unsolved = np.ones(self._n_modules, dtype=bool)
+        if result_store is not None:
+            solver_settings = self._solver_settings(a_init, r_s_init)
+            for settings in solver_settings:
+                settings.update(tier)
+            datasheets = self.get_datasheets()
+            keys = [result_store.make_key(datasheet, settings)
+                for datasheet, settings in zip(datasheets, solver_settings)]
+            records = result_store.get_many(keys)
+            for module, key in enumerate(keys):
+                record = records.get(key)
+                if record is not None:
+                    self._x[module] = record["state"]
+                    self._converged[module] = record["converged"]
+                    unsolved[module] = False
+
+        # Solve nonlinear equations of the other modules to get the model parameters.
+        unsolved_index = np.nonzero(unsolved)[0]
+        if unsolved_index.size:
+            result = solve_batch(lambda x, index: self._nonlinear_equations(x, unsolved_index[index]),
+                self._x[unsolved_index], xtol=tier["xtol"], ftol=tier["ftol"], max_iter=tier["max_iter"],
+                residual_tol=tier["residual_tol"])
+            self._x[unsolved_index] = result["x"]
+            self._converged[unsolved_index] = result["converged"]
+            self._n_iterations[unsolved_index] = result["n_iterations"]
+        self._set_stc_solution(self._x)
+
+        # The mismatch of every module. The solves that do not meet the tier's bound are
+        # not converged.
+        mismatch, _ = self._nonlinear_equations(self._x, np.arange(self._n_modules))
+        self._mismatch = np.abs(mismatch).max(axis=1)
+        if tier["mismatch_bound"] is not None:
+            self._converged[unsolved_index] &= self._mismatch[unsolved_index] <= tier["mismatch_bound"]
+
+        # Store the new solutions in one transaction.
+        if result_store is not None and unsolved_index.size:
+            stored_records = []
+            for module in unsolved_index:
+                stored_record = {
+                    "key": keys[module],
+                    "datasheet": datasheets[module],
+                    "solver_settings": solver_settings[module],
+                    "a": self._a[module],
+                    "i_o_stc": self._i_o_stc[module],
+                    "r_s": self._r_s[module],
+                    "r_sh": self._r_sh[module],
+                    "state": self._x[module],
+                    "mismatch": self._mismatch[module],
+                    "converged": self._converged[module],
+                }
+                if metadata is not None:
+                    stored_record.update(metadata[module])
+                stored_records.append(stored_record)
+            result_store.put_many(stored_records)
+
+        self._update_working_parameters()
+
+        self._solved = True
+        return self._output(self._a), self._output(self._i_o), self._output(self._i_ph),\
+            self._output(self._r_s), self._output(self._r_sh)
+
+    def _update_working_parameters(self):
+        # The parameters that depend on the operating condition only.
+        # note that the temperature coefficient's unit is %/C
+        i_sc_working = self._i_sc_stc * (1 + self._temp_coeff_i * (self._temperature_k - self._stc_temp_k))
+        self._i_ph = i_sc_working * self._solar_irr / self._stc_solar_irr
+
+        self._v_oc = self._v_oc_stc *(1 + self._temp_coeff_v * (self._temperature_k - self._stc_temp_k))
+
+        # Update self._i_o based on the new open circuit voltage (1000 W/m^2 irradiance).
+        self._i_o = (i_sc_working - self._v_oc/self._r_sh)\
+             / np.exp(self._q*self._v_oc/(self._n_cell*self._a*self._k*self._temperature_k))
+
+    def update_conditions(self, temperature_c, solar_irr):
+        # Recalculate the parameters for new operating conditions (scalars or arrays with
+        # one element per module) without solving the nonlinear equations again.
+        if not self._solved:
+            return None
+
+        self._temperature_c = np.broadcast_to(np.asarray(temperature_c, dtype=float), (self._n_modules,))
+        self._temperature_k = self._temperature_c + 273.15 # convert temperature unit C to K
+        self._solar_irr = np.broadcast_to(np.asarray(solar_irr, dtype=float), (self._n_modules,))
+
+        self._update_working_parameters()
+
+        return self._output(self._a), self._output(self._i_o), self._output(self._i_ph),\
+            self._output(self._r_s), self._output(self._r_sh)
+
+    def _output(self, x):
+        # Return scalars if the inputs were scalars.
+        if self._scalar:
+            return x[0].item() if x.ndim == 1 else x[0]
+        return x
+
+    def get_mismatch(self):
+        # The errors of the nonlinear equations at the solution, one row per module.
+        if not self._solved:
+            return None
+        mismatch, _ = self._nonlinear_equations(self._x, np.arange(self._n_modules))
+        return self._output(mismatch)
+
+    def get_solver_info(self):
+        # The numbers of iterations, the convergence flags and the largest mismatch of
+        # each module in the last extraction.
+        if not self._solved:
+            return None
+        solver_info = {
+            "n_iterations": self._output(self._n_iterations),
+            "converged": self._output(self._converged),
+            "mismatch": self._output(self._mismatch),
+        }
+        return solver_info
+
+    def get_stc_solution(self):
+        # The solution of the nonlinear equations, i.e. the parameters at STC, one array
+        # element per module.
+        if not self._solved:
+            return None
+
+        stc_solution = {
+            "a": self._output(self._a),
+            "i_o_stc": self._output(self._i_o_stc),
+            "r_s": self._output(self._r_s),
+        }
+        return stc_solution
+
+    def get_solution(self):
+        # The extracted parameters, one array element per module.
+        if not self._solved:
+            return None
+
+        solution = {
+            "a": self._output(self._a),
+            "i_o": self._output(self._i_o),
+            "i_ph": self._output(self._i_ph),
+            "r_s": self._output(self._r_s),
+            "r_sh": self._output(self._r_sh),
+        }
+        return solution
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+
+    # Extract a catalog of modules around the default module.
+    n_modules = 100000
+    rng = np.random.default_rng(0)
+    scale = rng.uniform(0.8, 1.2, n_modules)
+    batch_extractor = PV_Module_Batch_Extractor(v_oc_stc=44.9 * scale, i_sc_stc=8.53 * scale,
+        v_mp=36.1 * scale, i_mp=8.04 * scale, di_dv_oc=-2.05 / scale)
+    start_time = time.perf_counter()
+    a, i_o, i_ph, r_s, r_sh = batch_extractor.extract()
+    elapsed_time = time.perf_counter() - start_time
+    print("")
+    print("Extracted " + str(n_modules) + " modules in " + "{:.3f}".format(elapsed_time) + " s.")
+    print("converged: " + str(batch_extractor.get_solver_info()["converged"].sum()))
+    print("max |mismatch| = " + str(np.abs(batch_extractor.get_mismatch()).max()))
+
+    # Compare the precision tiers.
+    print("{:<10}{:>10}{:>12}{:>16}{:>20}".format("tier", "time (s)", "converged", "iterations", "median mismatch"))
+    for precision in ["fast", "standard", "strict"]:
+        start_time = time.perf_counter()
+        batch_extractor.extract(precision=precision)
+        elapsed_time = time.perf_counter() - start_time
+        solver_info = batch_extractor.get_solver_info()
+        print("{:<10}{:>10.3f}{:>12}{:>16}{:>20.3e}".format(precision, elapsed_time, solver_info["converged"].sum(),
+            solver_info["n_iterations"].sum(), np.median(solver_info["mismatch"])))
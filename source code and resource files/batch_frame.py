@@ -0,0 +1,290 @@
+# Define the frame class of the batch tab in the main window.
+#
+# The batch tab loads many case files (saved by the main window) at once and
+# extracts the parameters of all cases in the background, using a pool of
+# worker threads that each solve a chunk of cases with the vectorized batch
+# extractor. The main window only polls the workers' progress, so it stays
+# responsive.
+#
+# The results are shown in a virtualized table: the Treeview only holds as
+# many rows as are visible, and scrolling changes the values shown in these
+# rows instead of creating one Treeview item per case. So the table is as fast
+# with thousands of cases as with ten.
+
+import tkinter as tk
+import tkinter.ttk as ttk
+from tkinter import filedialog
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+from os import getcwd
+
+class BatchFrame(tk.Frame):
+    def __init__(self, master, main_window, **kwargs):
+        super().__init__(master, **kwargs)
+        self.main_window = main_window
+
+        # The loaded cases. Each case is a dictionary with the file name, the input
+        # (None if the case file is not valid), the status and the results.
+        self.cases = []
+        self.chunk_size = 512 # the number of cases solved by a worker at a time
+        self.executor = None
+        self.futures = []
+        self.future_indices = [] # the case indices of each extraction future
+
+        # The columns of the result table.
+        self.columns = ["file", "status", "i_ph", "a", "i_o", "r_s", "r_sh", "mismatch"]
+        self.column_texts = {
+            "file": "Case file",
+            "status": "Status",
+            "i_ph": "I_L (A)",
+            "a": "a",
+            "i_o": "I_o (A)",
+            "r_s": "R_s (Ω)",
+            "r_sh": "R_sh (Ω)",
+            "mismatch": "Max mismatch",
+        }
+        self.column_widths = {"file": 180, "status": 90, "mismatch": 90}
+
+        # The index of the first case shown in the table.
+        self.first_row = 0
+        # The Treeview items, one per visible row.
+        self.row_items = []
+
+        self.buttons = {}
+        self.create_widgets()
+
+    def create_widgets(self):
+        # The buttons at the top.
+        self.button_frame = tk.Frame(self)
+        self.button_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.buttons["load"] = ttk.Button(self.button_frame, text="Load Case Files", command=self.load_case_files)
+        self.buttons["load"].pack(side=tk.LEFT, padx=1)
+        self.buttons["extract"] = ttk.Button(self.button_frame, text="Extract All", command=self.extract_all)
+        self.buttons["extract"].pack(side=tk.LEFT, padx=1)
+        self.buttons["clear"] = ttk.Button(self.button_frame, text="Clear", command=self.clear_cases)
+        self.buttons["clear"].pack(side=tk.LEFT, padx=1)
+        self.case_count = tk.StringVar()
+        self.case_count.set("No cases loaded.")
+        self.case_count_label = tk.Label(self.button_frame, textvariable=self.case_count, anchor=tk.E)
+        self.case_count_label.pack(side=tk.RIGHT, padx=1)
+
+        # The virtualized result table. The scroll bar is not connected to the
+        # Treeview, it moves the window of cases that is shown in the rows.
+        self.table_frame = tk.Frame(self)
+        self.table_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=1, padx=5, pady=(0, 5))
+        self.tree = ttk.Treeview(self.table_frame, columns=self.columns, show="headings", selectmode="none")
+        for column in self.columns:
+            self.tree.heading(column, text=self.column_texts[column])
+            self.tree.column(column, width=self.column_widths.get(column, 70), stretch=(column == "file"))
+        self.scrollbar = ttk.Scrollbar(self.table_frame, orient=tk.VERTICAL, command=self.scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=1)
+
+        self.tree.bind("<Configure>", self.resize_table)
+        self.tree.bind("<MouseWheel>", self.mouse_wheel)
+        self.tree.bind("<Button-4>", lambda event: self.scroll("scroll", -3, "units"))
+        self.tree.bind("<Button-5>", lambda event: self.scroll("scroll", 3, "units"))
+
+    def visible_row_count(self):
+        return len(self.row_items)
+
+    def resize_table(self, event=None):
+        # Create or delete Treeview items so that there is one item per visible row.
+        row_height = ttk.Style().lookup("Treeview", "rowheight")
+        row_height = int(row_height) if row_height else 20
+        heading_height = 25
+        n_rows = max(1, (self.tree.winfo_height() - heading_height) // row_height)
+        while len(self.row_items) < n_rows:
+            self.row_items.append(self.tree.insert("", tk.END, values=[""] * len(self.columns)))
+        while len(self.row_items) > n_rows:
+            self.tree.delete(self.row_items.pop())
+        self.refresh_table()
+
+    def scroll(self, *args):
+        # Called by the scroll bar and the mouse wheel.
+        n_cases = len(self.cases)
+        n_rows = self.visible_row_count()
+        if args[0] == "moveto":
+            self.first_row = int(float(args[1]) * n_cases)
+        elif args[0] == "scroll":
+            step = int(args[1]) * (n_rows if args[2] == "pages" else 1)
+            self.first_row += step
+        self.first_row = max(0, min(self.first_row, n_cases - n_rows))
+        self.refresh_table()
+
+    def mouse_wheel(self, event):
+        self.scroll("scroll", -3 if event.delta > 0 else 3, "units")
+
+    def format_row(self, case):
+        # The values of a case shown in a row of the table.
+        values = [case["file"], case["status"]]
+        results = case.get("results")
+        if results is None:
+            return values + [""] * (len(self.columns) - 2)
+        values.append("{0:.5f}".format(results["i_ph"]))
+        values.append("{0:.5f}".format(results["a"]))
+        values.append("{:.5e}".format(results["i_o"]))
+        values.append("{0:.5f}".format(results["r_s"]))
+        values.append("{0:.5f}".format(results["r_sh"]))
+        values.append("{:.4e}".format(results["mismatch"]))
+        return values
+
+    def refresh_table(self):
+        # Show the cases from first_row in the visible rows and update the scroll bar.
+        n_cases = len(self.cases)
+        for row, item in enumerate(self.row_items):
+            index = self.first_row + row
+            if index < n_cases:
+                self.tree.item(item, values=self.format_row(self.cases[index]))
+            else:
+                self.tree.item(item, values=[""] * len(self.columns))
+        if n_cases:
+            self.scrollbar.set(self.first_row / n_cases,
+                min(1.0, (self.first_row + self.visible_row_count()) / n_cases))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+        self.case_count.set(str(n_cases) + " cases loaded." if n_cases else "No cases loaded.")
+
+    def read_case_file(self, file_name):
+        # Read one case file. Returns the case dictionary.
+        case = {"file": os.path.basename(file_name), "input": None, "status": "Invalid file"}
+        try:
+            with open(file_name, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return case
+        if data.get("file type") != "solar panel circuit model parameters":
+            return case
+        try:
+            case["input"] = {item: float(data[item]) for item in self.main_window.all_input_items}
+            case["status"] = "Loaded"
+        except (KeyError, ValueError):
+            case["status"] = "Invalid input"
+        return case
+
+    def read_case_files(self, file_names):
+        return [self.read_case_file(file_name) for file_name in file_names]
+
+    def get_executor(self):
+        # The pool of worker threads, created at the first use.
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+        return self.executor
+
+    def set_busy(self, busy):
+        state = "disable" if busy else "enable"
+        for button in self.buttons.values():
+            button.configure(state=state)
+
+    def load_case_files(self):
+        # Ask for the case files and read them in the worker threads.
+        file_names = filedialog.askopenfilenames(initialdir = getcwd(), title = "Open case files",
+            filetypes=self.main_window.osftypes)
+        if not file_names:
+            return
+        self.set_busy(True)
+        self.main_window.set_execution_state("Loading " + str(len(file_names)) + " case files...")
+        self.futures = [self.get_executor().submit(self.read_case_files, file_names[start:start + self.chunk_size])
+            for start in range(0, len(file_names), self.chunk_size)]
+        self.after(100, self.poll_loading)
+
+    def poll_loading(self):
+        # Add the cases when all files are read, to keep the order of the files.
+        if not all(future.done() for future in self.futures):
+            self.after(100, self.poll_loading)
+            return
+        for future in self.futures:
+            self.cases.extend(future.result())
+        self.futures = []
+        self.refresh_table()
+        self.set_busy(False)
+        self.main_window.set_execution_state("Ready...")
+
+    def clear_cases(self):
+        self.cases = []
+        self.first_row = 0
+        self.refresh_table()
+
+    def extract_chunk(self, indices):
+        # Extract the parameters of a chunk of cases with the batch extractor.
+        # Run by a worker thread. Each worker only writes the results of its own cases.
+        import numpy as np
+        from batch_extractor import PV_Module_Batch_Extractor
+
+        inputs = {item: np.array([self.cases[index]["input"][item] for index in indices])
+            for item in self.main_window.all_input_items}
+        a_init = inputs.pop("a_init")
+        r_s_init = inputs.pop("r_s_init")
+        batch_extractor = PV_Module_Batch_Extractor(**inputs)
+        batch_extractor.extract(a_init, r_s_init)
+        solution = batch_extractor.get_solution()
+        mismatch = np.abs(batch_extractor.get_mismatch()).max(axis=1)
+        converged = batch_extractor.get_solver_info()["converged"]
+
+        # Each case is replaced by a complete new one in a single assignment, so the main
+        # thread never sees results without their mismatch or status.
+        for row, index in enumerate(indices):
+            results = {item: float(solution[item][row]) for item in solution}
+            results["mismatch"] = float(mismatch[row])
+            status = "Extracted" if converged[row] else "Not converged"
+            self.cases[index] = dict(self.cases[index], results=results, status=status)
+        return len(indices)
+
+    def extract_all(self):
+        # Start extracting all valid cases in the worker threads.
+        indices = [index for index, case in enumerate(self.cases) if case["input"] is not None]
+        if not indices:
+            return
+        self.set_busy(True)
+        for index in indices:
+            self.cases[index]["status"] = "Queued"
+        self.n_queued = len(indices)
+        self.future_indices = [indices[start:start + self.chunk_size]
+            for start in range(0, len(indices), self.chunk_size)]
+        self.futures = [self.get_executor().submit(self.extract_chunk, chunk) for chunk in self.future_indices]
+        self.refresh_table()
+        self.after(100, self.poll_extraction)
+
+    def mark_failed_chunks(self):
+        # Mark the cases of the chunks whose worker raised as failed, with the exception
+        # text in the status. Returns the number of failed cases and the first error text.
+        n_failed = 0
+        error = None
+        for future, indices in zip(self.futures, self.future_indices):
+            if not future.done() or future.exception() is None:
+                continue
+            exception = future.exception()
+            text = type(exception).__name__ + ": " + str(exception)
+            error = error or text
+            for index in indices:
+                if self.cases[index]["status"] == "Queued":
+                    self.cases[index] = dict(self.cases[index], results=None, status="Failed: " + text)
+            n_failed += len(indices)
+        return n_failed, error
+
+    def poll_extraction(self):
+        # Show the progress and the results that are ready.
+        n_extracted = sum(future.result() for future in self.futures if future.done() and future.exception() is None)
+        n_failed, error = self.mark_failed_chunks()
+        self.refresh_table()
+        if not all(future.done() for future in self.futures):
+            message = "Extracting parameters... " + str(n_extracted) + " of " + str(self.n_queued) + " cases finished."
+            if n_failed:
+                message += " " + str(n_failed) + " cases failed (" + error + ")."
+            self.main_window.set_execution_state(message)
+            self.after(100, self.poll_extraction)
+            return
+        self.futures = []
+        self.future_indices = []
+        self.set_busy(False)
+        message = "Batch extraction finished for " + str(n_extracted) + " cases."
+        if n_failed:
+            message += " " + str(n_failed) + " cases failed (" + error + ")."
+        self.main_window.set_execution_state(message + " Ready for extracting again...")
+
+    def shut_down(self):
+        # Stop the worker threads when the main window is closed.
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,96 @@
+# The batch nonlinear solver.
+#
+# Scipy's solvers work on one problem at a time, and calling them once per
+# PV module (or per measured curve) spends most of the time in the Python
+# overhead instead of in the calculation. Here, many small independent
+# problems of the same form are solved together using numpy arrays, so that
+# every step of the solver is one vectorized operation for the whole batch.
+#
+# The method is Levenberg-Marquardt with one damping factor per problem.
+# It solves nonlinear least squares problems (more residuals than unknowns)
+# and, as a special case, square nonlinear equation systems, where it works
+# as a damped Newton method. Each problem stops independently when it
+# converges, so the easy problems do not wait for the hard ones.
+#
+# The caller provides a function that returns the residuals and their
+# analytic Jacobian for a subset of the problems.
+
+
+import numpy as np
+
+def solve_batch(fun, x0, xtol=1e-12, ftol=1e-15, max_iter=100, lambda_init=1e-3, residual_tol=0.0):
+    # fun(x, index) returns (r, J) for the problems in the integer array index, where
+    #   x has shape (len(index), n_unknowns),
+    #   r has shape (len(index), n_residuals),
+    #   J has shape (len(index), n_residuals, n_unknowns).
+    # Padded residuals, if any, must be returned as 0 with zero Jacobian rows.
+    # A problem also stops as soon as all its residuals are at most residual_tol.
+    #
+    # Returns a dictionary with the solution x, the final cost (the sum of the
+    # squared residuals) of each problem, a converged flag and the number of
+    # iterations used by each problem.
+    x = np.array(x0, dtype=float)
+    if x.ndim == 1:
+        x = x.reshape(1, -1)
+    n_problems, n_unknowns = x.shape
+
+    damping = np.full(n_problems, lambda_init)
+    cost = np.full(n_problems, np.inf)
+    converged = np.zeros(n_problems, dtype=bool)
+    n_iterations = np.zeros(n_problems, dtype=int)
+    eye = np.eye(n_unknowns)
+
+    # The residuals and the Jacobian at the current point of each active problem.
+    active = np.arange(n_problems)
+    r, jacobian = fun(x[active], active)
+    cost[active] = np.sum(r**2, axis=1)
+
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        n_iterations[active] += 1
+
+        # Solve the damped normal equations of all active problems at once.
+        jtj = np.einsum("nmi,nmj->nij", jacobian, jacobian)
+        gradient = np.einsum("nmi,nm->ni", jacobian, r)
+        diagonal = np.maximum(np.einsum("nii->ni", jtj), 1e-300)
+        lhs = jtj + damping[active, None, None] * diagonal[:, :, None] * eye
+        try:
+            step = -np.linalg.solve(lhs, gradient[:, :, None])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = -np.stack([np.linalg.lstsq(m, g, rcond=None)[0] for m, g in zip(lhs, gradient)])
+
+        x_new = x[active] + step
+        r_new, jacobian_new = fun(x_new, active)
+        cost_new = np.sum(r_new**2, axis=1)
+
+        # Accept the steps that reduce the cost and update the damping factors.
+        accepted = np.isfinite(cost_new) & (cost_new <= cost[active])
+        cost_reduction = cost[active] - np.where(accepted, cost_new, cost[active])
+        damping[active] = np.where(accepted, damping[active] / 3.0, damping[active] * 2.0)
+
+        x[active[accepted]] = x_new[accepted]
+        r = np.where(accepted[:, None], r_new, r)
+        jacobian = np.where(accepted[:, None, None], jacobian_new, jacobian)
+        cost[active[accepted]] = cost_new[accepted]
+
+        # Convergence tests, the same form as MINPACK's xtol and ftol tests.
+        step_small = np.linalg.norm(step, axis=1) <= xtol * (np.linalg.norm(x[active], axis=1) + xtol)
+        cost_small = accepted & (cost_reduction <= ftol * np.maximum(cost[active], 1e-300))
+        exact = (cost[active] == 0.0) | (np.max(np.abs(r), axis=1) <= residual_tol)
+        stalled = damping[active] > 1e16
+        done = (accepted & step_small) | cost_small | exact
+        converged[active[done]] = True
+        keep = ~(done | stalled)
+
+        active = active[keep]
+        r = r[keep]
+        jacobian = jacobian[keep]
+
+    solution = {
+        "x": x,
+        "cost": cost,
+        "converged": converged,
+        "n_iterations": n_iterations,
+    }
+    return solution
@@ -0,0 +1,74 @@
+# Benchmark of the linear and the log formulations of the nonlinear equations.
+#
+# A synthetic catalog of data sheets is made by scaling the default module's
+# data randomly, and every data sheet is extracted from random initial values
+# (as in batch runs where the initial values do not suit every module) with
+# both formulations. The numbers of function calls, the failed solves
+# (overflow, no convergence or a large mismatch) and the wall time are
+# reported for each formulation.
+#
+# Usage: python benchmark_log_formulation.py [number of data sheets] [seed]
+
+
+import sys
+import time
+import numpy as np
+from pvmmpe import PV_Module_Model_Parameter_Extractor
+
+def make_catalog(n_modules, rng):
+    # Random data sheets around the default module, with random initial values.
+    voltage_scale = rng.uniform(0.5, 1.5, n_modules)
+    current_scale = rng.uniform(0.5, 1.5, n_modules)
+    catalog = []
+    for row in range(n_modules):
+        catalog.append({
+            "v_oc_stc": 44.9 * voltage_scale[row],
+            "i_sc_stc": 8.53 * current_scale[row],
+            "v_mp": 36.1 * voltage_scale[row] * rng.uniform(0.97, 1.0),
+            "i_mp": 8.04 * current_scale[row] * rng.uniform(0.97, 1.0),
+            "n_cell": int(rng.choice([60, 72, 96])),
+            "di_dv_sc": -2.488e-3 * rng.uniform(0.2, 5.0),
+            "di_dv_oc": -2.05 * current_scale[row] / voltage_scale[row] * rng.uniform(0.8, 1.2),
+            "a_init": rng.uniform(0.3, 3.0),
+            "r_s_init": rng.uniform(0.0, 1.0),
+        })
+    return catalog
+
+def run(catalog, formulation, mismatch_tolerance=1e-6):
+    # Extract the catalog with one formulation and collect the statistics.
+    n_function_calls = 0
+    n_failed = 0
+    start_time = time.perf_counter()
+    for datasheet in catalog:
+        inputs = dict(datasheet)
+        a_init = inputs.pop("a_init")
+        r_s_init = inputs.pop("r_s_init")
+        parameter_extracter = PV_Module_Model_Parameter_Extractor(**inputs)
+        try:
+            parameter_extracter.extract(a_init, r_s_init, formulation=formulation)
+        except (OverflowError, ValueError, ZeroDivisionError) as error:
+            # The linear formulation overflows math.exp for bad initial values. The calls
+            # made before the error are counted too.
+            n_function_calls += getattr(error, "n_function_calls", 0)
+            n_failed += 1
+            continue
+        solver_info = parameter_extracter.get_solver_info()
+        n_function_calls += solver_info["n_function_calls"]
+        # The mismatch is the largest absolute error of the three linear equations (inf on
+        # overflow), relative to I_sc.
+        if not solver_info["converged"] or not solver_info["mismatch"] <= mismatch_tolerance * inputs["i_sc_stc"]:
+            n_failed += 1
+    elapsed_time = time.perf_counter() - start_time
+    return n_function_calls, n_failed, elapsed_time
+
+
+if __name__ == "__main__":
+    n_modules = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    catalog = make_catalog(n_modules, np.random.default_rng(seed))
+
+    print("Synthetic catalog of " + str(n_modules) + " data sheets with random initial values.")
+    print("{:<12}{:>16}{:>10}{:>10}".format("formulation", "function calls", "failed", "time (s)"))
+    for formulation in ["linear", "log"]:
+        n_function_calls, n_failed, elapsed_time = run(catalog, formulation)
+        print("{:<12}{:>16}{:>10}{:>10.2f}".format(formulation, n_function_calls, n_failed, elapsed_time))
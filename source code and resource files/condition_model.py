@@ -0,0 +1,185 @@
+# The PV module extended condition model class.
+#
+# The extractors solve the nonlinear equations at STC only and move the
+# parameters to other operating conditions in closed form: i_ph scales with
+# the irradiance and the I_sc temperature coefficient, i_o follows the V_oc
+# temperature coefficient, and r_s and r_sh are fixed.
+#
+# The instance of this class adds the usual physical corrections of the
+# single-diode model without any further solve:
+#   - i_o follows the temperature dependence of the diode's saturation
+#     current, i_o ~ T^3 * exp(-q*E_g(T)/(a*k*T)) (as in Villalva et al.,
+#     2009), with the bandgap E_g(T) = E_g_stc * (1 + d_band_gap_dt * (T - T_stc))
+#     (as in De Soto et al., 2006),
+#   - r_sh is inversely proportional to the irradiance (De Soto et al.),
+#   - optionally, r_s changes linearly with the temperature.
+#
+# All of it is folded into a few coefficients per module when the instance is
+# made, so an evaluation is one exp() and one log() per module and condition,
+# about the cost of the extractors' update_conditions(). The conditions are
+# broadcast against the modules along the last axis: temperatures and
+# irradiances with one element per module give one condition per module, and
+# e.g. arrays of shape (n_conditions, 1) give a sweep of every module over
+# all conditions, of shape (n_conditions, n_modules).
+
+
+import numpy as np
+from iv_curve import maximum_power_point
+
+class PV_Module_Condition_Model:
+
+    def __init__(self, a, i_o_stc, r_s, r_sh, i_sc_stc, temp_coeff_i_perc, n_cell,
+        band_gap=1.121, d_band_gap_dt=-0.0002677, temp_coeff_r_s_perc=0.0, irradiance_r_sh=True):
+        # a, i_o_stc, r_s and r_sh are the STC solutions of the modules (e.g. from
+        # get_stc_solution() of an extractor), as arrays with one element per module or
+        # scalars. i_sc_stc, temp_coeff_i_perc and n_cell are the data sheet values of the
+        # same modules, they have no defaults so that every module is modelled with its own
+        # data sheet. band_gap is the bandgap at STC in eV (1.121 for crystalline silicon) and
+        # d_band_gap_dt its relative temperature coefficient in 1/K. temp_coeff_r_s_perc is
+        # the temperature coefficient of r_s in %/C (0 keeps r_s fixed). If irradiance_r_sh
+        # is False, r_sh is kept fixed.
+
+        # Some physical constants:
+        q = 1.6e-19 # the charge of an electron in SI unit
+        k = 1.38e-23 # Boltzmann constant in SI unit
+        stc_temp_k = 25.0 + 273.15 # STC condition temperature with unit K
+        stc_solar_irr = 1000 # STC condition solar irradiation with unit W/(m^2)
+
+        (a, i_o_stc, r_s, r_sh, i_sc_stc, temp_coeff_i, n_cell, band_gap, d_band_gap_dt,
+            temp_coeff_r_s) = np.broadcast_arrays(*[np.atleast_1d(np.asarray(item, dtype=float)) for item in
+            [a, i_o_stc, r_s, r_sh, i_sc_stc, temp_coeff_i_perc / np.float64(100), n_cell, band_gap,
+            d_band_gap_dt, temp_coeff_r_s_perc / np.float64(100)]])
+        self._n_modules = a.size
+        self._a = a.ravel()
+
+        # v_t = v_t_coeff * T (T in K).
+        self._v_t_coeff = (n_cell * k / q).ravel()
+        # i_ph = G * (i_ph_0 + i_ph_1 * T) (T in C), from the I_sc temperature coefficient.
+        self._i_ph_1 = (i_sc_stc * temp_coeff_i / stc_solar_irr).ravel()
+        self._i_ph_0 = (i_sc_stc / stc_solar_irr).ravel() - 25.0 * self._i_ph_1
+        # log(i_o) = log_i_o_0 + 3*log(T) - band_gap_t / T (T in K). With the linear bandgap,
+        # E_g(T)/(a*k*T) = E_g_stc*(1 - d*T_stc)/(a*k*T) + E_g_stc*d/(a*k), so the constant
+        # part goes into log_i_o_0.
+        band_gap_t = band_gap * q / (a * k) # q*E_g_stc/(a*k) in K
+        self._band_gap_t = (band_gap_t * (1 - d_band_gap_dt * stc_temp_k)).ravel()
+        self._log_i_o_0 = (np.log(i_o_stc) - 3 * np.log(stc_temp_k) + band_gap_t / stc_temp_k
+            - band_gap_t * d_band_gap_dt).ravel()
+        # r_s = r_s_0 + r_s_1 * T (T in C).
+        self._r_s_1 = (r_s * temp_coeff_r_s).ravel()
+        self._r_s_0 = r_s.ravel() - 25.0 * self._r_s_1
+        self._fixed_r_s = not np.any(self._r_s_1)
+        # r_sh = 1 / (g_sh * G), or r_sh fixed.
+        self._irradiance_r_sh = irradiance_r_sh
+        self._r_sh = r_sh.ravel()
+        self._g_sh = 1 / (self._r_sh * stc_solar_irr)
+
+    def get_n_modules(self):
+        return self._n_modules
+
+    def update_conditions(self, temperature_c, solar_irr):
+        # The parameters of the modules at the conditions (see above for the shapes).
+        # Returns a dictionary with the arrays a, i_o, i_ph, r_s, r_sh and v_t.
+        temperature_c = np.asarray(temperature_c, dtype=float)
+        solar_irr = np.asarray(solar_irr, dtype=float)
+        temperature_k = temperature_c + 273.15 # convert temperature unit C to K
+        shape = np.broadcast_shapes(temperature_c.shape, solar_irr.shape, (self._n_modules,))
+
+        i_o = np.exp(self._log_i_o_0 + 3 * np.log(temperature_k) - self._band_gap_t / temperature_k)
+        i_ph = solar_irr * (self._i_ph_0 + self._i_ph_1 * temperature_c)
+        if self._fixed_r_s:
+            r_s = self._r_s_0 + self._r_s_1 * 25.0
+        else:
+            r_s = self._r_s_0 + self._r_s_1 * temperature_c
+        if self._irradiance_r_sh:
+            with np.errstate(divide="ignore"):
+                r_sh = 1 / (self._g_sh * solar_irr) # no light: no shunt current
+        else:
+            r_sh = self._r_sh
+        broadcast = lambda x: np.broadcast_to(x, shape)
+        return {
+            "a": broadcast(self._a),
+            "i_o": broadcast(i_o),
+            "i_ph": broadcast(i_ph),
+            "r_s": broadcast(r_s),
+            "r_sh": broadcast(r_sh),
+            "v_t": broadcast(self._v_t_coeff * temperature_k),
+        }
+
+    def maximum_power_point(self, temperature_c, solar_irr):
+        # The maximum power point of the modules at the conditions. Returns the arrays v_mp,
+        # i_mp and p_mp, of the shape of the broadcast conditions and modules.
+        parameters = self.update_conditions(temperature_c, solar_irr)
+        shape = parameters["a"].shape
+        parameters = {item: values.ravel() for item, values in parameters.items()}
+        v_mp = np.zeros(parameters["a"].size)
+        i_mp = np.zeros(parameters["a"].size)
+        lit = parameters["i_ph"] > 0 # no power without light
+        if np.any(lit):
+            v_mp[lit], i_mp[lit] = maximum_power_point(
+                *[parameters[item][lit] for item in ["a", "i_o", "i_ph", "r_s", "r_sh", "v_t"]])
+        v_mp, i_mp = v_mp.reshape(shape), i_mp.reshape(shape)
+        return v_mp, i_mp, v_mp * i_mp
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+    from batch_extractor import PV_Module_Batch_Extractor
+    from iv_curve import open_circuit_voltage
+    from pvmmpe import PV_Module_Model_Parameter_Extractor
+
+    n_modules = 100000
+    rng = np.random.default_rng(0)
+    scale = rng.uniform(0.8, 1.2, n_modules)
+    i_sc_stc = 8.53 * scale
+    batch_extractor = PV_Module_Batch_Extractor(v_oc_stc=44.9 * scale, i_sc_stc=i_sc_stc,
+        v_mp=36.1 * scale, i_mp=8.04 * scale, di_dv_oc=-2.05 / scale)
+    batch_extractor.extract()
+    stc_solution = batch_extractor.get_stc_solution()
+    condition_model = PV_Module_Condition_Model(r_sh=batch_extractor.get_solution()["r_sh"], i_sc_stc=i_sc_stc,
+        temp_coeff_i_perc=0.046, n_cell=72, temp_coeff_r_s_perc=0.2, **stc_solution)
+
+    # At STC, the model gives the STC solution.
+    parameters = condition_model.update_conditions(25.0, 1000.0)
+    print("max relative difference from the extractor at STC: " + str(max(
+        np.max(np.abs(parameters[item] / batch_extractor.get_solution()[item] - 1))
+        for item in ["a", "i_o", "i_ph", "r_s", "r_sh"])))
+
+    # One condition per module, compared with the extractor's closed-form update.
+    temperature_c = rng.uniform(0.0, 70.0, n_modules)
+    solar_irr = rng.uniform(100.0, 1100.0, n_modules)
+    start_time = time.perf_counter()
+    batch_extractor.update_conditions(temperature_c, solar_irr)
+    update_time = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    parameters = condition_model.update_conditions(temperature_c, solar_irr)
+    model_time = time.perf_counter() - start_time
+    print("one condition per module: update_conditions() " + "{:.4f}".format(update_time)
+        + " s, condition model " + "{:.4f}".format(model_time) + " s")
+    # The V_oc temperature coefficient implied by the bandgap model for the default module
+    # of the single module extractor (data sheet: -0.33 %/C).
+    parameter_extracter = PV_Module_Model_Parameter_Extractor()
+    parameter_extracter.extract()
+    datasheet = parameter_extracter.get_datasheet()
+    single_model = PV_Module_Condition_Model(r_sh=parameter_extracter.get_solution()["r_sh"],
+        i_sc_stc=datasheet["i_sc_stc"], temp_coeff_i_perc=datasheet["temp_coeff_i_perc"],
+        n_cell=datasheet["n_cell"], **parameter_extracter.get_stc_solution())
+    v_oc = [open_circuit_voltage(*[parameters[item] for item in ["a", "i_o", "i_ph", "r_s", "r_sh", "v_t"]])[0]
+        for parameters in [single_model.update_conditions(t, 1000.0) for t in [24.5, 25.5]]]
+    print("V_oc temperature coefficient: " + "{:.4f}".format((v_oc[1] - v_oc[0]) / v_oc[0] * 100) + " %/C")
+
+    # A sweep of every module over a grid of 24 conditions.
+    grid_temperature_c, grid_solar_irr = np.meshgrid([10.0, 25.0, 40.0, 55.0], [200, 400, 600, 800, 1000, 1200])
+    start_time = time.perf_counter()
+    parameters = condition_model.update_conditions(grid_temperature_c.reshape(-1, 1), grid_solar_irr.reshape(-1, 1))
+    sweep_time = time.perf_counter() - start_time
+    print("sweep of " + str(parameters["i_o"].shape[1]) + " modules over " + str(parameters["i_o"].shape[0])
+        + " conditions: " + "{:.3f}".format(sweep_time) + " s")
+
+    # The maximum power of the first module over the grid.
+    v_mp, i_mp, p_mp = condition_model.maximum_power_point(grid_temperature_c.reshape(-1, 1),
+        grid_solar_irr.reshape(-1, 1))
+    p_mp = p_mp[:, 0].reshape(grid_temperature_c.shape)
+    print("P_mp (W) of module 0" + "".join("{:>10}".format(str(t) + " C") for t in grid_temperature_c[0]))
+    for row, irradiance in enumerate(grid_solar_irr[:, 0]):
+        print("{:>10} W/m^2".format(irradiance) + "    " + "".join("{:>10.1f}".format(p) for p in p_mp[row]))
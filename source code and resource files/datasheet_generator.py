@@ -0,0 +1,185 @@
+# The synthetic data sheet generator class.
+#
+# To check the accuracy and the speed of the extractors at scale, the
+# instance of this class makes any number of realistic data sheets with known
+# true parameters. The physical parameters of each module (a, i_o, i_ph, r_s,
+# r_sh and the number of cells) are sampled first, and the data sheet
+# quantities are calculated from them exactly with the single-diode model:
+# the open circuit voltage, the short circuit current, the maximum power
+# point and the slopes dI/dV at both ends of the curve,
+#   dI/dV = -g / (1 + g*r_s),  g = i_o*exp((v + i*r_s)/(a*v_t))/(a*v_t) + 1/r_sh.
+#
+# Everything is calculated for a chunk of modules at a time with numpy, and
+# the chunks are written to a CSV file one after another, so the memory use
+# does not depend on the number of data sheets. The file holds the data sheet
+# inputs of the extractors and the true parameters, so it can drive
+# accuracy-versus-speed regression checks (see regression_check()).
+#
+# Usage: python datasheet_generator.py [output file] [number of data sheets] [seed]
+# Without an output file, the data sheets are written to a new temporary
+# directory.
+
+
+import sys
+import time
+import numpy as np
+from itertools import islice
+from iv_curve import thermal_voltage, open_circuit_voltage, current_at_voltage, maximum_power_point
+
+class SyntheticDatasheetGenerator:
+
+    def __init__(self, seed=0, chunk_size=100000):
+        self._rng = np.random.default_rng(seed)
+        self._chunk_size = chunk_size # the number of data sheets made at a time
+
+        # The data sheet inputs of the extractors and the true parameters, in file order.
+        self.datasheet_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc",
+            "temp_coeff_v_perc", "n_cell", "di_dv_sc", "di_dv_oc"]
+        self.parameter_items = ["a", "i_o", "i_ph", "r_s", "r_sh"]
+        self.columns = self.datasheet_items + ["true_" + item for item in self.parameter_items]
+
+    def sample_parameters(self, n_modules):
+        # Sample the physical parameters of n_modules modules. The saturation current is
+        # derived from a sampled open circuit voltage per cell, so that the data sheets
+        # look like real crystalline silicon modules.
+        rng = self._rng
+        n_cell = rng.choice([36, 60, 72, 96, 120, 144], n_modules).astype(float)
+        a = rng.uniform(1.0, 1.5, n_modules)
+        i_ph = rng.uniform(4.0, 12.0, n_modules)
+        v_oc_cell = rng.uniform(0.6, 0.72, n_modules)
+        v_t = thermal_voltage(25, n_cell)
+        i_o = i_ph / np.expm1(n_cell * v_oc_cell / (a * v_t))
+        r_s = n_cell * rng.uniform(0.002, 0.008, n_modules)
+        r_sh = n_cell / 72 * 10**rng.uniform(2.0, 3.5, n_modules)
+        return {
+            "a": a,
+            "i_o": i_o,
+            "i_ph": i_ph,
+            "r_s": r_s,
+            "r_sh": r_sh,
+            "n_cell": n_cell,
+            "temp_coeff_i_perc": rng.uniform(0.03, 0.07, n_modules),
+            "temp_coeff_v_perc": rng.uniform(-0.40, -0.25, n_modules),
+        }
+
+    def _slope(self, v_d, a_v_t, i_o, r_s, r_sh):
+        # dI/dV of the curve at the diode voltage v_d = v + i*r_s.
+        g = i_o * np.exp(v_d / a_v_t) / a_v_t + 1 / r_sh
+        return -g / (1 + g * r_s)
+
+    def make_datasheets(self, parameters):
+        # Calculate the data sheet quantities at STC from the physical parameters.
+        a, i_o, i_ph, r_s, r_sh = [parameters[item] for item in self.parameter_items]
+        v_t = thermal_voltage(25, parameters["n_cell"])
+        a_v_t = a * v_t
+
+        v_oc = open_circuit_voltage(a, i_o, i_ph, r_s, r_sh, v_t)
+        i_sc = current_at_voltage(0.0, a, i_o, i_ph, r_s, r_sh, v_t)
+        v_mp, i_mp = maximum_power_point(a, i_o, i_ph, r_s, r_sh, v_t, v_oc)
+
+        datasheets = {
+            "v_oc_stc": v_oc,
+            "i_sc_stc": i_sc,
+            "v_mp": v_mp,
+            "i_mp": i_mp,
+            "temp_coeff_i_perc": parameters["temp_coeff_i_perc"],
+            "temp_coeff_v_perc": parameters["temp_coeff_v_perc"],
+            "n_cell": parameters["n_cell"],
+            "di_dv_sc": self._slope(i_sc * r_s, a_v_t, i_o, r_s, r_sh),
+            "di_dv_oc": self._slope(v_oc, a_v_t, i_o, r_s, r_sh),
+        }
+        for item in self.parameter_items:
+            datasheets["true_" + item] = parameters[item]
+        return datasheets
+
+    def iter_chunks(self, n_modules):
+        # Yield the data sheets and true parameters of n_modules modules as dictionaries
+        # of arrays of at most chunk_size modules.
+        for start in range(0, n_modules, self._chunk_size):
+            parameters = self.sample_parameters(min(self._chunk_size, n_modules - start))
+            yield self.make_datasheets(parameters)
+
+    def write_csv(self, output_path, n_modules):
+        # Write n_modules data sheets to a CSV file, chunk by chunk.
+        with open(output_path, "w") as output_file:
+            output_file.write(",".join(self.columns) + "\n")
+            for chunk in self.iter_chunks(n_modules):
+                np.savetxt(output_file, np.column_stack([chunk[column] for column in self.columns]),
+                    delimiter=",", fmt="%.17g")
+                output_file.flush()
+
+    def read_csv_chunks(self, input_path):
+        # Read a file written by write_csv() back, as dictionaries of arrays of at most
+        # chunk_size modules.
+        with open(input_path, "r") as input_file:
+            columns = input_file.readline().strip().split(",")
+            while True:
+                lines = list(islice(input_file, self._chunk_size))
+                if not lines:
+                    return
+                rows = np.loadtxt(lines, delimiter=",", ndmin=2)
+                yield {column: rows[:, index] for index, column in enumerate(columns)}
+
+
+def regression_check(chunks, extractor_class=None, **extract_settings):
+    # Extract the data sheets of the chunks with a batch extractor and compare the
+    # solutions with the true parameters. Returns the number of modules, the wall time,
+    # the number of converged solves and the median and 95th percentile relative
+    # errors of each parameter.
+    if extractor_class is None:
+        from batch_extractor import PV_Module_Batch_Extractor
+        extractor_class = PV_Module_Batch_Extractor
+
+    parameter_items = ["a", "i_o", "i_ph", "r_s", "r_sh"]
+    relative_errors = {item: [] for item in parameter_items}
+    n_modules = 0
+    n_converged = 0
+    elapsed_time = 0.0
+    for chunk in chunks:
+        inputs = {item: value for item, value in chunk.items() if not item.startswith("true_")}
+        start_time = time.perf_counter()
+        batch_extractor = extractor_class(**inputs)
+        batch_extractor.extract(**extract_settings)
+        elapsed_time += time.perf_counter() - start_time
+
+        solution = batch_extractor.get_solution()
+        for item in parameter_items:
+            relative_errors[item].append(np.abs(solution[item] / chunk["true_" + item] - 1))
+        n_modules += len(chunk["true_a"])
+        n_converged += int(np.sum(batch_extractor.get_solver_info()["converged"]))
+
+    errors = {}
+    for item in parameter_items:
+        relative_error = np.concatenate(relative_errors[item])
+        errors[item] = (np.median(relative_error), np.percentile(relative_error, 95))
+    return {
+        "n_modules": n_modules,
+        "elapsed_time": elapsed_time,
+        "n_converged": n_converged,
+        "relative_errors": errors,
+    }
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+
+    if len(sys.argv) > 1:
+        output_path = sys.argv[1]
+    else:
+        output_path = os.path.join(tempfile.mkdtemp(), "synthetic_datasheets.csv")
+    n_modules = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    generator = SyntheticDatasheetGenerator(seed)
+    start_time = time.perf_counter()
+    generator.write_csv(output_path, n_modules)
+    print("Wrote " + str(n_modules) + " synthetic data sheets to " + output_path + " in "
+        + "{:.2f}".format(time.perf_counter() - start_time) + " s.")
+
+    result = regression_check(generator.read_csv_chunks(output_path))
+    print("Batch extractor: " + str(result["n_modules"]) + " modules in "
+        + "{:.2f}".format(result["elapsed_time"]) + " s, converged: " + str(result["n_converged"]))
+    print("{:<8}{:>16}{:>16}".format("", "median error", "95% error"))
+    for item, (median_error, percentile_error) in result["relative_errors"].items():
+        print("{:<8}{:>16.3e}{:>16.3e}".format(item, median_error, percentile_error))
@@ -0,0 +1,139 @@
+# The degradation tracker class.
+#
+# To follow the degradation of a PV module (e.g. the growth of the series
+# resistance or the drop of the shunt resistance), the model parameters are
+# extracted again for every period (e.g. every day) of the module's history.
+#
+# The parameters change slowly from one period to the next, so instead of
+# starting every extraction from the fixed default initial values, each
+# extraction is seeded with the solution of the previous period. This needs
+# far fewer solver iterations over a long history. If a warm-started
+# extraction does not converge, it is retried from the default initial values.
+#
+# Abrupt changes of the parameters between two periods (larger than the given
+# relative thresholds) are flagged, as they usually mean a failure, a repair
+# or a problem with the measurement rather than the normal degradation. i_o is
+# compared at STC, as its value at each period's own temperature changes
+# exponentially with the temperature.
+
+
+from pvmmpe import PV_Module_Model_Parameter_Extractor
+
+class DegradationTracker:
+
+    def __init__(self, jump_thresholds=None, a_init=1.3, r_s_init=0.3):
+        # The relative change between two periods above which a parameter is flagged.
+        self.jump_thresholds = {
+            "a": 0.05,
+            "i_o": 0.5,
+            "r_s": 0.1,
+            "r_sh": 0.2,
+        }
+        if jump_thresholds is not None:
+            self.jump_thresholds.update(jump_thresholds)
+
+        # The default initial values, used for the first period and for retries.
+        self._a_init = a_init
+        self._r_s_init = r_s_init
+
+        # The data sheet inputs read from each record of the history.
+        self._input_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc",
+            "temp_coeff_v_perc", "n_cell", "di_dv_sc", "di_dv_oc", "temperature_c", "solar_irr"]
+
+    def _extract_period(self, record, initial_values):
+        # Extract the parameters of one period, starting from initial_values if given.
+        inputs = {item: record[item] for item in self._input_items if item in record}
+        parameter_extracter = PV_Module_Model_Parameter_Extractor(**inputs)
+
+        n_function_calls = 0
+        warm_started = initial_values is not None
+        if warm_started:
+            parameter_extracter.extract(initial_values["a"], initial_values["r_s"],
+                initial_values["i_o_stc"])
+            n_function_calls += parameter_extracter.get_solver_info()["n_function_calls"]
+        if not warm_started or not parameter_extracter.get_solver_info()["converged"]:
+            parameter_extracter.extract(self._a_init, self._r_s_init)
+            n_function_calls += parameter_extracter.get_solver_info()["n_function_calls"]
+
+        return parameter_extracter, n_function_calls
+
+    def _find_jumps(self, solution, previous_solution):
+        # The parameters whose relative change from the previous period is too large. The
+        # solutions hold i_o at STC.
+        jumps = []
+        for item, threshold in self.jump_thresholds.items():
+            previous_value = previous_solution[item]
+            if previous_value != 0 and abs(solution[item] / previous_value - 1) > threshold:
+                jumps.append(item)
+        return jumps
+
+    def track(self, history, warm_start=True):
+        # Process the history of one module in time order. Each record of the history is
+        # a dictionary with a "timestamp" and the inputs of PV_Module_Model_Parameter_Extractor.
+        # Returns one result dictionary per record.
+        results = []
+        initial_values = None
+        previous_solution = None
+        for record in sorted(history, key=lambda record: record["timestamp"]):
+            parameter_extracter, n_function_calls = self._extract_period(record, initial_values)
+            solver_info = parameter_extracter.get_solver_info()
+            solution = parameter_extracter.get_solution()
+
+            result = {
+                "timestamp": record["timestamp"],
+                "n_function_calls": n_function_calls,
+                "converged": solver_info["converged"],
+                "jumps": [],
+            }
+            result.update(solution)
+            stc_solution = parameter_extracter.get_stc_solution()
+            result["i_o_stc"] = stc_solution["i_o_stc"]
+
+            if solver_info["converged"]:
+                # Compare i_o at STC, independent of the period's temperature.
+                compared_solution = dict(solution, i_o=stc_solution["i_o_stc"])
+                if previous_solution is not None:
+                    result["jumps"] = self._find_jumps(compared_solution, previous_solution)
+                previous_solution = compared_solution
+                # Seed the next period with this period's solution.
+                if warm_start:
+                    initial_values = stc_solution
+
+            results.append(result)
+
+        return results
+
+
+# Unit test.
+if __name__ == "__main__":
+    import math
+    import time
+
+    # A synthetic history of daily data sheet style measurements of a module whose
+    # series resistance grows slowly, with a sudden shunt failure after 3 years. The
+    # module temperature follows the seasons and changes from day to day.
+    n_days = 5 * 365
+    history = []
+    for day in range(n_days):
+        history.append({
+            "timestamp": day,
+            "v_oc_stc": 44.9 * (1 - 0.00001 * day),
+            "i_sc_stc": 8.53 * (1 - 0.00002 * day),
+            "v_mp": 36.1 * (1 - 0.00003 * day),
+            "i_mp": 8.04 * (1 - 0.00002 * day),
+            "di_dv_sc": -2.488e-3 if day < 3 * 365 else -5e-3,
+            "di_dv_oc": -2.05 * (1 - 0.0001 * day),
+            "temperature_c": 30 + 15 * math.sin(2 * math.pi * day / 365) + 10 * math.sin(day * 1.7),
+        })
+
+    degradation_tracker = DegradationTracker()
+    for warm_start in [False, True]:
+        start_time = time.perf_counter()
+        results = degradation_tracker.track(history, warm_start=warm_start)
+        elapsed_time = time.perf_counter() - start_time
+        print("")
+        print("warm start: " + str(warm_start))
+        print("total function calls = " + str(sum(result["n_function_calls"] for result in results)))
+        print("wall time = " + "{:.3f}".format(elapsed_time) + " s")
+        print("flagged periods: " + str([(result["timestamp"], result["jumps"]) for result in results if result["jumps"]]))
+        print("R_s from " + str(results[0]["r_s"]) + " to " + str(results[-1]["r_s"]))
@@ -3,7 +3,6 @@
 # Using the thread, one can avoid freezing the main window when 
 # the extraction is running as the extractor is possibly time consuming.
 
-from pvmmpe import PV_Module_Model_Parameter_Extractor
 import threading
 
 class ExtractorState():
@@ -23,28 +22,48 @@ class ExtractorState():
             # Update the state bar at the GUI's bottom part.
             self.extractor_state.main_window.set_execution_state("Extracting parameters...")
 
-            parameter_extracter = PV_Module_Model_Parameter_Extractor(
-                v_oc_stc=self.extractor_state.v_oc_stc, 
-                i_sc_stc=self.extractor_state.i_sc_stc, 
-                v_mp=self.extractor_state.v_mp, 
-                i_mp=self.extractor_state.i_mp, 
-                temp_coeff_i_perc=self.extractor_state.temp_coeff_i_perc, 
-                temp_coeff_v_perc=self.extractor_state.temp_coeff_v_perc, 
-                n_cell=self.extractor_state.n_cell, 
-                di_dv_sc=self.extractor_state.di_dv_sc, 
-                di_dv_oc=self.extractor_state.di_dv_oc,
-                temperature_c=self.extractor_state.temperature_c, 
-                solar_irr=self.extractor_state.solar_irr
-            )
-
-            parameter_extracter.extract(self.extractor_state.a_init, self.extractor_state.r_s_init)
+            # The extractor (and Scipy) is imported at the first extraction to
+            # make the GUI start faster.
+            from pvmmpe import PV_Module_Model_Parameter_Extractor
+
+            if self.extractor_state.only_conditions_changed():
+                # The STC inputs are the same as the last extraction, so the nonlinear
+                # equations are not solved again. Only the parameters that depend on the
+                # operating condition are recalculated.
+                parameter_extracter = self.extractor_state.parameter_extracter
+                parameter_extracter.update_conditions(self.extractor_state.temperature_c,
+                    self.extractor_state.solar_irr)
+            else:
+                parameter_extracter = PV_Module_Model_Parameter_Extractor(
+                    v_oc_stc=self.extractor_state.v_oc_stc, 
+                    i_sc_stc=self.extractor_state.i_sc_stc, 
+                    v_mp=self.extractor_state.v_mp, 
+                    i_mp=self.extractor_state.i_mp, 
+                    temp_coeff_i_perc=self.extractor_state.temp_coeff_i_perc, 
+                    temp_coeff_v_perc=self.extractor_state.temp_coeff_v_perc, 
+                    n_cell=self.extractor_state.n_cell, 
+                    di_dv_sc=self.extractor_state.di_dv_sc, 
+                    di_dv_oc=self.extractor_state.di_dv_oc,
+                    temperature_c=self.extractor_state.temperature_c, 
+                    solar_irr=self.extractor_state.solar_irr
+                )
+
+                parameter_extracter.extract(self.extractor_state.a_init, self.extractor_state.r_s_init)
+                # Remember the STC inputs and the extractor holding the STC solution.
+                self.extractor_state.parameter_extracter = parameter_extracter
+                self.extractor_state.last_stc_input = self.extractor_state.get_stc_input()
+
             solution = parameter_extracter.get_solution()
             mismatch = parameter_extracter.get_mismatch()
+            self.extractor_state.set_solution(solution, mismatch)
 
             # Set format for the the mismatch.
             string_format = "{:.4e}"
             # Update the solution entries in the GUI
             self.extractor_state.main_window.set_solution_entries(solution)
+            # Draw the I-V and P-V curves of the solution.
+            self.extractor_state.main_window.plot_solution(parameter_extracter,
+                self.extractor_state.temperature_c, self.extractor_state.solar_irr, self.extractor_state.n_cell)
 
             # Enable the previously disabled entries.
             self.extractor_state.main_window.enable_input_entries()
@@ -90,6 +109,13 @@ class ExtractorState():
         # Mismatch:
         self.mismatch = None
 
+        # Dependency tracking:
+        # The STC inputs used by the last extraction and the extractor that holds
+        # the STC solution. Used to skip the nonlinear solver when only the
+        # operating condition (temperature and irradiance) is changed.
+        self.last_stc_input = None
+        self.parameter_extracter = None
+
 
 
     def update_input_from_gui(self):
@@ -111,6 +137,29 @@ class ExtractorState():
         self.a_init = input_dict["a_init"]
         self.r_s_init = input_dict["r_s_init"]
 
+    def get_stc_input(self):
+        # The inputs that the nonlinear equations (STC solution) depend on.
+        # The temperature and irradiance are not included as they only affect
+        # the closed-form post-processing.
+        return (self.v_oc_stc, self.i_sc_stc, self.v_mp, self.i_mp,
+            self.temp_coeff_i_perc, self.temp_coeff_v_perc, self.n_cell,
+            self.di_dv_sc, self.di_dv_oc, self.a_init, self.r_s_init)
+
+    def only_conditions_changed(self):
+        # Check if the STC solution of the last extraction can be reused.
+        if self.parameter_extracter is None or self.last_stc_input is None:
+            return False
+        return self.get_stc_input() == self.last_stc_input
+
+    def set_solution(self, solution, mismatch):
+        # Keep the latest solution and mismatch.
+        self.a = solution["a"]
+        self.i_o = solution["i_o"]
+        self.r_s = solution["r_s"]
+        self.r_sh = solution["r_sh"]
+        self.i_ph = solution["i_ph"]
+        self.mismatch = mismatch
+
     def extract(self):
         self.update_input_from_gui()
 
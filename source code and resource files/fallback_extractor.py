@@ -0,0 +1,169 @@
+# The PV module fallback extractor class.
+#
+# In a batch pipeline, a single data sheet can make the solver wander for a
+# long time or return a nonsense solution without any error. The instance of
+# this class guards every extraction:
+#   - every solve has a time budget and a cap on the function calls, so no
+#     module can stall the pipeline,
+#   - a divergence detector checks every solution: the parameters must be
+#     finite and physical, and the mismatch of the equations must be small
+#     compared to the short circuit current,
+#   - a module that fails is tried again with a chain of fallback strategies
+#     (other initial values, another formulation, another solver) before it
+#     is marked as failed.
+#
+# extract_many() first solves all modules together with the vectorized batch
+# extractor, which has a fixed iteration cap, and only the modules that fail
+# there go through the fallback chain one by one. So the time of a batch is
+# bounded by the batch solve plus, for each failed module, the number of
+# strategies times the time budget.
+
+
+import time
+import numpy as np
+from pvmmpe import PV_Module_Model_Parameter_Extractor
+from batch_extractor import PV_Module_Batch_Extractor
+from precision_tiers import get_precision_tier
+
+class PV_Module_Fallback_Extractor:
+
+    # The fallback strategies, tried in order. Each one overrides the default settings
+    # a_init=1.3, r_s_init=0.3, formulation="log" and solver="fsolve".
+    default_strategies = [
+        {},
+        {"a_init": 1.0, "r_s_init": 0.05},
+        {"a_init": 2.0, "r_s_init": 0.8},
+        {"solver": "lm"},
+        {"formulation": "linear"},
+    ]
+
+    def __init__(self, strategies=None, time_budget=0.2, max_function_calls=400,
+        mismatch_limit=1e-2, a_range=(0.5, 5.0), precision="standard"):
+        self.strategies = self.default_strategies if strategies is None else strategies
+        # The budgets of each solve.
+        self._time_budget = time_budget # seconds
+        self._tier = get_precision_tier(precision)
+        self._tier["maxfev"] = max_function_calls
+        # The divergence detector's limits. The mismatch limit is relative to I_sc.
+        self._mismatch_limit = mismatch_limit
+        self._a_range = a_range
+
+        self._datasheet_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc",
+            "temp_coeff_v_perc", "n_cell", "di_dv_sc", "di_dv_oc", "temperature_c", "solar_irr"]
+
+    def check_solution(self, solution, mismatch, i_sc_stc):
+        # The divergence detector. Returns the reason why the solution is rejected, or
+        # None if it is accepted.
+        values = [solution[item] for item in ["a", "i_o", "i_ph", "r_s", "r_sh"]]
+        if not all(np.isfinite(value) for value in values) or not np.isfinite(mismatch):
+            return "not finite"
+        if not self._a_range[0] <= solution["a"] <= self._a_range[1]:
+            return "a out of range"
+        if solution["i_o"] <= 0 or solution["r_s"] < 0 or solution["r_sh"] <= 0:
+            return "not physical"
+        if mismatch > self._mismatch_limit * abs(i_sc_stc):
+            return "large mismatch"
+        return None
+
+    def extract_module(self, datasheet):
+        # Extract one module (a dictionary of the extractor's inputs) with the fallback
+        # chain. Returns a dictionary with the solution, the index of the strategy that
+        # succeeded (-1 if all failed), the reason of the last failure and the time used.
+        start_time = time.perf_counter()
+        result = {"strategy": -1, "reason": None, "mismatch": np.inf,
+            "a": np.nan, "i_o": np.nan, "i_ph": np.nan, "r_s": np.nan, "r_sh": np.nan}
+        for index, strategy in enumerate(self.strategies):
+            settings = {"a_init": 1.3, "r_s_init": 0.3, "formulation": "log", "solver": "fsolve"}
+            settings.update(strategy)
+            parameter_extracter = PV_Module_Model_Parameter_Extractor(**datasheet)
+            try:
+                parameter_extracter.extract(precision=self._tier, time_budget=self._time_budget, **settings)
+            except (OverflowError, ZeroDivisionError, ValueError):
+                # e.g. math.exp overflows in the linear formulation.
+                result["reason"] = "solver error"
+                continue
+
+            solver_info = parameter_extracter.get_solver_info()
+            if solver_info["out_of_time"]:
+                result["reason"] = "out of time"
+                continue
+            if not solver_info["converged"]:
+                result["reason"] = "not converged"
+                continue
+            solution = parameter_extracter.get_solution()
+            reason = self.check_solution(solution, solver_info["mismatch"], datasheet.get("i_sc_stc", 8.53))
+            if reason is not None:
+                result["reason"] = reason
+                continue
+
+            result.update(solution)
+            result["strategy"] = index
+            result["reason"] = None
+            result["mismatch"] = solver_info["mismatch"]
+            break
+        result["elapsed_time"] = time.perf_counter() - start_time
+        return result
+
+    def extract_many(self, **datasheets):
+        # Extract many modules (the inputs of PV_Module_Batch_Extractor, as arrays). All
+        # modules are solved by the batch extractor first, and the failed ones by the
+        # fallback chain. Returns a dictionary of arrays with the solutions, the mismatch,
+        # the strategy (0 for the batch solve, k for the k-th fallback strategy, -1 for
+        # failed), the time used by the fallback chain and a list of reasons: why the batch
+        # solve failed, or for the failed modules, why the last strategy failed.
+        batch_extractor = PV_Module_Batch_Extractor(**datasheets)
+        batch_extractor.extract(precision=self._tier)
+        solution = batch_extractor.get_solution()
+        solver_info = batch_extractor.get_solver_info()
+        n_modules = np.size(solution["a"])
+
+        results = {item: np.array(np.atleast_1d(value), dtype=float) for item, value in solution.items()}
+        results["mismatch"] = np.array(np.atleast_1d(solver_info["mismatch"]), dtype=float)
+        results["strategy"] = np.zeros(n_modules, dtype=int)
+        results["elapsed_time"] = np.zeros(n_modules)
+        results["reason"] = [None] * n_modules
+
+        inputs = np.broadcast_arrays(*[np.atleast_1d(np.asarray(datasheets.get(item, default), dtype=float))
+            for item, default in zip(self._datasheet_items, [44.9, 8.53, 36.1, 8.04, 0.046, -0.33, 72,
+            -2.488e-3, -2.05, 25, 1000])])
+        inputs = [np.broadcast_to(item.ravel(), (n_modules,)) for item in inputs]
+        converged = np.atleast_1d(solver_info["converged"])
+        for module in range(n_modules):
+            datasheet = {item: inputs[column][module].item() for column, item in enumerate(self._datasheet_items)}
+            module_solution = {item: results[item][module] for item in ["a", "i_o", "i_ph", "r_s", "r_sh"]}
+            reason = "not converged" if not converged[module] else\
+                self.check_solution(module_solution, results["mismatch"][module], datasheet["i_sc_stc"])
+            if reason is None:
+                continue
+
+            result = self.extract_module(datasheet)
+            for item in ["a", "i_o", "i_ph", "r_s", "r_sh", "mismatch", "elapsed_time"]:
+                results[item][module] = result[item]
+            results["strategy"][module] = result["strategy"] + 1 if result["strategy"] >= 0 else -1
+            results["reason"][module] = result["reason"] if result["strategy"] < 0 else reason
+        return results
+
+
+# Unit test.
+if __name__ == "__main__":
+    from datasheet_generator import SyntheticDatasheetGenerator
+
+    n_modules = 20000
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    datasheets = next(generator.iter_chunks(n_modules))
+    inputs = {item: datasheets[item] for item in generator.datasheet_items}
+
+    fallback_extractor = PV_Module_Fallback_Extractor()
+    start_time = time.perf_counter()
+    results = fallback_extractor.extract_many(**inputs)
+    elapsed_time = time.perf_counter() - start_time
+    print("Extracted " + str(n_modules) + " modules in " + "{:.2f}".format(elapsed_time) + " s.")
+    print("solved by the batch solve: " + str(np.sum(results["strategy"] == 0)))
+    for index in range(len(fallback_extractor.strategies)):
+        print("solved by fallback strategy " + str(index + 1) + " " + str(fallback_extractor.strategies[index])
+            + ": " + str(np.sum(results["strategy"] == index + 1)))
+    print("failed: " + str(np.sum(results["strategy"] < 0)))
+    fallback_time = results["elapsed_time"][results["strategy"] != 0]
+    if fallback_time.size:
+        print("fallback time per module: median " + "{:.4f}".format(np.median(fallback_time))
+            + " s, max " + "{:.4f}".format(fallback_time.max()) + " s")
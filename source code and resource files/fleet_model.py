@@ -0,0 +1,181 @@
+# The PV fleet model class.
+#
+# A plant has many modules (100k and more) but only a few distinct module
+# types, i.e. distinct data sheets. Extracting the parameters module by
+# module repeats the same work for every module of a type. The instance of
+# this class interns the modules by their data sheet: the unique data sheets
+# are kept once, and each module only keeps the index of its type. The
+# nonlinear equations are solved once per type with the batch extractor.
+#
+# The operating conditions (temperature and irradiance) are given per module.
+# The parameters at those conditions are calculated in closed form from the
+# STC solutions of the types, gathered by the type index, and the maximum
+# power point of every module is evaluated with vectorized Newton iterations.
+# The memory use is proportional to the number of types plus the per-module
+# condition data; the MPP evaluation is done in chunks of modules.
+
+
+import numpy as np
+from batch_extractor import PV_Module_Batch_Extractor
+from iv_curve import thermal_voltage, maximum_power_point
+
+class PV_Fleet_Model:
+
+    # The data sheet inputs that identify a module type.
+    datasheet_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc",
+        "temp_coeff_v_perc", "n_cell", "di_dv_sc", "di_dv_oc"]
+
+    def __init__(self, chunk_size=65536, **datasheets):
+        # datasheets holds the data sheet inputs of the modules, as arrays with one element
+        # per module (or scalars shared by all modules).
+        defaults = [44.9, 8.53, 36.1, 8.04, 0.046, -0.33, 72, -2.488e-3, -2.05]
+        columns = np.broadcast_arrays(*[np.atleast_1d(np.asarray(datasheets.get(item, default), dtype=float))
+            for item, default in zip(self.datasheet_items, defaults)])
+        self._chunk_size = chunk_size
+
+        # Intern the modules by their data sheet.
+        unique_rows, type_index = np.unique(np.column_stack([column.ravel() for column in columns]),
+            axis=0, return_inverse=True)
+        self._types = {item: unique_rows[:, column] for column, item in enumerate(self.datasheet_items)}
+        self._type_index = type_index.ravel().astype(np.int32)
+        self._n_modules = self._type_index.size
+        self._n_types = unique_rows.shape[0]
+
+        # The STC solution of each type.
+        self._stc_solution = None
+        self._converged = None
+
+    def get_n_types(self):
+        return self._n_types
+
+    def get_n_modules(self):
+        return self._n_modules
+
+    def get_type_index(self):
+        # The type of each module, as an index into the arrays of get_types().
+        return self._type_index
+
+    def get_types(self):
+        # The unique data sheets, one array element per type.
+        return self._types
+
+    def solve(self, a_init=1.3, r_s_init=0.3, precision="standard", result_store=None):
+        # Solve the nonlinear equations once per type.
+        batch_extractor = PV_Module_Batch_Extractor(**self._types)
+        batch_extractor.extract(a_init, r_s_init, result_store=result_store, precision=precision)
+        stc_solution = batch_extractor.get_stc_solution()
+        self._stc_solution = {
+            "a": np.atleast_1d(stc_solution["a"]),
+            "i_o_stc": np.atleast_1d(stc_solution["i_o_stc"]),
+            "r_s": np.atleast_1d(stc_solution["r_s"]),
+            "r_sh": np.atleast_1d(batch_extractor.get_solution()["r_sh"]),
+        }
+        self._converged = np.atleast_1d(batch_extractor.get_solver_info()["converged"])
+        return self._converged
+
+    def get_converged(self):
+        # The convergence flag of each type.
+        return self._converged
+
+    def _parameters(self, module_index, temperature_c, solar_irr):
+        # The parameters of the modules in module_index at their conditions, in closed form
+        # from the STC solutions of their types (the same as the extractors'
+        # update_conditions()).
+        type_index = self._type_index[module_index]
+        gather = lambda values: values[type_index]
+        temperature_k = temperature_c + 273.15
+        delta_t = temperature_k - (25.0 + 273.15)
+
+        i_sc_working = gather(self._types["i_sc_stc"]) * (1 + gather(self._types["temp_coeff_i_perc"]) / 100 * delta_t)
+        i_ph = i_sc_working * solar_irr / 1000
+        v_oc = gather(self._types["v_oc_stc"]) * (1 + gather(self._types["temp_coeff_v_perc"]) / 100 * delta_t)
+        a = gather(self._stc_solution["a"])
+        r_sh = gather(self._stc_solution["r_sh"])
+        v_t = thermal_voltage(temperature_c, gather(self._types["n_cell"]))
+        i_o = (i_sc_working - v_oc / r_sh) / np.exp(v_oc / (a * v_t))
+        return {
+            "a": a,
+            "i_o": i_o,
+            "i_ph": i_ph,
+            "r_s": gather(self._stc_solution["r_s"]),
+            "r_sh": r_sh,
+            "v_t": v_t,
+        }
+
+    def _module_conditions(self, temperature_c, solar_irr):
+        temperature_c = np.broadcast_to(np.asarray(temperature_c, dtype=float), (self._n_modules,))
+        solar_irr = np.broadcast_to(np.asarray(solar_irr, dtype=float), (self._n_modules,))
+        return temperature_c, solar_irr
+
+    def update_conditions(self, temperature_c, solar_irr):
+        # The parameters of every module at its condition (scalars or arrays with one
+        # element per module). Returns a dictionary of per-module arrays.
+        if self._stc_solution is None:
+            return None
+        temperature_c, solar_irr = self._module_conditions(temperature_c, solar_irr)
+        parameters = self._parameters(np.arange(self._n_modules), temperature_c, solar_irr)
+        del parameters["v_t"]
+        return parameters
+
+    def maximum_power_point(self, temperature_c, solar_irr):
+        # The maximum power point of every module at its condition. Returns the per-module
+        # arrays v_mp, i_mp and p_mp.
+        if self._stc_solution is None:
+            return None
+        temperature_c, solar_irr = self._module_conditions(temperature_c, solar_irr)
+        v_mp = np.zeros(self._n_modules)
+        i_mp = np.zeros(self._n_modules)
+        for start in range(0, self._n_modules, self._chunk_size):
+            module_index = np.arange(start, min(start + self._chunk_size, self._n_modules))
+            parameters = self._parameters(module_index, temperature_c[module_index], solar_irr[module_index])
+            lit = parameters["i_ph"] > 0 # no power without light
+            if not np.any(lit):
+                continue
+            v_mp[module_index[lit]], i_mp[module_index[lit]] = maximum_power_point(
+                *[parameters[item][lit] for item in ["a", "i_o", "i_ph", "r_s", "r_sh", "v_t"]])
+        return v_mp, i_mp, v_mp * i_mp
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+
+    # A plant of 200k modules of 40 types with per-module temperatures and irradiances.
+    n_modules = 200000
+    n_types = 40
+    rng = np.random.default_rng(0)
+    type_scale = rng.uniform(0.8, 1.2, n_types)
+    module_type = rng.integers(0, n_types, n_modules)
+    scale = type_scale[module_type]
+    start_time = time.perf_counter()
+    fleet_model = PV_Fleet_Model(v_oc_stc=44.9 * scale, i_sc_stc=8.53 * scale, v_mp=36.1 * scale,
+        i_mp=8.04 * scale, di_dv_oc=-2.05 / scale)
+    fleet_model.solve()
+    solve_time = time.perf_counter() - start_time
+    print(str(fleet_model.get_n_modules()) + " modules of " + str(fleet_model.get_n_types())
+        + " types solved in " + "{:.3f}".format(solve_time) + " s.")
+
+    temperature_c = rng.uniform(20.0, 60.0, n_modules)
+    solar_irr = rng.uniform(200.0, 1000.0, n_modules)
+    start_time = time.perf_counter()
+    v_mp, i_mp, p_mp = fleet_model.maximum_power_point(temperature_c, solar_irr)
+    mpp_time = time.perf_counter() - start_time
+    print("MPP of all modules in " + "{:.3f}".format(mpp_time) + " s, plant power = "
+        + "{:.1f}".format(p_mp.sum() / 1000) + " kW")
+
+    # Compare one module with the single module extractor and the I-V curve samples.
+    from pvmmpe import PV_Module_Model_Parameter_Extractor
+    from iv_curve import sample_iv_curve
+    module = 12345
+    parameters = fleet_model.update_conditions(temperature_c, solar_irr)
+    types = fleet_model.get_types()
+    datasheet = {item: types[item][fleet_model.get_type_index()[module]] for item in types}
+    parameter_extracter = PV_Module_Model_Parameter_Extractor(temperature_c=temperature_c[module],
+        solar_irr=solar_irr[module], **datasheet)
+    single_parameters = parameter_extracter.extract()
+    print("module " + str(module) + ": max relative difference from the single module extractor = "
+        + str(max(abs(parameters[item][module] / value - 1)
+        for item, value in zip(["a", "i_o", "i_ph", "r_s", "r_sh"], single_parameters))))
+    v, i, _ = sample_iv_curve(*single_parameters, temperature_c[module], 72, n_points=20000)
+    print("module " + str(module) + ": P_mp = " + "{:.4f}".format(p_mp[module]) + " W, sampled max = "
+        + "{:.4f}".format((v * i).max()) + " W")
@@ -0,0 +1,117 @@
+# Vectorized evaluation of the single-diode model's I-V curve.
+#
+# The model equation
+#   i = i_ph - i_o*(exp((v + i*r_s)/(a*v_t)) - 1) - (v + i*r_s)/r_sh
+# is implicit in the current. It is solved with Newton's method for all
+# voltages (and all modules) at once with numpy arrays. Starting from
+# i = i_ph, the right hand side minus i is a concave decreasing function of i
+# that is not positive, so the iterations converge monotonically.
+#
+# The functions are used to draw the curves in the main window and to make
+# synthetic curves, so they only depend on numpy.
+
+
+import numpy as np
+
+q = 1.6e-19 # the charge of an electron in SI unit
+k = 1.38e-23 # Boltzmann constant in SI unit
+
+def thermal_voltage(temperature_c=25, n_cell=72):
+    # The thermal voltage of the module, n_cell*k*T/q.
+    return n_cell * k * (np.asarray(temperature_c, dtype=float) + 273.15) / q
+
+def open_circuit_voltage(a, i_o, i_ph, r_s, r_sh, v_t, tol=1e-12, max_iter=100):
+    # Solve i_ph - i_o*(exp(v/(a*v_t)) - 1) - v/r_sh = 0 for v (no current, so r_s
+    # does not matter). The starting value ignores r_sh, so it is above the root and
+    # Newton's method converges monotonically.
+    a_v_t = np.asarray(a * v_t, dtype=float)
+    v = a_v_t * np.log1p(i_ph / i_o)
+    for _ in range(max_iter):
+        exp_term = np.exp(v / a_v_t)
+        f = i_ph - i_o * (exp_term - 1) - v / r_sh
+        step = f / (i_o * exp_term / a_v_t + 1 / r_sh)
+        v = v + step
+        if np.all(np.abs(step) < tol * np.maximum(np.abs(v), 1.0)):
+            break
+    return v
+
+def current_at_voltage(v, a, i_o, i_ph, r_s, r_sh, v_t, tol=1e-12, max_iter=100):
+    # Solve the model equation for the current at the voltages v. All arguments are
+    # broadcast together.
+    v, a, i_o, i_ph, r_s, r_sh, v_t = np.broadcast_arrays(*[np.asarray(x, dtype=float)
+        for x in (v, a, i_o, i_ph, r_s, r_sh, v_t)])
+    a_v_t = a * v_t
+    i = i_ph.copy()
+    for _ in range(max_iter):
+        exp_term = np.exp(np.minimum((v + i*r_s) / a_v_t, 700.0)) # avoid overflow
+        f = i_ph - i_o * (exp_term - 1) - (v + i*r_s) / r_sh - i
+        step = f / (i_o * exp_term * r_s / a_v_t + r_s / r_sh + 1)
+        i = i + step
+        if np.all(np.abs(step) < tol * np.maximum(np.abs(i), 1.0)):
+            break
+    return i
+
+def maximum_power_point(a, i_o, i_ph, r_s, r_sh, v_t, v_oc=None, n_grid=64, n_newton=8):
+    # The maximum power point of each curve (1-D arrays of parameters). In terms of the
+    # diode voltage v_d = v + i*r_s, the current and the voltage are explicit,
+    # i = i_ph - i_o*(exp(v_d/(a*v_t)) - 1) - v_d/r_sh and v = v_d - i*r_s, so dP/dv_d = 0
+    # is solved with Newton's method from the best point of a coarse grid.
+    # Returns v_mp and i_mp.
+    a, i_o, i_ph, r_s, r_sh, v_t = [np.atleast_1d(np.asarray(x, dtype=float)) for x in (a, i_o, i_ph, r_s, r_sh, v_t)]
+    a_v_t = a * v_t
+    if v_oc is None:
+        v_oc = open_circuit_voltage(a, i_o, i_ph, r_s, r_sh, v_t)
+    v_oc = np.atleast_1d(v_oc)
+    grid = v_oc[:, None] * np.linspace(0.0, 1.0, n_grid)
+    column = lambda x: x[:, None]
+    i_grid = column(i_ph) - column(i_o) * np.expm1(grid / column(a_v_t)) - grid / column(r_sh)
+    v_d = grid[np.arange(len(v_oc)), np.argmax((grid - i_grid * column(r_s)) * i_grid, axis=1)]
+    for _ in range(n_newton):
+        exp_term = np.exp(v_d / a_v_t)
+        i = i_ph - i_o * (exp_term - 1) - v_d / r_sh
+        v = v_d - i * r_s
+        di = -(i_o * exp_term / a_v_t + 1 / r_sh)
+        d2i = -i_o * exp_term / a_v_t**2
+        dv = 1 - di * r_s
+        d2v = -d2i * r_s
+        dp = di * v + i * dv
+        d2p = d2i * v + 2 * di * dv + i * d2v
+        # No step where the curve is flat (no light, v_oc = 0).
+        step = np.divide(dp, d2p, out=np.zeros_like(dp), where=d2p < 0)
+        v_d = np.clip(v_d - step, 0.0, v_oc)
+    i = i_ph - i_o * np.expm1(v_d / a_v_t) - v_d / r_sh
+    return v_d - i * r_s, i
+
+def sample_iv_curve(a, i_o, i_ph, r_s, r_sh, temperature_c=25, n_cell=72, n_points=200):
+    # Sample the I-V curve from the short circuit to the open circuit point.
+    # The parameters can be arrays (one curve per element), then the samples have one
+    # row per curve. Returns the voltages, the currents and the maximum power point
+    # (v_mp, i_mp) of each curve.
+    v_t = thermal_voltage(temperature_c, n_cell)
+    v_oc = open_circuit_voltage(a, i_o, i_ph, r_s, r_sh, v_t)
+    v = np.asarray(v_oc)[..., None] * np.linspace(0.0, 1.0, n_points)
+    expand = lambda x: np.asarray(x, dtype=float)[..., None]
+    i = current_at_voltage(v, expand(a), expand(i_o), expand(i_ph), expand(r_s), expand(r_sh), expand(v_t))
+    i[..., -1] = 0.0 # exactly at the open circuit point
+    mpp_index = np.argmax(v * i, axis=-1)
+    v_mp = np.take_along_axis(v, mpp_index[..., None], axis=-1)[..., 0]
+    i_mp = np.take_along_axis(i, mpp_index[..., None], axis=-1)[..., 0]
+    return v, i, (v_mp, i_mp)
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+
+    # The default data sheet parameters of the extractor.
+    v, i, (v_mp, i_mp) = sample_iv_curve(1.2459, 2.966e-08, 8.53, 0.2174, 401.93)
+    print("V_oc = " + str(v[-1]) + ", I_sc = " + str(i[0]))
+    print("MPP: V_mp = " + str(v_mp) + ", I_mp = " + str(i_mp))
+
+    n_curves = 10000
+    rng = np.random.default_rng(0)
+    start_time = time.perf_counter()
+    v, i, _ = sample_iv_curve(rng.uniform(1.1, 1.4, n_curves), 10**rng.uniform(-9, -7, n_curves),
+        rng.uniform(8.0, 9.0, n_curves), rng.uniform(0.2, 0.5, n_curves), rng.uniform(200.0, 600.0, n_curves))
+    elapsed_time = time.perf_counter() - start_time
+    print(str(n_curves) + " curves of " + str(v.shape[1]) + " points in " + "{:.3f}".format(elapsed_time) + " s")
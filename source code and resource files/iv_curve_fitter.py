@@ -0,0 +1,237 @@
+# The PV module I-V curve fitter class.
+#
+# The instance of this class fits the single-diode model parameters
+# (a, i_o, i_ph, r_s, r_sh) to measured I-V curves, e.g. the curves recorded
+# by field I-V tracers, instead of using only the four data sheet points and
+# the two slopes.
+#
+# The residual of every measured point is the implicit single-diode equation
+#   r = i_ph - i_o * (exp((v + i*r_s) / (a*v_t)) - 1) - (v + i*r_s) / r_sh - i
+# where v_t = n_cell*k*T/q. The residuals of all points of all curves are
+# evaluated with numpy arrays and the Jacobian is given analytically. As each
+# curve only depends on its own five parameters, the curves are independent
+# least squares problems and a whole batch of them is fitted together by the
+# vectorized Levenberg-Marquardt solver in batch_solver.py.
+#
+# Internally, i_o is fitted as log(i_o) to keep it positive and the problem well
+# scaled, and r_sh is fitted as the shunt conductance 1/r_sh, which stays well
+# behaved when the shunt resistance is very large.
+#
+# The starting point is the solution of the data sheet nonlinear equations,
+# obtained with the existing PV_Module_Model_Parameter_Extractor and moved to
+# the operating condition of each curve.
+
+
+import numpy as np
+from batch_solver import solve_batch
+from pvmmpe import PV_Module_Model_Parameter_Extractor
+
+class PV_Module_IV_Curve_Fitter:
+
+    def __init__(self, v, i, n_cell=72, temperature_c=25, solar_irr=1000, chunk_size=4096):
+        # Some physical constants (the same as the data sheet extractor):
+        self._q = 1.6e-19 # the charge of an electron in SI unit
+        self._k = 1.38e-23 # Boltzmann constant in SI unit
+
+        # The measured curves. Either 2-D arrays with one curve per row (padded with NaN
+        # if the curves have different numbers of points), 1-D arrays for a single curve,
+        # or lists of 1-D arrays.
+        self._v = self._to_padded_array(v)
+        self._i = self._to_padded_array(i)
+        if self._v.shape != self._i.shape:
+            raise ValueError("The voltage and current arrays must have the same shape.")
+        self._n_curves = self._v.shape[0]
+        self._valid = np.isfinite(self._v) & np.isfinite(self._i)
+
+        # The operating condition of each curve.
+        self._n_cell = n_cell
+        self._temperature_c = np.broadcast_to(np.asarray(temperature_c, dtype=float), (self._n_curves,))
+        self._temperature_k = self._temperature_c + 273.15 # convert temperature unit C to K
+        self._solar_irr = np.broadcast_to(np.asarray(solar_irr, dtype=float), (self._n_curves,))
+        # The thermal voltage of the whole module for each curve.
+        self._v_t = self._n_cell * self._k * self._temperature_k / self._q
+
+        # The number of curves passed to one batch solve.
+        self._chunk_size = chunk_size
+
+        self._solved = False
+        self._parameters = None # Columns: a, i_o, i_ph, r_s, r_sh.
+        self._rms_error = None
+        self._success = None
+        self._n_iterations = None
+
+    def _to_padded_array(self, x):
+        # Convert the input curves to a 2-D float array padded with NaN.
+        if isinstance(x, np.ndarray):
+            x = np.asarray(x, dtype=float)
+            return x.reshape(1, -1) if x.ndim == 1 else x
+        curves = [np.asarray(curve, dtype=float).ravel() for curve in x]
+        if len(curves) and np.ndim(x[0]) == 0:
+            # A single curve given as a list of numbers.
+            return np.asarray(x, dtype=float).reshape(1, -1)
+        padded = np.full((len(curves), max(len(curve) for curve in curves)), np.nan)
+        for row, curve in enumerate(curves):
+            padded[row, :len(curve)] = curve
+        return padded
+
+    def initial_parameters_from_datasheet(self, **datasheet):
+        # Solve the data sheet nonlinear equations once and move the solution to the
+        # operating condition of each curve. The keyword arguments are the ones of
+        # PV_Module_Model_Parameter_Extractor (n_cell is taken from the fitter).
+        a_init = datasheet.pop("a_init", 1.3)
+        r_s_init = datasheet.pop("r_s_init", 0.3)
+        datasheet["n_cell"] = self._n_cell
+        parameter_extracter = PV_Module_Model_Parameter_Extractor(**datasheet)
+        parameter_extracter.extract(a_init, r_s_init)
+
+        return self.initial_parameters_from_extractor(parameter_extracter)
+
+    def initial_parameters_from_extractor(self, parameter_extracter):
+        # Move the solution of an already solved data sheet extractor to the operating
+        # condition of each curve. Used when many batches share one data sheet.
+        initial_parameters = np.empty((self._n_curves, 5))
+        # Only the distinct operating conditions need to be evaluated.
+        conditions, inverse = np.unique(np.column_stack((self._temperature_c, self._solar_irr)),
+            axis=0, return_inverse=True)
+        for row, (temperature_c, solar_irr) in enumerate(conditions):
+            a, i_o, i_ph, r_s, r_sh = parameter_extracter.update_conditions(temperature_c, solar_irr)
+            initial_parameters[inverse.ravel() == row] = [a, i_o, i_ph, r_s, r_sh]
+
+        return initial_parameters
+
+    def _residuals_and_jacobian(self, x, v, i, v_t):
+        # The residuals of all points of the given curves and their analytic derivatives
+        # with respect to (a, log(i_o), i_ph, r_s, 1/r_sh).
+        # x holds one row of (a, log(i_o), i_ph, r_s, 1/r_sh) per curve.
+        a = x[:, 0:1]
+        i_o = np.exp(x[:, 1:2])
+        i_ph = x[:, 2:3]
+        r_s = x[:, 3:4]
+        g_sh = x[:, 4:5] # the shunt conductance
+        a_v_t = a * v_t[:, None]
+
+        v_d = v + i * r_s # the diode voltage
+        u = v_d / a_v_t
+        exp_term = np.exp(np.minimum(u, 700.0)) # avoid overflow
+        residuals = i_ph - i_o * (exp_term - 1) - v_d * g_sh - i
+
+        jacobian = np.empty(v.shape + (5,))
+        jacobian[..., 0] = i_o * exp_term * u / a
+        jacobian[..., 1] = -i_o * (exp_term - 1)
+        jacobian[..., 2] = 1.0
+        jacobian[..., 3] = -i_o * exp_term * i / a_v_t - i * g_sh
+        jacobian[..., 4] = -v_d
+        return residuals, jacobian
+
+    def _fit_chunk(self, rows, x0, max_iter):
+        # Fit the curves in rows together with the batch solver.
+        valid = self._valid[rows]
+        # Padded points take the value 0 and have zero residuals and derivatives.
+        v = np.where(valid, self._v[rows], 0.0)
+        i = np.where(valid, self._i[rows], 0.0)
+        v_t = self._v_t[rows]
+
+        def fun(x, index):
+            residuals, jacobian = self._residuals_and_jacobian(x, v[index], i[index], v_t[index])
+            residuals[~valid[index]] = 0.0
+            jacobian[~valid[index]] = 0.0
+            return residuals, jacobian
+
+        result = solve_batch(fun, x0, xtol=1e-10, ftol=1e-12, max_iter=max_iter)
+
+        rms_error = np.sqrt(result["cost"] / np.maximum(valid.sum(axis=1), 1))
+        return result["x"], rms_error, result["converged"], result["n_iterations"]
+
+    def fit(self, initial_parameters=None, max_iter=200, **datasheet):
+        # Fit all curves. initial_parameters has one row (a, i_o, i_ph, r_s, r_sh) per
+        # curve, or a single row used by all curves. If it is not given, the data sheet
+        # solution is used, with the data sheet given as keyword arguments.
+        if initial_parameters is None:
+            initial_parameters = self.initial_parameters_from_datasheet(**datasheet)
+        initial_parameters = np.broadcast_to(np.asarray(initial_parameters, dtype=float),
+            (self._n_curves, 5))
+
+        x0 = np.array(initial_parameters)
+        x0[:, 1] = np.log(x0[:, 1])
+        x0[:, 4] = 1.0 / x0[:, 4]
+
+        x = np.empty_like(x0)
+        self._rms_error = np.empty(self._n_curves)
+        self._success = np.empty(self._n_curves, dtype=bool)
+        self._n_iterations = np.empty(self._n_curves, dtype=int)
+        # The curves are fitted in chunks to bound the size of the Jacobian arrays.
+        for start in range(0, self._n_curves, self._chunk_size):
+            rows = slice(start, min(start + self._chunk_size, self._n_curves))
+            x[rows], self._rms_error[rows], self._success[rows], self._n_iterations[rows] =\
+                self._fit_chunk(rows, x0[rows], max_iter)
+
+        self._parameters = x
+        self._parameters[:, 1] = np.exp(x[:, 1])
+        self._parameters[:, 4] = 1.0 / x[:, 4]
+        self._solved = True
+
+        return self.get_solution()
+
+    def get_convergence(self):
+        # The convergence flags and the numbers of iterations of the fitted curves.
+        if not self._solved:
+            return None
+        return self._success, self._n_iterations
+
+    def get_mismatch(self):
+        # The root mean square current residual (A) of each fitted curve.
+        if not self._solved:
+            return None
+        return self._rms_error
+
+    def get_solution(self):
+        # The fitted parameters, one array element per curve.
+        if not self._solved:
+            return None
+
+        solution = {
+            "a": self._parameters[:, 0],
+            "i_o": self._parameters[:, 1],
+            "i_ph": self._parameters[:, 2],
+            "r_s": self._parameters[:, 3],
+            "r_sh": self._parameters[:, 4],
+        }
+        return solution
+
+
+# Unit test.
+if __name__ == "__main__":
+    # Make noisy synthetic curves from known parameters and fit them back.
+    q = 1.6e-19
+    k = 1.38e-23
+    n_curves = 1000
+    n_points = 200
+    rng = np.random.default_rng(0)
+    true_parameters = np.column_stack((
+        rng.uniform(1.1, 1.4, n_curves), # a
+        10**rng.uniform(-9, -7, n_curves), # i_o
+        rng.uniform(8.0, 9.0, n_curves), # i_ph
+        rng.uniform(0.2, 0.5, n_curves), # r_s
+        rng.uniform(200.0, 600.0, n_curves), # r_sh
+    ))
+    a, i_o, i_ph, r_s, r_sh = [p[:, None] for p in true_parameters.T]
+    v_t = 72 * k * (25 + 273.15) / q
+    # Sample the curves on a voltage grid and solve the implicit equation for the current
+    # with Newton's method. Starting from i = i_ph, the iterations converge monotonically.
+    v_oc = a * v_t * np.log1p(i_ph / i_o) # an upper estimate of the open circuit voltage
+    v = np.linspace(0.0, 1.0, n_points) * v_oc
+    i = np.broadcast_to(i_ph, v.shape).copy()
+    for _ in range(100):
+        exp_term = np.exp((v + i*r_s) / (a*v_t))
+        f = i_ph - i_o * (exp_term - 1) - (v + i*r_s) / r_sh - i
+        i -= f / (-i_o * exp_term * r_s / (a*v_t) - r_s / r_sh - 1)
+    i = i + rng.normal(0.0, 1e-3, i.shape)
+
+    curve_fitter = PV_Module_IV_Curve_Fitter(v, i)
+    solution = curve_fitter.fit()
+    print("")
+    print("Fitted " + str(n_curves) + " curves.")
+    for column, name in enumerate(["a", "i_o", "i_ph", "r_s", "r_sh"]):
+        relative_error = np.abs(solution[name] / true_parameters[:, column] - 1)
+        print("median relative error of " + name + " = " + str(np.median(relative_error)))
+    print("median RMS current residual = " + str(np.median(curve_fitter.get_mismatch())))
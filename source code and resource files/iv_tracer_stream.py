@@ -0,0 +1,223 @@
+# The streaming I-V tracer file fitter class.
+#
+# I-V curve tracers write long logs of concatenated I-V sweeps. Loading such
+# a log completely before fitting does not work for multi-gigabyte files, so
+# the instance of this class reads the log in chunks of lines, splits the
+# rows into sweeps as they arrive, fits the completed sweeps in batches with
+# PV_Module_IV_Curve_Fitter and appends the results to the output file.
+#
+# At any time, only one chunk of lines, the unfinished sweep at the end of
+# the chunk and one batch of completed sweeps are kept in memory, so the
+# memory use does not depend on the size of the log. The unfinished sweep is
+# kept as a list of pieces and joined once, when it is complete. A sweep
+# longer than max_sweep_points rows (e.g. a log with a stuck sweep id) is
+# split into parts of at most max_sweep_points rows, which are fitted as
+# separate sweeps with the same sweep id.
+#
+# The log is a delimited text file with one measured point per row. A new
+# sweep starts when the value in the sweep id column changes or, if the log
+# has no sweep id column, when the voltage drops back (the tracer restarts
+# the sweep from the short circuit side).
+
+
+import numpy as np
+from itertools import islice
+from pvmmpe import PV_Module_Model_Parameter_Extractor
+from iv_curve_fitter import PV_Module_IV_Curve_Fitter
+
+class IV_Tracer_Stream_Fitter:
+
+    def __init__(self, voltage_column=1, current_column=2, sweep_column=0,
+     temperature_column=None, solar_irr_column=None, delimiter=",", skip_header=1,
+     chunk_lines=200000, batch_size=1024, min_points=10, max_sweep_points=100000,
+     temperature_c=25, solar_irr=1000, a_init=1.3, r_s_init=0.3, **datasheet):
+        # The columns of the log. The temperature and irradiance columns are optional,
+        # if they are not given, temperature_c and solar_irr are used for all sweeps.
+        self._voltage_column = voltage_column
+        self._current_column = current_column
+        self._sweep_column = sweep_column
+        self._temperature_column = temperature_column
+        self._solar_irr_column = solar_irr_column
+        self._delimiter = delimiter
+        self._skip_header = skip_header
+        self._temperature_c = temperature_c
+        self._solar_irr = solar_irr
+
+        # The bounds of the memory use.
+        self._chunk_lines = chunk_lines # the number of lines read at a time
+        self._batch_size = batch_size # the number of sweeps fitted together
+        self._min_points = min_points # shorter sweeps are reported but not fitted
+        self._max_sweep_points = max_sweep_points # longer sweeps are split
+
+        # The data sheet of the traced module type gives the starting point of the fits.
+        # It is solved only once for the whole log.
+        self._n_cell = datasheet.get("n_cell", 72)
+        self._parameter_extracter = PV_Module_Model_Parameter_Extractor(**datasheet)
+        self._parameter_extracter.extract(a_init, r_s_init)
+
+        self.output_columns = ["sweep_id", "n_points", "temperature_c", "solar_irr",
+            "a", "i_o", "i_ph", "r_s", "r_sh", "rms_error", "converged"]
+
+    def read_chunks(self, file):
+        # Yield the rows of the log as 2-D float arrays of at most chunk_lines rows.
+        for _ in range(self._skip_header):
+            file.readline()
+        while True:
+            lines = list(islice(file, self._chunk_lines))
+            if not lines:
+                return
+            chunk = np.loadtxt(lines, delimiter=self._delimiter, ndmin=2)
+            if chunk.size:
+                yield chunk
+
+    def _sweep_starts(self, rows):
+        # The row indices where a new sweep starts (the first row is not included).
+        if self._sweep_column is not None:
+            sweep_id = rows[:, self._sweep_column]
+            return np.nonzero(sweep_id[1:] != sweep_id[:-1])[0] + 1
+        voltage = rows[:, self._voltage_column]
+        return np.nonzero(voltage[1:] < voltage[:-1])[0] + 1
+
+    def _split_sweep(self, rows):
+        # The parts of a sweep with at most max_sweep_points rows each.
+        return [rows[start:start + self._max_sweep_points] for start in range(0, len(rows), self._max_sweep_points)]
+
+    def iter_sweeps(self, file):
+        # Yield the sweeps of the log one by one, each as a 2-D array of its rows.
+        pending = [] # the pieces of the sweep that may continue in the next chunk
+        n_pending = 0 # the number of rows in pending
+        n_sweeps = 0
+        for chunk in self.read_chunks(file):
+            segments = np.split(chunk, self._sweep_starts(chunk))
+            complete = []
+            if pending and len(self._sweep_starts(np.vstack((pending[-1][-1], chunk[0])))):
+                # The pending sweep ended with the previous chunk.
+                complete.append(np.concatenate(pending))
+                pending, n_pending = [], 0
+            if len(segments) > 1:
+                # The first segment completes the pending sweep, if any.
+                complete.append(np.concatenate(pending + [segments[0]]) if pending else segments[0])
+                complete.extend(segments[1:-1])
+                pending, n_pending = [], 0
+                segments = segments[-1:]
+            # The last sweep of the chunk is not complete yet. Copy it so the chunk is freed.
+            pending.append(segments[0].copy())
+            n_pending += len(segments[0])
+            if n_pending >= self._max_sweep_points:
+                # Emit the full parts of a too long sweep and keep only the rest.
+                rows = np.concatenate(pending)
+                n_full = n_pending - n_pending % self._max_sweep_points
+                complete.append(rows[:n_full])
+                pending = [rows[n_full:]] if n_full < n_pending else []
+                n_pending -= n_full
+            for rows in complete:
+                for part in self._split_sweep(rows):
+                    yield n_sweeps, part
+                    n_sweeps += 1
+        if pending:
+            for part in self._split_sweep(np.concatenate(pending)):
+                yield n_sweeps, part
+                n_sweeps += 1
+
+    def _fit_batch(self, sweeps):
+        # Fit a batch of sweeps together and return the result rows.
+        n_sweeps = len(sweeps)
+        sweep_ids = []
+        n_points = np.array([len(rows) for _, rows in sweeps])
+        v = np.full((n_sweeps, max(n_points)), np.nan)
+        i = np.full_like(v, np.nan)
+        temperature_c = np.full(n_sweeps, float(self._temperature_c))
+        solar_irr = np.full(n_sweeps, float(self._solar_irr))
+        for row, (index, rows) in enumerate(sweeps):
+            sweep_ids.append(rows[0, self._sweep_column] if self._sweep_column is not None else index)
+            v[row, :len(rows)] = rows[:, self._voltage_column]
+            i[row, :len(rows)] = rows[:, self._current_column]
+            # The condition of a sweep is the mean over its rows.
+            if self._temperature_column is not None:
+                temperature_c[row] = rows[:, self._temperature_column].mean()
+            if self._solar_irr_column is not None:
+                solar_irr[row] = rows[:, self._solar_irr_column].mean()
+
+        # Too short sweeps are not fitted, the result is reported as not converged.
+        fitted = n_points >= self._min_points
+        parameters = np.full((n_sweeps, 5), np.nan)
+        rms_error = np.full(n_sweeps, np.nan)
+        converged = np.zeros(n_sweeps, dtype=bool)
+        if fitted.any():
+            curve_fitter = PV_Module_IV_Curve_Fitter(v[fitted], i[fitted], n_cell=self._n_cell,
+                temperature_c=temperature_c[fitted], solar_irr=solar_irr[fitted])
+            solution = curve_fitter.fit(
+                curve_fitter.initial_parameters_from_extractor(self._parameter_extracter))
+            parameters[fitted] = np.column_stack([solution[name] for name in ["a", "i_o", "i_ph", "r_s", "r_sh"]])
+            rms_error[fitted] = curve_fitter.get_mismatch()
+            converged[fitted] = curve_fitter.get_convergence()[0]
+
+        return [[sweep_ids[row], n_points[row], temperature_c[row], solar_irr[row], *parameters[row],
+            rms_error[row], int(converged[row])] for row in range(n_sweeps)]
+
+    def fit_file(self, input_path, output_path):
+        # Fit all sweeps of the log in input_path and write one result row per sweep to
+        # output_path. The results are written and flushed after every batch.
+        n_sweeps = 0
+        with open(input_path, "r", encoding="utf-8") as input_file, \
+            open(output_path, "w", encoding="utf-8") as output_file:
+            output_file.write(",".join(self.output_columns) + "\n")
+            sweeps = []
+            for sweep in self.iter_sweeps(input_file):
+                sweeps.append(sweep)
+                if len(sweeps) == self._batch_size:
+                    n_sweeps += self._write_results(output_file, self._fit_batch(sweeps))
+                    sweeps = []
+            if sweeps:
+                n_sweeps += self._write_results(output_file, self._fit_batch(sweeps))
+
+        return n_sweeps
+
+    def _write_results(self, output_file, results):
+        for result in results:
+            output_file.write(",".join("{:.10g}".format(value) for value in result) + "\n")
+        output_file.flush()
+        return len(results)
+
+
+# Unit test.
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+
+    # Write a log of synthetic sweeps with slightly different parameters and fit it.
+    q = 1.6e-19
+    k = 1.38e-23
+    n_sweeps = 5000
+    n_points = 150
+    rng = np.random.default_rng(1)
+    a = rng.uniform(1.2, 1.3, (n_sweeps, 1))
+    i_o = 10**rng.uniform(-8, -7, (n_sweeps, 1))
+    i_ph = rng.uniform(8.3, 8.7, (n_sweeps, 1))
+    r_s = rng.uniform(0.2, 0.3, (n_sweeps, 1))
+    r_sh = rng.uniform(300.0, 500.0, (n_sweeps, 1))
+    v_t = 72 * k * (25 + 273.15) / q
+    v = np.linspace(0.0, 1.0, n_points) * a * v_t * np.log1p(i_ph / i_o)
+    i = np.broadcast_to(i_ph, v.shape).copy()
+    for _ in range(100):
+        exp_term = np.exp((v + i*r_s) / (a*v_t))
+        f = i_ph - i_o * (exp_term - 1) - (v + i*r_s) / r_sh - i
+        i -= f / (-i_o * exp_term * r_s / (a*v_t) - r_s / r_sh - 1)
+
+    directory = tempfile.mkdtemp()
+    input_path = os.path.join(directory, "tracer_log.csv")
+    output_path = os.path.join(directory, "fitted_parameters.csv")
+    sweep_id = np.repeat(np.arange(n_sweeps), n_points)
+    np.savetxt(input_path, np.column_stack((sweep_id, v.ravel(), i.ravel())),
+        delimiter=",", header="sweep_id,voltage,current", comments="", fmt="%.8g")
+
+    stream_fitter = IV_Tracer_Stream_Fitter(chunk_lines=50000, batch_size=1000)
+    start_time = time.perf_counter()
+    n_fitted = stream_fitter.fit_file(input_path, output_path)
+    elapsed_time = time.perf_counter() - start_time
+    results = np.loadtxt(output_path, delimiter=",", skiprows=1)
+    print("")
+    print("Fitted " + str(n_fitted) + " sweeps in " + "{:.2f}".format(elapsed_time) + " s.")
+    print("converged: " + str(int(results[:, -1].sum())))
+    print("max relative error of r_s = " + str(np.max(np.abs(results[:, 7] / r_s[:, 0] - 1))))
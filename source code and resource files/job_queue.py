@@ -0,0 +1,308 @@
+# The file-based catalog job queue class.
+#
+# Re-extracting a large catalog takes hours on several machines, and a crash
+# must not mean starting over. The instance of this class keeps a work queue
+# in a shared directory (e.g. on a network file system):
+#
+#   queue.json            the manifest: the number of modules and shards and
+#                         the extraction settings,
+#   shards/NNNNNN.npz     the inputs of each shard (a slice of the catalog),
+#   locks/NNNNNN.lock     a shard claimed by a worker,
+#   results/NNNNNN.npz    the checkpointed results of a finished shard.
+#
+# Any number of worker processes on any node can run run_worker() on the same
+# directory. A worker claims a shard by creating its lock file with
+# O_CREAT | O_EXCL, which succeeds for exactly one worker, extracts the shard
+# with PV_Module_Fallback_Extractor and writes the results to a temporary
+# file that is renamed to the result file with os.replace(), so a result file
+# is either complete or missing. A shard with a result file is never worked
+# on again, so an interrupted run resumes where it stopped.
+#
+# A lock file holds the id of its worker, and the worker refreshes its
+# modification time while it works on the shard, so a long shard keeps its
+# lock. A worker only removes a lock that still holds its own id.
+#
+# If a worker dies, its lock file stays. A lock not refreshed for lock_timeout
+# whose shard has no result is broken by renaming it, and the shard is claimed
+# again. The renamed lock is checked again: if it was refreshed or replaced in
+# the meantime, it was not stale and it is put back. In the rare case that a
+# shard is extracted twice, the second result replaces the identical first
+# one.
+#
+# Usage:
+#   python job_queue.py create [queue directory] [catalog CSV] [shard size]
+#   python job_queue.py work [queue directory]
+#   python job_queue.py status [queue directory]
+# The catalog CSV has a header line with the input names of the extractor
+# (e.g. written by datasheet_generator.py).
+
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+import numpy as np
+
+class CatalogJobQueue:
+
+    # The inputs of the extractors read from the catalog.
+    input_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc", "temp_coeff_v_perc",
+        "n_cell", "di_dv_sc", "di_dv_oc", "temperature_c", "solar_irr"]
+    # The results of each module.
+    output_items = ["a", "i_o", "i_ph", "r_s", "r_sh", "mismatch", "strategy"]
+
+    def __init__(self, queue_directory, lock_timeout=600.0):
+        self._directory = queue_directory
+        self._lock_timeout = lock_timeout # seconds
+        self._manifest_file = os.path.join(queue_directory, "queue.json")
+        self._shard_directory = os.path.join(queue_directory, "shards")
+        self._lock_directory = os.path.join(queue_directory, "locks")
+        self._result_directory = os.path.join(queue_directory, "results")
+        self._worker_id = socket.gethostname() + "-" + str(os.getpid()) + "-" + uuid.uuid4().hex[:8]
+
+    def _shard_file(self, shard):
+        return os.path.join(self._shard_directory, "{:06d}.npz".format(shard))
+
+    def _lock_file(self, shard):
+        return os.path.join(self._lock_directory, "{:06d}.lock".format(shard))
+
+    def _result_file(self, shard):
+        return os.path.join(self._result_directory, "{:06d}.npz".format(shard))
+
+    def _write_atomically(self, path, write):
+        # Write a file under a temporary name and rename it, so it is never seen half written.
+        temporary_path = path + "." + self._worker_id + ".tmp"
+        with open(temporary_path, "wb") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, path)
+
+    def get_manifest(self):
+        with open(self._manifest_file, "r") as file:
+            return json.load(file)
+
+    def create(self, catalog, shard_size=10000, extract_settings=None):
+        # Split the catalog (a dictionary of arrays, one element per module) into shards.
+        # If the queue exists already, it is kept as it is, so that a run can be restarted
+        # with the same command.
+        if os.path.isfile(self._manifest_file):
+            return self.get_manifest()
+        for directory in [self._directory, self._shard_directory, self._lock_directory, self._result_directory]:
+            os.makedirs(directory, exist_ok=True)
+
+        columns = {item: np.asarray(catalog[item], dtype=float) for item in self.input_items if item in catalog}
+        columns = dict(zip(columns, np.broadcast_arrays(*columns.values())))
+        n_modules = len(next(iter(columns.values())))
+        n_shards = (n_modules + shard_size - 1) // shard_size
+        for shard in range(n_shards):
+            shard_columns = {item: values[shard * shard_size:(shard + 1) * shard_size]
+                for item, values in columns.items()}
+            self._write_atomically(self._shard_file(shard), lambda file: np.savez(file, **shard_columns))
+
+        # The manifest is written last: a queue without it is not complete.
+        manifest = {
+            "n_modules": n_modules,
+            "n_shards": n_shards,
+            "shard_size": shard_size,
+            "extract_settings": extract_settings or {},
+        }
+        self._write_atomically(self._manifest_file, lambda file: file.write(json.dumps(manifest).encode("utf-8")))
+        return manifest
+
+    def _lock_owner(self, lock_file):
+        # The id of the worker in a lock file, or None if it can not be read.
+        try:
+            with open(lock_file, "r") as file:
+                return json.load(file)["worker"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _lock_age(self, lock_file):
+        # The time since the lock was last refreshed, or None if it is gone.
+        try:
+            return time.time() - os.stat(lock_file).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def _create_lock(self, lock_file):
+        # Create the lock file with this worker's id. Returns False if it exists.
+        try:
+            descriptor = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(descriptor, "w") as file:
+            file.write(json.dumps({"worker": self._worker_id, "time": time.time()}))
+        return True
+
+    def _claim(self, shard):
+        # Try to claim a shard. Returns True if this worker now holds its lock.
+        lock_file = self._lock_file(shard)
+        if self._create_lock(lock_file):
+            return True
+
+        # Break the lock of a worker that died, then try once more.
+        owner = self._lock_owner(lock_file)
+        lock_age = self._lock_age(lock_file)
+        if lock_age is None:
+            return self._create_lock(lock_file)
+        if lock_age < self._lock_timeout or os.path.isfile(self._result_file(shard)):
+            return False
+        stale_lock_file = lock_file + "." + self._worker_id + ".stale"
+        try:
+            os.rename(lock_file, stale_lock_file)
+        except FileNotFoundError:
+            return False # another worker broke it first
+        # Between the check and the rename, another worker may have broken the lock and
+        # claimed the shard, or the owner may have refreshed it. Then the renamed lock is
+        # live: put it back, unless a newer lock has been created in its place.
+        stale_lock_age = self._lock_age(stale_lock_file)
+        if self._lock_owner(stale_lock_file) != owner or stale_lock_age is None\
+            or stale_lock_age < self._lock_timeout:
+            try:
+                os.link(stale_lock_file, lock_file)
+            except FileExistsError:
+                pass
+            os.remove(stale_lock_file)
+            return False
+        os.remove(stale_lock_file)
+        return self._create_lock(lock_file)
+
+    def _refresh_lock(self, shard, stop):
+        # Refresh the lock's modification time until stop is set, while this worker owns it.
+        lock_file = self._lock_file(shard)
+        while not stop.wait(self._lock_timeout / 4):
+            if self._lock_owner(lock_file) == self._worker_id:
+                try:
+                    os.utime(lock_file)
+                except FileNotFoundError:
+                    pass
+
+    def _release(self, shard):
+        # Remove the lock, if this worker still owns it.
+        lock_file = self._lock_file(shard)
+        if self._lock_owner(lock_file) != self._worker_id:
+            return
+        try:
+            os.remove(lock_file)
+        except FileNotFoundError:
+            pass
+
+    def _process_shard(self, shard, extract_settings):
+        # Extract one shard and checkpoint its results.
+        from fallback_extractor import PV_Module_Fallback_Extractor
+        with np.load(self._shard_file(shard)) as shard_data:
+            inputs = {item: shard_data[item] for item in shard_data.files}
+        fallback_extractor = PV_Module_Fallback_Extractor(**extract_settings)
+        results = fallback_extractor.extract_many(**inputs)
+        output = {item: np.asarray(results[item]) for item in self.output_items}
+        output["reason"] = np.array([reason or "" for reason in results["reason"]])
+        self._write_atomically(self._result_file(shard), lambda file: np.savez(file, **output))
+
+    def run_worker(self, max_shards=None):
+        # Claim and process shards until none is left (or max_shards are done). The
+        # manifest's extract_settings are passed to PV_Module_Fallback_Extractor.
+        # Returns the number of shards processed by this worker.
+        manifest = self.get_manifest()
+        n_processed = 0
+        for shard in range(manifest["n_shards"]):
+            if max_shards is not None and n_processed >= max_shards:
+                break
+            if os.path.isfile(self._result_file(shard)) or not self._claim(shard):
+                continue
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=self._refresh_lock, args=(shard, stop), daemon=True)
+            heartbeat.start()
+            try:
+                # The shard may have been finished just before it was claimed.
+                if not os.path.isfile(self._result_file(shard)):
+                    self._process_shard(shard, manifest["extract_settings"])
+                    n_processed += 1
+            finally:
+                stop.set()
+                heartbeat.join()
+                self._release(shard)
+        return n_processed
+
+    def status(self):
+        # The numbers of finished, claimed and pending shards.
+        manifest = self.get_manifest()
+        n_finished = sum(os.path.isfile(self._result_file(shard)) for shard in range(manifest["n_shards"]))
+        n_claimed = sum(os.path.isfile(self._lock_file(shard)) and not os.path.isfile(self._result_file(shard))
+            for shard in range(manifest["n_shards"]))
+        return {
+            "n_shards": manifest["n_shards"],
+            "finished": n_finished,
+            "claimed": n_claimed,
+            "pending": manifest["n_shards"] - n_finished - n_claimed,
+        }
+
+    def collect(self):
+        # The results of all modules in catalog order, if all shards are finished.
+        manifest = self.get_manifest()
+        parts = []
+        for shard in range(manifest["n_shards"]):
+            if not os.path.isfile(self._result_file(shard)):
+                return None
+            with np.load(self._result_file(shard)) as result_data:
+                parts.append({item: result_data[item] for item in result_data.files})
+        return {item: np.concatenate([part[item] for part in parts]) for item in parts[0]}
+
+
+def _run_local_worker(queue_directory, lock_timeout):
+    CatalogJobQueue(queue_directory, lock_timeout).run_worker()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] in ["create", "work", "status"]:
+        job_queue = CatalogJobQueue(sys.argv[2])
+        if sys.argv[1] == "create":
+            with open(sys.argv[3], "r") as file:
+                names = file.readline().strip().split(",")
+            rows = np.loadtxt(sys.argv[3], delimiter=",", skiprows=1, ndmin=2)
+            catalog = {name: rows[:, column] for column, name in enumerate(names)}
+            shard_size = int(sys.argv[4]) if len(sys.argv) > 4 else 10000
+            print(job_queue.create(catalog, shard_size))
+        elif sys.argv[1] == "work":
+            print("processed " + str(job_queue.run_worker()) + " shards")
+        else:
+            print(job_queue.status())
+        sys.exit()
+
+    # Unit test: several local workers, one of them killed in the middle of the run,
+    # then a second run that resumes.
+    import multiprocessing
+    import tempfile
+    from datasheet_generator import SyntheticDatasheetGenerator
+
+    n_modules = 40000
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    datasheets = next(generator.iter_chunks(n_modules))
+    catalog = {item: datasheets[item] for item in generator.datasheet_items}
+
+    with tempfile.TemporaryDirectory() as queue_directory:
+        lock_timeout = 2.0
+        job_queue = CatalogJobQueue(queue_directory, lock_timeout)
+        print(job_queue.create(catalog, shard_size=1000))
+
+        workers = [multiprocessing.Process(target=_run_local_worker, args=(queue_directory, lock_timeout))
+            for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        time.sleep(1.0)
+        workers[0].kill() # a crash, leaving its lock behind
+        for worker in workers:
+            worker.join()
+        print("after the first run: " + str(job_queue.status()))
+
+        time.sleep(lock_timeout)
+        start_time = time.perf_counter()
+        print("resumed run processed " + str(job_queue.run_worker()) + " shards in "
+            + "{:.2f}".format(time.perf_counter() - start_time) + " s")
+        print("after the second run: " + str(job_queue.status()))
+        results = job_queue.collect()
+        print("collected " + str(len(results["a"])) + " modules, failed: " + str(np.sum(results["strategy"] < 0))
+            + ", max relative error of r_sh: " + str(np.max(np.abs(results["r_sh"] / datasheets["true_r_sh"] - 1))))
@@ -5,16 +5,20 @@
 # The extractor solver was developed using scipy 1.7.3
 ##################################################################################
 # Importing needed packages.
+# Keep the time when the application starts for the startup time measurement mode.
+import time
+startup_time = time.perf_counter()
+import sys
 import tkinter as tk
 from tkinter import filedialog
 import tkinter.ttk as ttk
-from PIL import Image, ImageTk
 from extractor_state import ExtractorState
+from plot_frame import IVPlotFrame
 import json
-from os import getcwd
+from os import getcwd, path
 
-from short_circuit_window import ShortCircuitWindow
-from open_circuit_window import OpenCircuitWindow
+# To start faster, PIL, Scipy (through the extractor) and the windows for the
+# I-V curve slopes are only imported when they are used for the first time.
 
 # Define the main window's class
 class MainWindow(tk.Tk):
@@ -22,11 +26,12 @@ class MainWindow(tk.Tk):
         super().__init__()
         # Set the main window parameters.
         self.title("solar panel equivalent circuit parameters extractor".title())
-        self.geometry("750x580+300+150")
+        self.geometry("1150x610+200+150")
         # Previously the window was not resaizable.
         #self.resizable(False, False)
         image_icon = tk.PhotoImage(file = "resource files\\solar_panel_icon_png.png")
         self.iconphoto(False, image_icon)
+        self.protocol("WM_DELETE_WINDOW", self.on_closing)
 
         # The extractor's state class. Used to keep track of the extractor's state
         # and start extracting parameters. 
@@ -109,6 +114,7 @@ class MainWindow(tk.Tk):
         self.create_circuit_frame()
         self.create_extractor_frame()
         self.create_solution_widgets()
+        self.create_plot_frame()
         #self.create_error_frame()
 
         # Add the extract button.
@@ -116,9 +122,17 @@ class MainWindow(tk.Tk):
         self.buttons["extract"].pack(fill=tk.BOTH, padx=5, pady=(5,0))
 
     def create_data_area_state_bar(self):
-        # The top big area for showing the data and buttons.
-        self.data_frame = tk.Frame(self)
-        self.data_frame.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        # The top big area has two tabs: the single case tab for showing the data and
+        # buttons of one case, and the batch tab for extracting many cases at once.
+        # The batch tab's widgets are only created when the tab is opened.
+        self.notebook = ttk.Notebook(self)
+        self.notebook.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.data_frame = tk.Frame(self.notebook)
+        self.notebook.add(self.data_frame, text="Single case")
+        self.batch_tab = tk.Frame(self.notebook)
+        self.notebook.add(self.batch_tab, text="Batch")
+        self.batch_frame = None
+        self.notebook.bind("<<NotebookTabChanged>>", self.create_batch_frame)
         self.data_frame.rowconfigure(0, weight=1)
         self.data_frame.columnconfigure(0, weight=1)
         self.data_frame.rowconfigure(1, weight=1)
@@ -132,6 +146,20 @@ class MainWindow(tk.Tk):
         anchor=tk.E, justify=tk.LEFT,  relief = tk.FLAT)
         self.state_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
+    def create_batch_frame(self, event=None):
+        # Create the batch tab's widgets when the tab is opened for the first time.
+        if self.batch_frame is not None or self.notebook.select() != str(self.batch_tab):
+            return
+        from batch_frame import BatchFrame
+        self.batch_frame = BatchFrame(self.batch_tab, self)
+        self.batch_frame.pack(fill=tk.BOTH, expand=1)
+
+    def on_closing(self):
+        # Stop the batch tab's worker threads before closing the window.
+        if self.batch_frame is not None:
+            self.batch_frame.shut_down()
+        self.destroy()
+
     def create_extractor_frame(self):
         # The bigger frame contains the frames for the solutions
         self.extractor_frame = tk.Frame(self.data_frame)
@@ -144,6 +172,11 @@ class MainWindow(tk.Tk):
     
 
 
+    def create_plot_frame(self):
+        # The I-V and P-V curves of the extracted parameters on the right.
+        self.plot_frame = IVPlotFrame(self.data_frame, text="I-V and P-V curves")
+        self.plot_frame.grid(row=0, column=2, rowspan=2, columnspan=1, sticky=tk.NW, padx=(1,5), pady=(10,1))
+
     def create_circuit_frame(self):
         # Create the figure frame and the figure itself using the Canvas widget.
         self.diagram_frame = ttk.LabelFrame(self.data_frame, text="Solar panel equivalent circuit")
@@ -151,10 +184,31 @@ class MainWindow(tk.Tk):
         # Put the canvas.
         self.circuit_canvas = tk.Canvas(self.diagram_frame, bg="white", width=340, height=320)
         self.circuit_canvas.pack(fill=tk.BOTH)
-        self.circuit_image = Image.open("resource files\\solar_cell_equivalent_circuit.png")
-        self.resized_circuit_image = self.circuit_image.resize((260, 320))
-        self.circuit_figure =ImageTk.PhotoImage(self.resized_circuit_image)
+        # The circuit figure is drawn after the first frame is shown.
+        self.circuit_figure = None
+        self.circuit_figure_load_time = 0.0 # for the startup time measurement mode
+        self.after_idle(self.load_circuit_figure)
+
+    def load_circuit_figure(self):
+        # Load the resized circuit figure. The resized figure is cached in a file, which
+        # Tkinter can load without PIL. Only when the cache does not exist yet, PIL is
+        # used to decode and resize the original figure and to write the cache.
+        load_start_time = time.perf_counter()
+        cached_figure_file = "resource files\\solar_cell_equivalent_circuit_260x320.png"
+        if not path.isfile(cached_figure_file):
+            from PIL import Image
+            circuit_image = Image.open("resource files\\solar_cell_equivalent_circuit.png")
+            resized_circuit_image = circuit_image.resize((260, 320))
+            try:
+                resized_circuit_image.save(cached_figure_file)
+            except OSError:
+                # The resource folder may be read only, use the resized figure directly.
+                from PIL import ImageTk
+                self.circuit_figure = ImageTk.PhotoImage(resized_circuit_image)
+        if self.circuit_figure is None:
+            self.circuit_figure = tk.PhotoImage(file=cached_figure_file)
         self.circuit_canvas.create_image((170,160), image=self.circuit_figure)
+        self.circuit_figure_load_time = time.perf_counter() - load_start_time
 
     def create_input_data_frames(self):
         # Put the frame on the left in the data area.
@@ -246,12 +300,14 @@ class MainWindow(tk.Tk):
     def get_di_dv_sc(self):
         # Open the window to get di/dv for the short circuit condition
         # using a graphical approximation method.
+        from short_circuit_window import ShortCircuitWindow
         get_di_dv_window = ShortCircuitWindow(self)
 
 
     def get_di_dv_oc(self):
         # Open the window to get di/dv for the open circuit condition
         # using a graphical approximation method.
+        from open_circuit_window import OpenCircuitWindow
         get_di_dv_window = OpenCircuitWindow(self)
 
     def create_solution_widgets(self):
@@ -435,6 +491,10 @@ class MainWindow(tk.Tk):
         self.string_vars["r_s"].set("{0:.5f}".format(solution["r_s"]))
         self.string_vars["r_sh"].set("{0:.5f}".format(solution["r_sh"]))
 
+    def plot_solution(self, parameter_extracter, temperature_c, solar_irr, n_cell):
+        # Draw the curves of the extractor's solution in the plot frame.
+        self.plot_frame.set_extractor(parameter_extracter, temperature_c, solar_irr, n_cell)
+
     def disable_extraction(self):
         # Disable the extract button.
         self.buttons["extract"].configure(state="disable")
@@ -453,4 +513,17 @@ class MainWindow(tk.Tk):
 
 if __name__ == "__main__":
     win = MainWindow()
-    win.mainloop()
\ No newline at end of file
+    if "--measure-startup" in sys.argv:
+        # Startup time measurement mode: show the first frame, report the time from the
+        # start of the application and quit. update() also runs the deferred loading of the
+        # circuit figure, so its time is reported separately and not counted in the time
+        # to the first frame.
+        win.update()
+        total_time = time.perf_counter() - startup_time
+        time_to_first_frame = total_time - win.circuit_figure_load_time
+        print("Time to first frame: " + "{:.1f}".format(time_to_first_frame * 1000) + " ms")
+        print("Deferred circuit figure loading: " + "{:.1f}".format(win.circuit_figure_load_time * 1000) + " ms")
+        print("Total: " + "{:.1f}".format(total_time * 1000) + " ms")
+        win.destroy()
+    else:
+        win.mainloop()
\ No newline at end of file
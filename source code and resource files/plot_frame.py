@@ -0,0 +1,193 @@
+# Define the frame class of the I-V and P-V curve plot in the main window.
+#
+# The curves are calculated from the extracted parameters with the vectorized
+# I-V curve functions and drawn into a pixel array with numpy. The pixel array
+# is passed to Tkinter as a single PPM image, so a redraw costs one image
+# update instead of deleting and creating thousands of canvas items. Only the
+# few axis labels are canvas text items, and they are reconfigured instead of
+# created again.
+#
+# The temperature and irradiance sliders recalculate the parameters for the
+# new operating condition in closed form with the extractor's
+# update_conditions(), so the curves follow the sliders smoothly. numpy is
+# imported at the first drawing to keep the main window's startup fast.
+
+import tkinter as tk
+import tkinter.ttk as ttk
+
+class IVPlotFrame(ttk.LabelFrame):
+    def __init__(self, master, width=380, height=300, **kwargs):
+        super().__init__(master, **kwargs)
+        # The size of the image and the margins of the plot area in pixels.
+        self.width = width
+        self.height = height
+        self.margin_left = 45
+        self.margin_right = 45
+        self.margin_top = 10
+        self.margin_bottom = 30
+        self.n_ticks = 5
+
+        # The colors of the curves and the grid (RGB).
+        self.iv_color = (31, 119, 180)
+        self.pv_color = (214, 39, 40)
+        self.grid_color = (220, 220, 220)
+        self.axis_color = (0, 0, 0)
+
+        # The extractor used for the curves, set after an extraction.
+        self.parameter_extracter = None
+        self.n_cell = 72
+        # Set while a redraw is scheduled, so several slider moves cause one redraw.
+        self.redraw_pending = False
+
+        self.create_widgets()
+
+    def create_widgets(self):
+        # The canvas holds the plot image and the axis labels.
+        self.canvas = tk.Canvas(self, bg="white", width=self.width, height=self.height, highlightthickness=0)
+        self.canvas.pack(side=tk.TOP, padx=1, pady=1)
+        self.image = tk.PhotoImage(width=self.width, height=self.height)
+        self.canvas.create_image((0, 0), image=self.image, anchor=tk.NW)
+
+        # The tick labels of the voltage, current and power axes.
+        self.tick_labels = {"v": [], "i": [], "p": []}
+        for tick in range(self.n_ticks + 1):
+            self.tick_labels["v"].append(self.canvas.create_text(0, 0, text="", anchor=tk.N, font=("TkDefaultFont", 8)))
+            self.tick_labels["i"].append(self.canvas.create_text(0, 0, text="", anchor=tk.E,
+                fill=self.hex_color(self.iv_color), font=("TkDefaultFont", 8)))
+            self.tick_labels["p"].append(self.canvas.create_text(0, 0, text="", anchor=tk.W,
+                fill=self.hex_color(self.pv_color), font=("TkDefaultFont", 8)))
+        self.axis_title = self.canvas.create_text(self.width / 2, self.height - 2, anchor=tk.S,
+            text="Voltage (V)", font=("TkDefaultFont", 8))
+        self.mpp_label = self.canvas.create_text(self.width - self.margin_right - 4, self.margin_top + 4,
+            anchor=tk.NE, text="", font=("TkDefaultFont", 8))
+
+        # The sliders for the operating condition.
+        self.temperature_c = tk.DoubleVar()
+        self.temperature_c.set(25.0)
+        self.solar_irr = tk.DoubleVar()
+        self.solar_irr.set(1000.0)
+        self.slider_frame = tk.Frame(self)
+        self.slider_frame.pack(side=tk.TOP, fill=tk.X, padx=1, pady=1)
+        self.slider_frame.columnconfigure(1, weight=1)
+        self.condition_texts = {}
+        for row_num, (text, variable, from_, to) in enumerate([
+            ("Temperature (°C):", self.temperature_c, -40.0, 85.0),
+            ("Irradiance (W/m²):", self.solar_irr, 50.0, 1200.0)]):
+            tk.Label(self.slider_frame, text=text, anchor=tk.E).grid(row=row_num, column=0, sticky=tk.E)
+            ttk.Scale(self.slider_frame, from_=from_, to=to, variable=variable, orient=tk.HORIZONTAL,
+                command=self.schedule_redraw).grid(row=row_num, column=1, sticky=tk.EW, padx=1)
+            self.condition_texts[text] = tk.Label(self.slider_frame, width=6, anchor=tk.W)
+            self.condition_texts[text].grid(row=row_num, column=2, sticky=tk.W)
+        self.show_conditions()
+
+    def hex_color(self, color):
+        return "#{:02x}{:02x}{:02x}".format(*color)
+
+    def show_conditions(self):
+        # Show the slider values next to the sliders.
+        texts = list(self.condition_texts.values())
+        texts[0].configure(text="{0:.1f}".format(self.temperature_c.get()))
+        texts[1].configure(text="{0:.0f}".format(self.solar_irr.get()))
+
+    def set_extractor(self, parameter_extracter, temperature_c, solar_irr, n_cell):
+        # Plot the curves of a new extraction, starting from its operating condition.
+        self.parameter_extracter = parameter_extracter
+        self.n_cell = n_cell
+        self.temperature_c.set(temperature_c)
+        self.solar_irr.set(solar_irr)
+        self.schedule_redraw()
+
+    def schedule_redraw(self, event=None):
+        # Redraw when Tkinter is idle. The slider may call this many times in a row.
+        self.show_conditions()
+        if not self.redraw_pending:
+            self.redraw_pending = True
+            self.after_idle(self.redraw)
+
+    def nice_step(self, max_value):
+        # A round tick step (1, 2 or 5 times a power of 10) for the axis range [0, max_value].
+        # A zero or non-finite range (e.g. no light, solar_irr = 0) gets a unit step.
+        import math
+        if not math.isfinite(max_value) or max_value <= 0:
+            return 1.0
+        raw_step = max_value / self.n_ticks
+        magnitude = 10 ** math.floor(math.log10(raw_step))
+        for factor in [1, 2, 5, 10]:
+            if factor * magnitude >= raw_step:
+                return factor * magnitude
+
+    def draw_line(self, pixels, x, y, color):
+        # Draw a polyline through the pixel coordinates x, y into the pixel array.
+        # The line is resampled every half pixel along its length, so no segment has gaps.
+        import numpy as np
+        segment_lengths = np.hypot(np.diff(x), np.diff(y))
+        path_length = np.concatenate(([0.0], np.cumsum(segment_lengths)))
+        t = np.arange(0.0, path_length[-1], 0.5)
+        rows = np.rint(np.interp(t, path_length, y)).astype(int)
+        columns = np.rint(np.interp(t, path_length, x)).astype(int)
+        # Two pixels thick.
+        for row_offset, column_offset in [(0, 0), (1, 0), (0, 1)]:
+            r = np.clip(rows + row_offset, 0, self.height - 1)
+            c = np.clip(columns + column_offset, 0, self.width - 1)
+            pixels[r, c] = color
+
+    def redraw(self):
+        self.redraw_pending = False
+        if self.parameter_extracter is None:
+            return
+
+        import numpy as np
+        from iv_curve import sample_iv_curve
+
+        temperature_c = self.temperature_c.get()
+        solar_irr = self.solar_irr.get()
+        a, i_o, i_ph, r_s, r_sh = self.parameter_extracter.update_conditions(temperature_c, solar_irr)
+        v, i, (v_mp, i_mp) = sample_iv_curve(a, i_o, i_ph, r_s, r_sh, temperature_c, self.n_cell,
+            n_points=2 * self.width)
+        p = v * i
+
+        # The axis ranges and the mapping from values to pixels.
+        v_step = self.nice_step(v[-1])
+        i_step = self.nice_step(i[0])
+        p_step = self.nice_step(p.max())
+        v_max = v_step * self.n_ticks
+        i_max = i_step * self.n_ticks
+        p_max = p_step * self.n_ticks
+        left, right = self.margin_left, self.width - self.margin_right
+        top, bottom = self.margin_top, self.height - self.margin_bottom
+        to_x = lambda value: left + value / v_max * (right - left)
+        to_y = lambda value, max_value: bottom - value / max_value * (bottom - top)
+
+        pixels = np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        for tick in range(self.n_ticks + 1):
+            x_tick = int(round(to_x(tick * v_step)))
+            y_tick = int(round(to_y(tick * i_step, i_max)))
+            pixels[top:bottom + 1, x_tick] = self.grid_color
+            pixels[y_tick, left:right + 1] = self.grid_color
+            self.canvas.coords(self.tick_labels["v"][tick], x_tick, bottom + 3)
+            self.canvas.itemconfigure(self.tick_labels["v"][tick], text="{:g}".format(tick * v_step))
+            self.canvas.coords(self.tick_labels["i"][tick], left - 3, y_tick)
+            self.canvas.itemconfigure(self.tick_labels["i"][tick], text="{:g}".format(tick * i_step))
+            self.canvas.coords(self.tick_labels["p"][tick], right + 3, y_tick)
+            self.canvas.itemconfigure(self.tick_labels["p"][tick], text="{:g}".format(tick * p_step))
+        pixels[top:bottom + 1, [left, right]] = self.axis_color
+        pixels[bottom, left:right + 1] = self.axis_color
+
+        # Without light the curves are a single point at the origin, and a diverged solution
+        # may give non-finite points. Only finite curves are drawn.
+        if np.all(np.isfinite(v)) and np.all(np.isfinite(i)):
+            self.draw_line(pixels, to_x(v), to_y(i, i_max), self.iv_color)
+            self.draw_line(pixels, to_x(v), to_y(p, p_max), self.pv_color)
+
+        # Mark the maximum power point on both curves.
+        if np.isfinite(v_mp) and np.isfinite(i_mp):
+            x_mp = int(round(to_x(v_mp)))
+            for y_mp in [to_y(i_mp, i_max), to_y(v_mp * i_mp, p_max)]:
+                y_mp = int(round(y_mp))
+                pixels[max(y_mp - 3, 0):y_mp + 4, max(x_mp - 3, 0):x_mp + 4] = self.axis_color
+        self.canvas.itemconfigure(self.mpp_label, text="MPP: {0:.2f} V, {1:.2f} A, {2:.1f} W".format(
+            v_mp, i_mp, v_mp * i_mp))
+
+        # Pass the pixels to Tkinter as a binary PPM image.
+        header = "P6 {0} {1} 255\n".format(self.width, self.height).encode("ascii")
+        self.image.configure(data=header + pixels.tobytes(), format="PPM")
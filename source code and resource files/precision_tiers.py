@@ -0,0 +1,99 @@
+# The precision tiers of the extractors.
+#
+# A tier is a named set of solver settings, so that a screening run can trade
+# accuracy for speed and a final report can require a bound on the residuals:
+#   xtol:            the relative step size at which the solver stops,
+#   ftol:            the relative cost reduction at which the batch solver stops,
+#   maxfev:          the maximum number of function calls of fsolve (0 for
+#                    fsolve's default),
+#   max_iter:        the maximum number of iterations of the batch solver,
+#   residual_tol:    the solver stops as soon as all residuals are at most this
+#                    large (0 to turn the early stopping off),
+#   mismatch_bound:  a solve whose largest mismatch is larger than this is
+#                    reported as not converged (None for no bound),
+#   formulation:     the formulation used by the single module extractor
+#                    whatever formulation is asked for (None to use the one
+#                    asked for). The linear formulation needs over 100
+#                    function calls for the default module even at loose
+#                    tolerances, so the fast tier uses the log formulation,
+#                    where it needs about 11.
+#
+# "standard" is the setting the extractors always used. Instead of a name, a
+# dictionary can be given, which overrides the items of "standard".
+
+
+precision_tiers = {
+    "fast": {
+        "xtol": 1e-6,
+        "ftol": 1e-10,
+        "maxfev": 100,
+        "max_iter": 20,
+        "residual_tol": 1e-6,
+        "mismatch_bound": None,
+        "formulation": "log",
+    },
+    "standard": {
+        "xtol": 1e-12,
+        "ftol": 1e-15,
+        "maxfev": 0,
+        "max_iter": 100,
+        "residual_tol": 0.0,
+        "mismatch_bound": None,
+        "formulation": None,
+    },
+    "strict": {
+        "xtol": 1e-12,
+        "ftol": 1e-15,
+        "maxfev": 2000,
+        "max_iter": 300,
+        "residual_tol": 0.0,
+        "mismatch_bound": 1e-9,
+        "formulation": None,
+    },
+}
+
+def get_precision_tier(precision="standard"):
+    # The solver settings of a tier name or of a dictionary of settings.
+    if isinstance(precision, dict):
+        tier = dict(precision_tiers["standard"])
+        tier.update(precision)
+        return tier
+    if precision not in precision_tiers:
+        raise ValueError("Unknown precision tier: " + str(precision))
+    return dict(precision_tiers[precision])
+
+
+# Unit test: the tiers with the single module extractor (default settings: the linear
+# formulation and fsolve) on the default module and on a synthetic catalog.
+if __name__ == "__main__":
+    import time
+    from pvmmpe import PV_Module_Model_Parameter_Extractor
+    from datasheet_generator import SyntheticDatasheetGenerator
+
+    n_modules = 2000
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    chunk = next(generator.iter_chunks(n_modules))
+    catalog = [{item: chunk[item][module].item() for item in generator.datasheet_items}
+        for module in range(n_modules)]
+
+    print("{:<10}{:>16}{:>12}{:>16}{:>12}{:>12}".format("tier", "default calls", "converged",
+        "catalog calls", "converged", "time (s)"))
+    for precision in precision_tiers:
+        parameter_extracter = PV_Module_Model_Parameter_Extractor()
+        parameter_extracter.extract(precision=precision)
+        solver_info = parameter_extracter.get_solver_info()
+        n_function_calls = 0
+        n_converged = 0
+        start_time = time.perf_counter()
+        for datasheet in catalog:
+            catalog_extracter = PV_Module_Model_Parameter_Extractor(**datasheet)
+            try:
+                catalog_extracter.extract(precision=precision)
+            except (OverflowError, ValueError, ZeroDivisionError) as error:
+                n_function_calls += getattr(error, "n_function_calls", 0)
+                continue
+            n_function_calls += catalog_extracter.get_solver_info()["n_function_calls"]
+            n_converged += catalog_extracter.get_solver_info()["converged"]
+        elapsed_time = time.perf_counter() - start_time
+        print("{:<10}{:>16}{:>12}{:>16}{:>12}{:>12.2f}".format(precision, solver_info["n_function_calls"],
+            str(solver_info["converged"]), n_function_calls, n_converged, elapsed_time))
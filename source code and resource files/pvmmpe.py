@@ -12,10 +12,28 @@
 # is needed. Since Scipy is a free open source package, to avoid reinventing
 # the wheel, it is decided that Scipy's fsolve function is used as the 
 # required nonlinear equation system solver.
+#
+# The nonlinear equations can be solved in two formulations. The "linear" one
+# solves for i_o directly and evaluates the exponentials of the diode
+# equation, which overflow for bad initial values. The "log" one solves for
+# log(i_o) and takes the logarithm of both sides of the two diode equations,
+# so no large exponential is ever evaluated and i_o stays positive.
+#
+# The solver's tolerances and iteration cap are given by a precision tier
+# (see precision_tiers.py). The achieved mismatch of each solve is reported
+# by get_solver_info(). A solve can also be given a time budget, after which
+# it is stopped and reported as not converged.
+#
+# Besides fsolve (MINPACK's hybrid method), Scipy's Levenberg-Marquardt
+# method ("lm") can be used as the solver.
+#
+# The equations are solved by the stateless functions of pvmmpe_solver.py,
+# which can also be used directly from several threads at once.
 
 
-from scipy.optimize import fsolve
-from math import exp
+from pvmmpe_solver import PV_Module_Datasheet, PV_Module_STC_Solution, nonlinear_equations,\
+    solve_stc, working_parameters
+from precision_tiers import get_precision_tier
 
 class PV_Module_Model_Parameter_Extractor:
 
@@ -40,11 +58,19 @@ class PV_Module_Model_Parameter_Extractor:
         self._i_o = 0.0 # diode reverse saturation current.
         self._i_o_stc = 0.0 # i_o at STC.
 
+        # The nonlinear solver's information of the last extraction.
+        self._n_function_calls = 0
+        self._solver_converged = False
+        self._mismatch = None # the largest error of the equations at the solution
+        self._out_of_time = False # if the last solve was stopped by its time budget
+
         # Initialize:
         self._v_oc_stc = v_oc_stc
         self._i_sc_stc = i_sc_stc
         self._v_mp = v_mp
         self._i_mp = i_mp
+        self._temp_coeff_i_perc = temp_coeff_i_perc
+        self._temp_coeff_v_perc = temp_coeff_v_perc
         self._temp_coeff_i = temp_coeff_i_perc / 100 
         # The temperature coefficient's unit is %/C, need to be converted.
         self._temp_coeff_v = temp_coeff_v_perc / 100
@@ -57,43 +83,87 @@ class PV_Module_Model_Parameter_Extractor:
         
 
     def _nonlinear_equations(self, x):
+        return nonlinear_equations(self.get_datasheet_record(), x)
 
-        # Unpack to get the unknown variables.
-        a, i_o, r_s = x
-        # Define the three nonlinear equations
-        f_1 = i_o * (exp(self._q * self._v_oc_stc/(self._n_cell * a * self._k * self._stc_temp_k)) - 1)\
-             - (self._i_sc_stc - self._v_oc_stc / self._r_sh)
-        f_2 = self._i_mp - self._i_sc_stc + i_o * (exp((self._v_mp + r_s*self._i_mp)\
-             / ((self._n_cell* a* self._k* self._stc_temp_k)/self._q)) - 1)\
-                  + (self._v_mp + self._r_s * self._i_mp) / self._r_sh
-        f_3 = r_s + 1 / self._di_dv_oc + (self._n_cell* a* self._k* self._stc_temp_k/ self._q) / self._i_sc_stc
-
-        return [f_1, f_2, f_3]
-
-    def extract(self, a_init = 1.3, r_s_init = 0.3):
-        # note that the temperature coefficient's unit is %/C
-        self._i_ph = self._i_sc_stc * (1 + self._temp_coeff_i * (self._temperature_k - self._stc_temp_k))
-        self._i_ph *= self._solar_irr / self._stc_solar_irr
-
-        self._v_oc = self._v_oc_stc *(1 + self._temp_coeff_v * (self._temperature_k - self._stc_temp_k))
-
+    def extract(self, a_init = 1.3, r_s_init = 0.3, i_o_init = None, formulation = "linear",
+        result_store = None, metadata = None, precision = "standard", solver = "fsolve", time_budget = None):
+        # precision is the name of a precision tier or a dictionary of solver settings.
+        # solver is "fsolve" or "lm". time_budget is the maximum time of the solve in seconds.
         self._r_sh = -1.0 / self._di_dv_sc
+        tier = get_precision_tier(precision)
+
+        # If a result store is given, reuse the stored solution of the same data sheet
+        # solved with the same settings, or store the new solution.
+        # metadata may give the manufacturer and the model for the store.
+        if result_store is not None:
+            # The equations of version 2 use the solved r_s in the second equation.
+            solver_settings = {"solver": solver, "formulation": formulation,
+                "a_init": a_init, "r_s_init": r_s_init, "i_o_init": i_o_init, "equations": 2}
+            solver_settings.update(tier)
+            key = result_store.make_key(self.get_datasheet(), solver_settings)
+            record = result_store.get(key)
+            if record is not None:
+                self._a, self._i_o_stc, self._r_s = record["state"]
+                self._n_function_calls = 0
+                self._solver_converged = record["converged"]
+                self._mismatch = record["mismatch"]
+                self._out_of_time = False
+            else:
+                self._solve(a_init, r_s_init, i_o_init, formulation, tier, solver, time_budget)
+                stored_record = {
+                    "key": key,
+                    "datasheet": self.get_datasheet(),
+                    "solver_settings": solver_settings,
+                    "a": self._a,
+                    "i_o_stc": self._i_o_stc,
+                    "r_s": self._r_s,
+                    "r_sh": self._r_sh,
+                    "state": [self._a, self._i_o_stc, self._r_s],
+                    "mismatch": self._mismatch,
+                    "converged": self._solver_converged,
+                }
+                stored_record.update(metadata or {})
+                # A solve stopped by the time budget may succeed with more time.
+                if not self._out_of_time:
+                    result_store.put(stored_record)
+        else:
+            self._solve(a_init, r_s_init, i_o_init, formulation, tier, solver, time_budget)
+
+        self._update_working_parameters()
 
-        # The inital value of the reverse saturation current, i_o, is calculated by:
-        i_o_init = (self._i_sc_stc - self._v_oc_stc / self._r_sh)\
-             / exp(self._q*self._v_oc_stc/(self._n_cell * a_init * self._k * self._stc_temp_k))
-        
-        # Solve nonlinear equations to get the model parameters.
-        self._a, self._i_o_stc, self._r_s = fsolve(self._nonlinear_equations, [a_init, i_o_init, r_s_init], xtol=1e-12)
+        self._solved = True
+        return self._a, self._i_o, self._i_ph, self._r_s, self._r_sh
 
+    def _solve(self, a_init, r_s_init, i_o_init, formulation, tier, solver="fsolve", time_budget=None):
+        # Solve the nonlinear equations for a, i_o_stc and r_s.
+        stc_solution = solve_stc(self.get_datasheet_record(), a_init, r_s_init, i_o_init, formulation,
+            tier, solver, time_budget)
+        self._a, self._i_o_stc, self._r_s, self._r_sh = stc_solution[:4]
+        self._n_function_calls = stc_solution.n_function_calls
+        self._solver_converged = stc_solution.converged
+        self._mismatch = stc_solution.mismatch
+        self._out_of_time = stc_solution.out_of_time
+
+    def _update_working_parameters(self):
+        # The parameters that depend on the operating condition only, i.e. the ones that
+        # can be calculated in closed form once a, i_o_stc and r_s are known.
+        stc_solution = PV_Module_STC_Solution(self._a, self._i_o_stc, self._r_s, self._r_sh,
+            self._n_function_calls, self._solver_converged, self._mismatch, self._out_of_time)
+        self._a, self._i_o, self._i_ph, self._r_s, self._r_sh = working_parameters(self.get_datasheet_record(),
+            stc_solution, self._temperature_c, self._solar_irr)
+
+    def update_conditions(self, temperature_c, solar_irr):
+        # Recalculate the parameters for a new operating condition without solving
+        # the nonlinear equations again. The STC solution must be available.
+        if not self._solved:
+            return None
 
+        self._temperature_c = temperature_c
+        self._temperature_k = self._temperature_c + 273.15 # convert temperature unit C to K
+        self._solar_irr = solar_irr
 
-        # Update self._i_o based on the new open circuit voltage (1000 W/m^2 irradiance).
-        i_sc_working = self._i_sc_stc * (1 + self._temp_coeff_i * (self._temperature_k - self._stc_temp_k))
-        self._i_o = (i_sc_working - self._v_oc/self._r_sh)\
-             / exp(self._q*self._v_oc/(self._n_cell*self._a*self._k*self._temperature_k))
+        self._update_working_parameters()
 
-        self._solved = True
         return self._a, self._i_o, self._i_ph, self._r_s, self._r_sh
 
     def get_mismatch(self):
@@ -103,6 +173,49 @@ class PV_Module_Model_Parameter_Extractor:
 
         return mismatch
 
+    def get_datasheet(self):
+        # The data sheet inputs that the STC solution depends on.
+        datasheet = {
+            "v_oc_stc": self._v_oc_stc,
+            "i_sc_stc": self._i_sc_stc,
+            "v_mp": self._v_mp,
+            "i_mp": self._i_mp,
+            "temp_coeff_i_perc": self._temp_coeff_i_perc,
+            "temp_coeff_v_perc": self._temp_coeff_v_perc,
+            "n_cell": self._n_cell,
+            "di_dv_sc": self._di_dv_sc,
+            "di_dv_oc": self._di_dv_oc,
+        }
+        return datasheet
+
+    def get_datasheet_record(self):
+        # The data sheet inputs as the immutable record of the stateless solver.
+        return PV_Module_Datasheet(**self.get_datasheet())
+
+    def get_stc_solution(self):
+        # The solution of the nonlinear equations, i.e. the parameters at STC.
+        # It can be used as the initial values of another extraction.
+        if not self._solved:
+            return None
+
+        stc_solution = {
+            "a": self._a,
+            "i_o_stc": self._i_o_stc,
+            "r_s": self._r_s,
+        }
+        return stc_solution
+
+    def get_solver_info(self):
+        # The number of function calls, the convergence flag, the largest mismatch of the
+        # last extraction and if it was stopped by its time budget.
+        solver_info = {
+            "n_function_calls": self._n_function_calls,
+            "converged": self._solver_converged,
+            "mismatch": self._mismatch,
+            "out_of_time": self._out_of_time,
+        }
+        return solver_info
+
     def get_solution(self):
         # Pass the solution to the GUI.
         if not self._solved:
@@ -0,0 +1,173 @@
+# The PV module double-diode model parameter extractor class.
+#
+# The double-diode model adds a second diode to the single-diode model, for
+# the recombination current in the depletion region, which matters for
+# thin-film modules and at low irradiance:
+#   i = i_ph - i_o1*(exp((v + i*r_s)/(a_1*v_t)) - 1)
+#            - i_o2*(exp((v + i*r_s)/(a_2*v_t)) - 1) - (v + i*r_s)/r_sh
+# where v_t = n_cell*k*T/q.
+#
+# The inputs are the same data sheet data as the single-diode extractor. The
+# ideality factors are fixed at a_1 = 1 (diffusion) and a_2 = 2
+# (recombination) by default, and r_sh is given by the slope near the short
+# circuit condition, as in the single-diode extractor. The three unknowns
+# i_o1, i_o2 and r_s are solved from the same three conditions as the
+# single-diode model: the open circuit point, the maximum power point and the
+# slope near the open circuit condition, where the slope uses the exact small
+# signal conductance of both diodes and the shunt resistor.
+#
+# The class shares the vectorized batch solver infrastructure of
+# PV_Module_Batch_Extractor: the inputs can be scalars (one module) or arrays
+# (a batch of modules), and the equations are solved with their analytic
+# Jacobian. The saturation currents are solved as log(i_o1) and log(i_o2) so
+# they stay positive.
+#
+# extract() and update_conditions() return the same five parameters as the
+# single-diode extractors (a and i_o are those of the first diode), so the
+# class can be used in their place. The second diode's i_o2 and a_2 are given
+# by get_solution().
+
+
+import numpy as np
+from batch_extractor import PV_Module_Batch_Extractor
+
+class PV_Module_Double_Diode_Model_Parameter_Extractor(PV_Module_Batch_Extractor):
+
+    def __init__(self, v_oc_stc=44.9, i_sc_stc=8.53, v_mp=36.1, i_mp=8.04,
+    temp_coeff_i_perc=0.046, temp_coeff_v_perc=-0.33, n_cell=72,
+     di_dv_sc=-2.488e-3, di_dv_oc=-2.05,
+     temperature_c=25, solar_irr =1000, a_1=1.0, a_2=2.0):
+        super().__init__(v_oc_stc, i_sc_stc, v_mp, i_mp, temp_coeff_i_perc, temp_coeff_v_perc,
+            n_cell, di_dv_sc, di_dv_oc, temperature_c, solar_irr)
+
+        # The fixed ideality factors of the two diodes.
+        self._a_1 = np.broadcast_to(np.asarray(a_1, dtype=float), (self._n_modules,))
+        self._a_2 = np.broadcast_to(np.asarray(a_2, dtype=float), (self._n_modules,))
+
+        # The parameters of the second diode that need to be extracted:
+        self._i_o2 = None # the second diode's reverse saturation current
+        self._i_o2_stc = None # i_o2 at STC.
+
+    def _nonlinear_equations(self, x, index):
+        # The data sheet equations and their analytic Jacobian for the modules in index.
+        # x holds one row of (log(i_o1), log(i_o2), r_s) per module.
+        i_o1, i_o2, r_s = np.exp(x[:, 0]), np.exp(x[:, 1]), x[:, 2]
+        a_1_v_t = self._a_1[index] * self._v_t_stc[index]
+        a_2_v_t = self._a_2[index] * self._v_t_stc[index]
+        v_oc_stc = self._v_oc_stc[index]
+        i_sc_stc = self._i_sc_stc[index]
+        v_mp = self._v_mp[index]
+        i_mp = self._i_mp[index]
+        r_sh = self._r_sh[index]
+
+        # The diode exponents at the open circuit point and the maximum power point.
+        v_d_mp = v_mp + r_s * i_mp
+        exp_11 = np.exp(np.minimum(v_oc_stc / a_1_v_t, 700.0)) # avoid overflow
+        exp_12 = np.exp(np.minimum(v_oc_stc / a_2_v_t, 700.0))
+        exp_21 = np.exp(np.minimum(v_d_mp / a_1_v_t, 700.0))
+        exp_22 = np.exp(np.minimum(v_d_mp / a_2_v_t, 700.0))
+
+        # The small signal conductance at the open circuit point. The slope there is
+        # -g_oc / (1 + r_s*g_oc).
+        g_oc = i_o1 * exp_11 / a_1_v_t + i_o2 * exp_12 / a_2_v_t + 1 / r_sh
+
+        f = np.empty((len(index), 3))
+        f[:, 0] = i_o1 * (exp_11 - 1) + i_o2 * (exp_12 - 1) - (i_sc_stc - v_oc_stc / r_sh)
+        f[:, 1] = i_mp - i_sc_stc + i_o1 * (exp_21 - 1) + i_o2 * (exp_22 - 1) + v_d_mp / r_sh
+        f[:, 2] = r_s + 1 / self._di_dv_oc[index] + 1 / g_oc
+
+        jacobian = np.zeros((len(index), 3, 3))
+        jacobian[:, 0, 0] = i_o1 * (exp_11 - 1)
+        jacobian[:, 0, 1] = i_o2 * (exp_12 - 1)
+        jacobian[:, 1, 0] = i_o1 * (exp_21 - 1)
+        jacobian[:, 1, 1] = i_o2 * (exp_22 - 1)
+        jacobian[:, 1, 2] = i_mp * (i_o1 * exp_21 / a_1_v_t + i_o2 * exp_22 / a_2_v_t + 1 / r_sh)
+        jacobian[:, 2, 0] = -(i_o1 * exp_11 / a_1_v_t) / g_oc**2
+        jacobian[:, 2, 1] = -(i_o2 * exp_12 / a_2_v_t) / g_oc**2
+        jacobian[:, 2, 2] = 1.0
+        return f, jacobian
+
+    def _initial_values(self, a_init, r_s_init):
+        # The initial saturation currents are chosen so that both diodes carry half of
+        # the current at the open circuit point. a_init is not used as the ideality
+        # factors are fixed.
+        r_s_init = np.broadcast_to(np.asarray(r_s_init, dtype=float), (self._n_modules,))
+        i_diode = self._i_sc_stc - self._v_oc_stc / self._r_sh
+        i_o1_init = 0.5 * i_diode / np.exp(self._v_oc_stc / (self._a_1 * self._v_t_stc))
+        i_o2_init = 0.5 * i_diode / np.exp(self._v_oc_stc / (self._a_2 * self._v_t_stc))
+        return np.column_stack((np.log(i_o1_init), np.log(i_o2_init), r_s_init))
+
+    def _solver_settings(self, a_init, r_s_init):
+        # The fixed ideality factors are part of the solver settings.
+        r_s_init = np.broadcast_to(np.asarray(r_s_init, dtype=float), (self._n_modules,))
+        return [{"solver": "batch_double_diode", "a_1": self._a_1[module], "a_2": self._a_2[module],
+            "r_s_init": r_s_init[module]} for module in range(self._n_modules)]
+
+    def _set_stc_solution(self, x):
+        # a is the first diode's ideality factor.
+        self._a = self._a_1
+        self._i_o_stc, self._i_o2_stc, self._r_s = np.exp(x[:, 0]), np.exp(x[:, 1]), x[:, 2]
+
+    def extract(self, a_init = 1.0, r_s_init = 0.3, max_iter = None, result_store = None, metadata = None,
+        precision = "standard"):
+        # The same interface as the single-diode extractors. a_init is not used.
+        return super().extract(a_init, r_s_init, max_iter, result_store, metadata, precision)
+
+    def _update_working_parameters(self):
+        # The photon current and the open circuit voltage change in the same way as the
+        # single-diode model. Both saturation currents are scaled by the same factor so
+        # that the open circuit condition holds at the new temperature.
+        i_sc_working = self._i_sc_stc * (1 + self._temp_coeff_i * (self._temperature_k - self._stc_temp_k))
+        self._i_ph = i_sc_working * self._solar_irr / self._stc_solar_irr
+
+        self._v_oc = self._v_oc_stc *(1 + self._temp_coeff_v * (self._temperature_k - self._stc_temp_k))
+
+        v_t = self._n_cell * self._k * self._temperature_k / self._q
+        i_diode_stc = self._i_o_stc * np.exp(self._v_oc / (self._a * v_t))\
+            + self._i_o2_stc * np.exp(self._v_oc / (self._a_2 * v_t))
+        scale = (i_sc_working - self._v_oc/self._r_sh) / i_diode_stc
+        self._i_o = self._i_o_stc * scale
+        self._i_o2 = self._i_o2_stc * scale
+
+    def get_solution(self):
+        # The extracted parameters. i_o is the first diode's saturation current.
+        solution = super().get_solution()
+        if solution is None:
+            return None
+
+        solution["i_o2"] = self._output(self._i_o2)
+        solution["a_2"] = self._output(self._a_2)
+        return solution
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+
+    parameter_extracter = PV_Module_Double_Diode_Model_Parameter_Extractor()
+    a_1, i_o1, i_ph, r_s, r_sh = parameter_extracter.extract()
+    i_o2 = parameter_extracter.get_solution()["i_o2"]
+    print("")
+    print("The extracted PV module double-diode parameters are:")
+    print("a_1 = " + str(a_1))
+    print("I_o1 = " + str(i_o1))
+    print("I_o2 = " + str(i_o2))
+    print("I_ph = " + str(i_ph))
+    print("R_s = " + str(r_s))
+    print("R_sh = " + str(r_sh))
+    print("mismatch = " + str(parameter_extracter.get_mismatch()))
+
+    # Compare the batch speed with the single-diode batch extractor.
+    n_modules = 100000
+    rng = np.random.default_rng(0)
+    scale = rng.uniform(0.8, 1.2, n_modules)
+    catalog = dict(v_oc_stc=44.9 * scale, i_sc_stc=8.53 * scale, v_mp=36.1 * scale,
+        i_mp=8.04 * scale, di_dv_oc=-2.05 / scale)
+    for extractor_class in [PV_Module_Batch_Extractor, PV_Module_Double_Diode_Model_Parameter_Extractor]:
+        batch_extractor = extractor_class(**catalog)
+        start_time = time.perf_counter()
+        batch_extractor.extract()
+        elapsed_time = time.perf_counter() - start_time
+        print(extractor_class.__name__ + ": " + str(n_modules) + " modules in "
+            + "{:.3f}".format(elapsed_time) + " s, converged: "
+            + str(batch_extractor.get_solver_info()["converged"].sum()))
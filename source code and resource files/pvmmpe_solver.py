@@ -0,0 +1,304 @@
+# The reentrant solver of the PV module model parameter extractor.
+#
+# PV_Module_Model_Parameter_Extractor keeps its data sheet and its solution
+# in the instance, so one instance can not be used by several threads at the
+# same time. The functions here do the same calculation without any state:
+# the data sheet is given as an immutable PV_Module_Datasheet record, the
+# solution is returned as an immutable PV_Module_STC_Solution record, and
+# nothing else is read or written. So they can be called from any number of
+# threads at once, and PV_Module_Model_Parameter_Extractor only delegates to
+# them.
+#
+# Many data sheets can be solved on a thread pool in two ways. The threads
+# share the memory of the caller, so no data sheet or solution is copied
+# across process boundaries.
+#   - solve_stc_many() runs solve_stc() for every data sheet, with all of its
+#     settings (formulation, solver, time budget). The scalar solves hold the
+#     GIL in their Python callbacks, so the threads do not run in parallel.
+#   - solve_stc_chunks() splits the data sheets into chunks, and each thread
+#     solves its chunks with its own vectorized batch extractor
+#     (batch_solver.py), whose numpy operations release the GIL, so the
+#     threads run in parallel. The batch solver always solves the log
+#     formulation with Levenberg-Marquardt and has no time budget, so its
+#     results are PV_Module_Batch_STC_Solution records, with the number of
+#     iterations instead of the number of function calls.
+
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from math import exp, expm1, log, log1p
+from typing import NamedTuple
+import numpy as np
+from scipy.optimize import fsolve, root
+from batch_extractor import PV_Module_Batch_Extractor
+from precision_tiers import get_precision_tier
+
+# Some physical constants:
+q = 1.6e-19 # the charge of an electron in SI unit
+k = 1.38e-23 # Boltzmann constant in SI unit
+stc_temp_k = 25.0 + 273.15 # STC condition temperature with unit K
+stc_solar_irr = 1000 # STC condition solar irradiation with unit W/(m^2)
+
+class PV_Module_Datasheet(NamedTuple):
+    # The data sheet inputs that the STC solution depends on.
+    v_oc_stc: float = 44.9
+    i_sc_stc: float = 8.53
+    v_mp: float = 36.1
+    i_mp: float = 8.04
+    temp_coeff_i_perc: float = 0.046
+    temp_coeff_v_perc: float = -0.33
+    n_cell: float = 72
+    di_dv_sc: float = -2.488e-3
+    di_dv_oc: float = -2.05
+
+class PV_Module_STC_Solution(NamedTuple):
+    # The solution of the nonlinear equations and the solver's information.
+    a: float
+    i_o_stc: float
+    r_s: float
+    r_sh: float
+    n_function_calls: int
+    converged: bool
+    mismatch: float # the largest error of the equations at the solution
+    out_of_time: bool # if the solve was stopped by its time budget
+
+class PV_Module_Batch_STC_Solution(NamedTuple):
+    # The solution of the nonlinear equations by the batch solver and its information.
+    a: float
+    i_o_stc: float
+    r_s: float
+    r_sh: float
+    n_iterations: int
+    converged: bool
+    mismatch: float # the largest error of the equations at the solution
+
+class _SolverStopped(Exception):
+    # Raised from the equations to stop the solver early, when the residuals are small
+    # enough (converged) or when the time budget is used up (not converged).
+    def __init__(self, x, n_function_calls, converged):
+        super().__init__()
+        self.x = x
+        self.n_function_calls = n_function_calls
+        self.converged = converged
+
+def shunt_resistance(datasheet):
+    return -1.0 / datasheet.di_dv_sc
+
+def nonlinear_equations(datasheet, x):
+    # The three nonlinear equations in a, i_o and r_s.
+    a, i_o, r_s = x
+    r_sh = shunt_resistance(datasheet)
+    n_a_v_t = datasheet.n_cell * a * k * stc_temp_k / q
+    f_1 = i_o * (exp(datasheet.v_oc_stc / n_a_v_t) - 1) - (datasheet.i_sc_stc - datasheet.v_oc_stc / r_sh)
+    f_2 = datasheet.i_mp - datasheet.i_sc_stc + i_o * (exp((datasheet.v_mp + r_s * datasheet.i_mp) / n_a_v_t) - 1)\
+        + (datasheet.v_mp + r_s * datasheet.i_mp) / r_sh
+    f_3 = r_s + 1 / datasheet.di_dv_oc + n_a_v_t / datasheet.i_sc_stc
+
+    return [f_1, f_2, f_3]
+
+def _log_expm1(x):
+    # log(exp(x) - 1) without evaluating exp(x), for x > 0.
+    x = max(x, 1e-300)
+    if x > 1.0:
+        return x + log1p(-exp(-x))
+    return log(expm1(x))
+
+def log_nonlinear_equations(datasheet, x):
+    # The same equations as nonlinear_equations in the log domain, in a, log(i_o) and r_s.
+    a, log_i_o, r_s = x
+    r_sh = shunt_resistance(datasheet)
+    n_a_v_t = datasheet.n_cell * a * k * stc_temp_k / q
+    # The currents of the diode at the open circuit point and the maximum power point.
+    i_d_oc = datasheet.i_sc_stc - datasheet.v_oc_stc / r_sh
+    i_d_mp = datasheet.i_sc_stc - datasheet.i_mp - (datasheet.v_mp + r_s * datasheet.i_mp) / r_sh
+    # log(i_o*(exp(v/(n*a*v_t)) - 1)) - log(i_d)
+    f_1 = log_i_o + _log_expm1(datasheet.v_oc_stc / n_a_v_t) - log(max(i_d_oc, 1e-300))
+    f_2 = log_i_o + _log_expm1((datasheet.v_mp + r_s * datasheet.i_mp) / n_a_v_t) - log(max(i_d_mp, 1e-300))
+    f_3 = r_s + 1 / datasheet.di_dv_oc + n_a_v_t / datasheet.i_sc_stc
+
+    return [f_1, f_2, f_3]
+
+def solve_stc(datasheet, a_init=1.3, r_s_init=0.3, i_o_init=None, formulation="linear",
+    precision="standard", solver="fsolve", time_budget=None):
+    # Solve the nonlinear equations of a data sheet (a PV_Module_Datasheet) for a, i_o_stc
+    # and r_s. precision is the name of a precision tier or a dictionary of solver settings.
+    # solver is "fsolve" or "lm". time_budget is the maximum time of the solve in seconds.
+    # Returns a PV_Module_STC_Solution.
+    tier = get_precision_tier(precision)
+    r_sh = shunt_resistance(datasheet)
+    # A tier may fix the formulation (the fast tier uses the log formulation).
+    if tier["formulation"] is not None:
+        formulation = tier["formulation"]
+
+    # The inital value of the reverse saturation current, i_o, is calculated by
+    # the following if it is not given (e.g. from a previous solution):
+    if i_o_init is None:
+        i_o_init = (datasheet.i_sc_stc - datasheet.v_oc_stc / r_sh)\
+            / exp(q * datasheet.v_oc_stc / (datasheet.n_cell * a_init * k * stc_temp_k))
+
+    if formulation == "linear":
+        equations = lambda x: nonlinear_equations(datasheet, x)
+        x_init = [a_init, i_o_init, r_s_init]
+    elif formulation == "log":
+        equations = lambda x: log_nonlinear_equations(datasheet, x)
+        x_init = [a_init, log(i_o_init), r_s_init]
+    else:
+        raise ValueError("Unknown formulation: " + str(formulation))
+
+    # Stop as soon as all residuals are within the tier's residual tolerance, or when
+    # the time budget is used up. The function calls are counted, including a call that
+    # raises an error.
+    residual_tol = tier["residual_tol"]
+    deadline = None if time_budget is None else time.perf_counter() + time_budget
+    n_calls = [0]
+    def equations_with_early_stop(x):
+        n_calls[0] += 1
+        f = equations(x)
+        if max(abs(value) for value in f) <= residual_tol:
+            raise _SolverStopped(x, n_calls[0], True)
+        if deadline is not None and time.perf_counter() > deadline:
+            raise _SolverStopped(x, n_calls[0], False)
+        return f
+    def counted_equations(x):
+        n_calls[0] += 1
+        return equations(x)
+    if residual_tol <= 0 and deadline is None:
+        equations_with_early_stop = counted_equations
+
+    # Solve nonlinear equations to get the model parameters.
+    out_of_time = False
+    try:
+        if solver == "fsolve":
+            solution, infodict, ier, message = fsolve(equations_with_early_stop, x_init,
+                xtol=tier["xtol"], maxfev=tier["maxfev"], full_output=True)
+            n_function_calls = infodict["nfev"]
+            converged = ier == 1
+        elif solver == "lm":
+            result = root(equations_with_early_stop, x_init, method="lm",
+                options={"xtol": tier["xtol"], "maxiter": tier["maxfev"]})
+            solution = result.x
+            n_function_calls = result.nfev
+            converged = bool(result.success)
+        else:
+            raise ValueError("Unknown solver: " + str(solver))
+    except _SolverStopped as early_stop:
+        solution = early_stop.x
+        n_function_calls = early_stop.n_function_calls
+        converged = early_stop.converged
+        out_of_time = not early_stop.converged
+    except (OverflowError, ValueError, ZeroDivisionError) as error:
+        # e.g. math.exp overflows in the linear formulation. The number of function calls
+        # made before the error is given to the caller with it.
+        error.n_function_calls = n_calls[0]
+        raise
+
+    if formulation == "linear":
+        a, i_o_stc, r_s = [float(value) for value in solution]
+    else:
+        a, r_s = float(solution[0]), float(solution[2])
+        i_o_stc = exp(solution[1])
+
+    # The mismatch is always evaluated with the linear equations. A solve that does
+    # not meet the tier's bound is not converged.
+    try:
+        mismatch = max(abs(f) for f in nonlinear_equations(datasheet, [a, i_o_stc, r_s]))
+    except OverflowError:
+        mismatch = float("inf")
+    if tier["mismatch_bound"] is not None and not mismatch <= tier["mismatch_bound"]:
+        converged = False
+
+    return PV_Module_STC_Solution(a, i_o_stc, r_s, r_sh, int(n_function_calls), bool(converged),
+        mismatch, out_of_time)
+
+def working_parameters(datasheet, stc_solution, temperature_c=25, solar_irr=1000):
+    # The parameters a, i_o, i_ph, r_s and r_sh at an operating condition, in closed form
+    # from the STC solution.
+    temperature_k = temperature_c + 273.15 # convert temperature unit C to K
+    # note that the temperature coefficient's unit is %/C
+    i_sc_working = datasheet.i_sc_stc * (1 + datasheet.temp_coeff_i_perc / 100 * (temperature_k - stc_temp_k))
+    i_ph = i_sc_working * solar_irr / stc_solar_irr
+    v_oc = datasheet.v_oc_stc * (1 + datasheet.temp_coeff_v_perc / 100 * (temperature_k - stc_temp_k))
+    # i_o based on the open circuit voltage at the temperature (1000 W/m^2 irradiance). For
+    # a diverged solution (e.g. a near 0), the exponential under- or overflows, and i_o is
+    # inf or 0 without a warning.
+    with np.errstate(divide="ignore", over="ignore", invalid="ignore"):
+        exponent = np.float64(q) * v_oc / (datasheet.n_cell * stc_solution.a * k * temperature_k)
+        i_o = float((i_sc_working - v_oc / stc_solution.r_sh) / np.exp(exponent))
+    return stc_solution.a, i_o, i_ph, stc_solution.r_s, stc_solution.r_sh
+
+def _datasheet_records(datasheets):
+    return [datasheet if isinstance(datasheet, PV_Module_Datasheet) else PV_Module_Datasheet(**datasheet)
+        for datasheet in datasheets]
+
+def solve_stc_many(datasheets, n_threads=None, **solve_settings):
+    # Solve many data sheets (PV_Module_Datasheet records, or dictionaries of their items)
+    # with solve_stc() on a thread pool. solve_settings are passed to every solve. Returns
+    # the list of PV_Module_STC_Solution records, in the order of datasheets.
+    datasheets = _datasheet_records(datasheets)
+    n_threads = n_threads or min(32, os.cpu_count() or 1)
+    if n_threads == 1:
+        return [solve_stc(datasheet, **solve_settings) for datasheet in datasheets]
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        return list(executor.map(lambda datasheet: solve_stc(datasheet, **solve_settings), datasheets))
+
+def _solve_chunk(columns, a_init, r_s_init, precision):
+    # Solve a chunk of data sheets (a dictionary of arrays) with a batch extractor of its own.
+    batch_extractor = PV_Module_Batch_Extractor(**columns)
+    batch_extractor.extract(a_init, r_s_init, precision=precision)
+    stc_solution = batch_extractor.get_stc_solution()
+    solver_info = batch_extractor.get_solver_info()
+    r_sh = -1.0 / columns["di_dv_sc"]
+    return [PV_Module_Batch_STC_Solution(*values) for values in zip(stc_solution["a"].tolist(),
+        stc_solution["i_o_stc"].tolist(), stc_solution["r_s"].tolist(), r_sh.tolist(),
+        solver_info["n_iterations"].tolist(), solver_info["converged"].tolist(), solver_info["mismatch"].tolist())]
+
+def solve_stc_chunks(datasheets, n_threads=None, chunk_size=None, a_init=1.3, r_s_init=0.3, precision="standard"):
+    # Solve many data sheets (PV_Module_Datasheet records, or dictionaries of their items)
+    # with the batch solver, in chunks of chunk_size (by default, one chunk per thread) on a
+    # thread pool. Returns the list of PV_Module_Batch_STC_Solution records, in the order
+    # of datasheets.
+    datasheets = _datasheet_records(datasheets)
+    if not datasheets:
+        return []
+    rows = np.array(datasheets, dtype=float)
+    n_threads = n_threads or min(32, os.cpu_count() or 1)
+    chunk_size = chunk_size or -(-len(datasheets) // n_threads)
+    chunks = [{item: rows[start:start + chunk_size, column] for column, item in enumerate(PV_Module_Datasheet._fields)}
+        for start in range(0, len(datasheets), chunk_size)]
+    solve = lambda columns: _solve_chunk(columns, a_init, r_s_init, precision)
+    if n_threads == 1:
+        solutions = [solve(columns) for columns in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            solutions = list(executor.map(solve, chunks))
+    return [solution for chunk_solutions in solutions for solution in chunk_solutions]
+
+
+# Unit test.
+if __name__ == "__main__":
+    from datasheet_generator import SyntheticDatasheetGenerator
+
+    n_modules = 5000
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    chunk = next(generator.iter_chunks(n_modules))
+    datasheets = [PV_Module_Datasheet(*[chunk[item][module].item() for item in PV_Module_Datasheet._fields])
+        for module in range(n_modules)]
+
+    for solve_many, settings in [(solve_stc_many, {"formulation": "log"}), (solve_stc_chunks, {})]:
+        results = {}
+        for n_threads in [1, 4]:
+            start_time = time.perf_counter()
+            results[n_threads] = solve_many(datasheets, n_threads, **settings)
+            print(solve_many.__name__ + ", " + str(n_threads) + " thread(s): " + str(n_modules) + " modules in "
+                + "{:.2f}".format(time.perf_counter() - start_time) + " s")
+        print("same results on 1 and 4 threads: " + str(results[1] == results[4]))
+        converged = [solution.converged for solution in results[4]]
+        print("converged: " + str(sum(converged)) + ", max mismatch: "
+            + str(max(solution.mismatch for solution in results[4] if solution.converged)))
+        if solve_many is solve_stc_many:
+            scalar_results = results[4]
+        else:
+            print("max relative difference of r_s from solve_stc(): " + str(max(abs(solution.r_s
+                / scalar_solution.r_s - 1) for solution, scalar_solution in zip(results[4], scalar_results)
+                if solution.converged and scalar_solution.converged)))
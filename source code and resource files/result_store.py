@@ -0,0 +1,176 @@
+# The persistent result store class.
+#
+# The same catalogs are extracted again and again, on different days and on
+# different machines. The instance of this class keeps the solutions in an
+# embedded SQLite database file, so that a data sheet that was solved before
+# with the same solver settings does not need to be solved again.
+#
+# Each solution is keyed by a canonical hash of the data sheet inputs and the
+# solver settings. Only the STC solution is stored, as the parameters for any
+# operating condition are calculated from it in closed form.
+#
+# Besides the key, the manufacturer, the model and the main parameters are
+# stored in indexed columns, so the store can be queried by manufacturer or
+# by parameter ranges. The solver's own vector of unknowns is kept as text
+# with the exact float values so that an extractor can restore its solution.
+
+
+import hashlib
+import json
+import sqlite3
+import time
+
+class ResultStore:
+
+    # The data sheet inputs that the STC solution depends on.
+    datasheet_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc",
+        "temp_coeff_v_perc", "n_cell", "di_dv_sc", "di_dv_oc"]
+
+    # The maximum number of keys in one SELECT statement (SQLite's parameter limit).
+    _query_chunk_size = 500
+
+    def __init__(self, database_file=":memory:"):
+        # check_same_thread is disabled so that the GUI and its worker threads can
+        # share the store. The writes are done in transactions.
+        self._connection = sqlite3.connect(database_file, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        with self._connection:
+            self._connection.execute("""CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                manufacturer TEXT,
+                model TEXT,
+                datasheet TEXT,
+                solver_settings TEXT,
+                a REAL,
+                i_o_stc REAL,
+                r_s REAL,
+                r_sh REAL,
+                state TEXT,
+                mismatch REAL,
+                converged INTEGER,
+                created REAL)""")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_manufacturer_model ON results (manufacturer, model)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_r_s ON results (r_s)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_r_sh ON results (r_sh)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS results_a ON results (a)")
+
+    def close(self):
+        self._connection.close()
+
+    def _canonical_value(self, value):
+        # Numbers are converted to Python floats (also numpy numbers), so e.g. 72 and
+        # 72.0 give the same text. repr() of a float is exact.
+        if value is None or isinstance(value, str):
+            return repr(value)
+        return repr(float(value))
+
+    def _canonical_text(self, values):
+        # The canonical text of a dictionary, with the items sorted by name.
+        return ";".join(item + "=" + self._canonical_value(values[item]) for item in sorted(values))
+
+    def _json_text(self, values):
+        # The JSON text of a dictionary, stored for reading the results back.
+        return json.dumps({item: value if value is None or isinstance(value, str) else float(value)
+            for item, value in values.items()}, sort_keys=True)
+
+    def make_key(self, datasheet, solver_settings):
+        # The canonical hash of the data sheet inputs and the solver settings.
+        datasheet_text = ";".join(self._canonical_value(datasheet[item]) for item in self.datasheet_items)
+        settings_text = self._canonical_text(solver_settings)
+        return hashlib.sha256((datasheet_text + "|" + settings_text).encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        # Look up many keys. Returns a dictionary from the found keys to their records.
+        records = {}
+        keys = list(keys)
+        for start in range(0, len(keys), self._query_chunk_size):
+            chunk = keys[start:start + self._query_chunk_size]
+            rows = self._connection.execute(
+                "SELECT key, a, i_o_stc, r_s, r_sh, state, mismatch, converged FROM results WHERE key IN ("
+                + ",".join("?" * len(chunk)) + ")", chunk)
+            for key, a, i_o_stc, r_s, r_sh, state, mismatch, converged in rows:
+                records[key] = {
+                    "a": a,
+                    "i_o_stc": i_o_stc,
+                    "r_s": r_s,
+                    "r_sh": r_sh,
+                    "state": [float(value) for value in state.split(",")],
+                    "mismatch": mismatch,
+                    "converged": bool(converged),
+                }
+        return records
+
+    def get(self, key):
+        # Look up one key. Returns the record or None.
+        return self.get_many([key]).get(key)
+
+    def put_many(self, records):
+        # Write many records in one transaction. Each record is a dictionary with the key,
+        # the data sheet, the solver settings, the STC solution (a, i_o_stc, r_s, r_sh),
+        # the solver's state vector, the mismatch, the convergence flag and optionally
+        # the manufacturer and the model.
+        created = time.time()
+        rows = [(
+            record["key"],
+            record.get("manufacturer"),
+            record.get("model"),
+            self._json_text({item: record["datasheet"][item] for item in self.datasheet_items}),
+            self._json_text(record["solver_settings"]),
+            float(record["a"]),
+            float(record["i_o_stc"]),
+            float(record["r_s"]),
+            float(record["r_sh"]),
+            ",".join(repr(float(value)) for value in record["state"]),
+            float(record["mismatch"]),
+            int(bool(record["converged"])),
+            created,
+        ) for record in records]
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def put(self, record):
+        return self.put_many([record])
+
+    def query(self, manufacturer=None, model=None, a_range=None, r_s_range=None, r_sh_range=None,
+        converged_only=True):
+        # Find stored results by manufacturer, model and parameter ranges (min, max).
+        conditions = []
+        values = []
+        if manufacturer is not None:
+            conditions.append("manufacturer = ?")
+            values.append(manufacturer)
+        if model is not None:
+            conditions.append("model = ?")
+            values.append(model)
+        for column, value_range in [("a", a_range), ("r_s", r_s_range), ("r_sh", r_sh_range)]:
+            if value_range is not None:
+                conditions.append(column + " BETWEEN ? AND ?")
+                values.extend(value_range)
+        if converged_only:
+            conditions.append("converged = 1")
+
+        sql = "SELECT key, manufacturer, model, datasheet, solver_settings, a, i_o_stc, r_s, r_sh, mismatch FROM results"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        results = []
+        for key, manufacturer, model, datasheet, solver_settings, a, i_o_stc, r_s, r_sh, mismatch\
+            in self._connection.execute(sql, values):
+            results.append({
+                "key": key,
+                "manufacturer": manufacturer,
+                "model": model,
+                "datasheet": json.loads(datasheet),
+                "solver_settings": json.loads(solver_settings),
+                "a": a,
+                "i_o_stc": i_o_stc,
+                "r_s": r_s,
+                "r_sh": r_sh,
+                "mismatch": mismatch,
+            })
+        return results
+
+    def count(self):
+        return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
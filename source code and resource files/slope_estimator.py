@@ -0,0 +1,150 @@
+# The I-V curve end slope estimator class.
+#
+# ShortCircuitWindow and OpenCircuitWindow get the slopes dI/dV near the short
+# circuit and the open circuit conditions from two cursor positions on a
+# picture of the curve. When the digitized (V, I) points of the curves are
+# already available, the instance of this class estimates both slopes for
+# many modules at once instead.
+#
+# At each end of a curve, a local polynomial i = c_0 + c_1*x + c_2*x^2 + ...
+# in x = v - v_end is fitted to the points whose voltages are close to the
+# end, and the slope is c_1. The fits of all modules are solved together as a
+# stack of small weighted least squares problems. Outliers (e.g. digitizing
+# errors) are down-weighted with a few iterations of reweighting with
+# Tukey's bisquare function.
+#
+# The slopes are checked in the same way as in the slope windows: a short
+# circuit slope above -1e-6 A/V is set to -1e-6, and an open circuit slope
+# above 0 or below -1e6 A/V is set to -1e6. The results can be passed
+# directly to PV_Module_Batch_Extractor.
+#
+# The points of each module are given as one row of a 2-D array. Curves with
+# fewer points are padded with NaN (see pack_points()).
+
+
+import numpy as np
+
+class IV_Slope_Estimator:
+
+    def __init__(self, window_sc=0.2, window_oc=0.05, min_points=5, degree=2, n_robust_iterations=3):
+        # The local fits use the points within window_sc (window_oc) times the voltage
+        # range from the end of the curve, but at least the min_points nearest points.
+        self._window_sc = window_sc
+        self._window_oc = window_oc
+        self._min_points = min_points
+        self._degree = degree
+        # The number of reweighting iterations for outliers (0 for plain least squares).
+        self._n_robust_iterations = n_robust_iterations
+
+        # The limits of the slopes, the same as in the slope windows.
+        self._max_slope_sc = -1e-6
+        self._min_slope_oc = -1e6
+
+    def pack_points(self, v_list, i_list):
+        # Pack curves of different lengths into 2-D arrays padded with NaN.
+        n_max = max(len(v) for v in v_list)
+        v = np.full((len(v_list), n_max), np.nan)
+        i = np.full((len(i_list), n_max), np.nan)
+        for row, (v_row, i_row) in enumerate(zip(v_list, i_list)):
+            v[row, :len(v_row)] = v_row
+            i[row, :len(i_row)] = i_row
+        return v, i
+
+    def _local_slope(self, v, i, v_end, window):
+        # Fit the local polynomials at v_end (one per module) and return their slopes.
+        valid = np.isfinite(v) & np.isfinite(i)
+        distance = np.where(valid, np.abs(v - v_end[:, None]), np.inf)
+
+        # The half width of the window: a fraction of the voltage range, or the distance
+        # of the min_points-th nearest point if that is larger.
+        v_range = np.nanmax(np.where(valid, v, np.nan), axis=1) - np.nanmin(np.where(valid, v, np.nan), axis=1)
+        n_nearest = min(self._min_points, v.shape[1]) - 1
+        nearest_distance = np.partition(distance, n_nearest, axis=1)[:, n_nearest]
+        half_width = np.maximum(window * v_range, nearest_distance)
+        half_width = np.where(np.isfinite(half_width) & (half_width > 0), half_width, 1.0)
+
+        # Scale x to [-1, 1] in the window for a well conditioned fit.
+        weights = (distance <= half_width[:, None]).astype(float)
+        x = np.where(valid, (v - v_end[:, None]) / half_width[:, None], 0.0)
+        y = np.where(valid, i, 0.0)
+        design = x[:, :, None] ** np.arange(self._degree + 1) # (n_modules, n_points, degree + 1)
+
+        for iteration in range(self._n_robust_iterations + 1):
+            weighted_design = design * weights[:, :, None]
+            normal_matrix = np.einsum("npk,npl->nkl", weighted_design, design)
+            normal_matrix += 1e-12 * np.eye(self._degree + 1) # singular for too few points
+            coefficients = np.linalg.solve(normal_matrix, np.einsum("npk,np->nk", weighted_design, y)[:, :, None])[:, :, 0]
+            if iteration == self._n_robust_iterations:
+                break
+            # Tukey's bisquare weights with the scale from the median absolute residual.
+            in_window = weights > 0
+            residuals = y - np.einsum("npk,nk->np", design, coefficients)
+            scale = np.nanmedian(np.where(in_window, np.abs(residuals), np.nan), axis=1) / 0.6745
+            u = residuals / (4.685 * np.maximum(scale, 1e-12)[:, None])
+            weights = np.where(in_window & (np.abs(u) < 1), (1 - u**2)**2, 0.0)
+
+        return coefficients[:, 1] / half_width
+
+    def estimate(self, v, i):
+        # Estimate the slopes of the curves. v and i have one row of points per module.
+        # Returns di_dv_sc and di_dv_oc and whether each of them was clamped.
+        v = np.atleast_2d(np.asarray(v, dtype=float))
+        i = np.atleast_2d(np.asarray(i, dtype=float))
+        valid = np.isfinite(v) & np.isfinite(i)
+
+        # The short circuit end is the lowest voltage, the open circuit end the highest.
+        v_sc = np.nanmin(np.where(valid, v, np.nan), axis=1)
+        v_oc = np.nanmax(np.where(valid, v, np.nan), axis=1)
+        di_dv_sc = self._local_slope(v, i, v_sc, self._window_sc)
+        di_dv_oc = self._local_slope(v, i, v_oc, self._window_oc)
+
+        # The same checks as in the slope windows.
+        clamped_sc = ~(di_dv_sc <= self._max_slope_sc)
+        di_dv_sc = np.where(clamped_sc, self._max_slope_sc, di_dv_sc)
+        clamped_oc = ~((di_dv_oc <= 0) & (di_dv_oc >= self._min_slope_oc))
+        di_dv_oc = np.where(clamped_oc, self._min_slope_oc, di_dv_oc)
+
+        return di_dv_sc, di_dv_oc, clamped_sc, clamped_oc
+
+    def datasheet_slopes(self, v, i):
+        # The slopes as keyword arguments of PV_Module_Batch_Extractor.
+        di_dv_sc, di_dv_oc, _, _ = self.estimate(v, i)
+        return {"di_dv_sc": di_dv_sc, "di_dv_oc": di_dv_oc}
+
+
+# Unit test.
+if __name__ == "__main__":
+    import time
+    from datasheet_generator import SyntheticDatasheetGenerator
+    from iv_curve import current_at_voltage, thermal_voltage
+
+    # Digitize synthetic curves with known slopes, with noise and a few outliers.
+    n_modules = 20000
+    n_points = 60
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    datasheets = next(generator.iter_chunks(n_modules))
+    rng = np.random.default_rng(1)
+    v = datasheets["v_oc_stc"][:, None] * np.linspace(0.0, 1.0, n_points)
+    parameters = [datasheets["true_" + item][:, None] for item in ["a", "i_o", "i_ph", "r_s", "r_sh"]]
+    i = current_at_voltage(v, *parameters, thermal_voltage(25, datasheets["n_cell"])[:, None])
+    i += rng.normal(0.0, 1e-4, i.shape)
+    outliers = rng.random(i.shape) < 0.02
+    i[outliers] += rng.normal(0.0, 0.2, outliers.sum())
+
+    slope_estimator = IV_Slope_Estimator()
+    start_time = time.perf_counter()
+    di_dv_sc, di_dv_oc, clamped_sc, clamped_oc = slope_estimator.estimate(v, i)
+    elapsed_time = time.perf_counter() - start_time
+    print("Estimated the slopes of " + str(n_modules) + " curves in " + "{:.3f}".format(elapsed_time) + " s.")
+    print("median relative error of di_dv_sc = " + str(np.median(np.abs(di_dv_sc / datasheets["di_dv_sc"] - 1))))
+    print("median relative error of di_dv_oc = " + str(np.median(np.abs(di_dv_oc / datasheets["di_dv_oc"] - 1))))
+    print("clamped: " + str(clamped_sc.sum()) + " short circuit, " + str(clamped_oc.sum()) + " open circuit")
+
+    # Feed the slopes to the batch extractor.
+    from batch_extractor import PV_Module_Batch_Extractor
+    inputs = {item: datasheets[item] for item in generator.datasheet_items}
+    inputs.update(slope_estimator.datasheet_slopes(v, i))
+    batch_extractor = PV_Module_Batch_Extractor(**inputs)
+    batch_extractor.extract()
+    print("Batch extraction converged: " + str(batch_extractor.get_solver_info()["converged"].sum())
+        + " of " + str(n_modules))
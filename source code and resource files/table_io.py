@@ -0,0 +1,186 @@
+# Columnar batch input and output with Arrow IPC and Parquet files.
+#
+# The main window reads and writes one case per JSON file, with every value
+# as a string. For catalogs of many modules, the functions here read tables
+# of data sheets from Arrow IPC (.arrow, .feather, .ipc) or Parquet
+# (.parquet) files and write tables of extracted parameters, with one column
+# per item, directly from and to the numpy arrays of the batch extractor.
+#
+# No Python object is made per row: a float64 column without missing values
+# in a single chunk is viewed as a numpy array without copying, text columns
+# are kept as Arrow arrays and written back as they are, and Arrow IPC files
+# are memory mapped, so their columns are not even read into memory before
+# they are used. Large files can be processed in batches of rows with
+# extract_table().
+#
+# pyarrow is an optional dependency. It is imported when the functions are
+# used, so the rest of the package works without it.
+
+
+import os
+import numpy as np
+
+# The numeric input columns of the extractors. All other columns of a table (e.g. the
+# manufacturer, the model or a serial number) are kept with them as Arrow arrays.
+input_items = ["v_oc_stc", "i_sc_stc", "v_mp", "i_mp", "temp_coeff_i_perc", "temp_coeff_v_perc",
+    "n_cell", "di_dv_sc", "di_dv_oc", "temperature_c", "solar_irr", "a_init", "r_s_init"]
+# The output columns added by extract_table().
+output_items = ["a", "i_o", "i_ph", "r_s", "r_sh", "mismatch", "converged"]
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet files need the pyarrow package (pip install pyarrow).")
+    return pyarrow
+
+def _file_format(path):
+    # "parquet" or "ipc", from the file extension.
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return "parquet"
+    if extension in [".arrow", ".feather", ".ipc"]:
+        return "ipc"
+    raise ValueError("Unknown table file extension: " + extension)
+
+def _column_to_numpy(column):
+    # A numpy view of a numeric column if possible (float64, one chunk, no missing
+    # values), otherwise a copy. Missing values become NaN. Text columns are returned
+    # as Arrow arrays, as numpy would need a Python object per row.
+    pyarrow = _import_pyarrow()
+    if isinstance(column, pyarrow.ChunkedArray):
+        column = column.chunks[0] if column.num_chunks == 1 else column.combine_chunks()
+    if pyarrow.types.is_string(column.type) or pyarrow.types.is_large_string(column.type):
+        return column
+    if column.type != pyarrow.float64():
+        column = column.cast(pyarrow.float64())
+    if column.null_count:
+        column = column.fill_null(np.nan)
+    return column.to_numpy(zero_copy_only=False)
+
+def _table_to_columns(table):
+    # The columns of a table (or a record batch) as a dictionary: the numeric columns of the
+    # extractors as numpy arrays, and every other column (text, IDs, ...) as the Arrow array
+    # it is, so it is passed through to the output without copying.
+    return {name: _column_to_numpy(table.column(name)) if name in input_items or name in output_items
+        else table.column(name) for name in table.column_names}
+
+def read_table(path, columns=None):
+    # Read a whole table. Returns a dictionary of numpy arrays (one per numeric column of
+    # the extractors) and Arrow arrays (one per other column). The input_items columns can
+    # be passed to PV_Module_Batch_Extractor.
+    pyarrow = _import_pyarrow()
+    if _file_format(path) == "parquet":
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(path, columns=columns)
+    else:
+        import pyarrow.ipc
+        table = pyarrow.ipc.open_file(pyarrow.memory_map(path, "r")).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    return _table_to_columns(table)
+
+def iter_table_batches(path, batch_size=1000000):
+    # Read a table in batches of at most batch_size rows, as dictionaries of arrays (see
+    # read_table()).
+    pyarrow = _import_pyarrow()
+    if _file_format(path) == "parquet":
+        import pyarrow.parquet
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=batch_size):
+            yield _table_to_columns(batch)
+    else:
+        import pyarrow.ipc
+        reader = pyarrow.ipc.open_file(pyarrow.memory_map(path, "r"))
+        for index in range(reader.num_record_batches):
+            batch = reader.get_batch(index)
+            for start in range(0, batch.num_rows, batch_size):
+                yield _table_to_columns(batch.slice(start, batch_size))
+
+def _columns_to_table(columns):
+    # numpy float arrays are wrapped without copying, and Arrow arrays are used as they are.
+    pyarrow = _import_pyarrow()
+    return pyarrow.table({name: values if isinstance(values, (pyarrow.Array, pyarrow.ChunkedArray))
+        else pyarrow.array(np.asarray(values)) for name, values in columns.items()})
+
+def write_table(path, columns, compression="zstd"):
+    # Write a dictionary of arrays (one per column) as a table.
+    pyarrow = _import_pyarrow()
+    table = _columns_to_table(columns)
+    if _file_format(path) == "parquet":
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path, compression=compression)
+    else:
+        import pyarrow.ipc
+        with pyarrow.ipc.new_file(path, table.schema) as writer:
+            writer.write_table(table)
+
+def extract_table(input_path, output_path, batch_size=1000000, precision="standard", compression="zstd"):
+    # Extract every data sheet of the input table with the batch extractor and write the
+    # input columns with the extracted parameters to the output table, one batch of rows
+    # at a time. Returns the number of rows.
+    pyarrow = _import_pyarrow()
+    from batch_extractor import PV_Module_Batch_Extractor
+
+    writer = None
+    n_rows = 0
+    try:
+        for columns in iter_table_batches(input_path, batch_size):
+            inputs = {item: columns[item] for item in input_items if item in columns}
+            a_init = inputs.pop("a_init", 1.3)
+            r_s_init = inputs.pop("r_s_init", 0.3)
+            batch_extractor = PV_Module_Batch_Extractor(**inputs)
+            batch_extractor.extract(a_init, r_s_init, precision=precision)
+            solution = batch_extractor.get_solution()
+            solver_info = batch_extractor.get_solver_info()
+
+            output = dict(columns)
+            for item in ["a", "i_o", "i_ph", "r_s", "r_sh"]:
+                output[item] = np.atleast_1d(solution[item])
+            output["mismatch"] = np.atleast_1d(solver_info["mismatch"])
+            output["converged"] = np.atleast_1d(solver_info["converged"])
+            table = _columns_to_table(output)
+
+            if writer is None:
+                if _file_format(output_path) == "parquet":
+                    import pyarrow.parquet
+                    writer = pyarrow.parquet.ParquetWriter(output_path, table.schema, compression=compression)
+                else:
+                    import pyarrow.ipc
+                    writer = pyarrow.ipc.new_file(output_path, table.schema)
+            writer.write_table(table)
+            n_rows += table.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return n_rows
+
+
+# Unit test.
+if __name__ == "__main__":
+    import sys
+    import time
+    import tempfile
+    from datasheet_generator import SyntheticDatasheetGenerator
+
+    n_modules = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    generator = SyntheticDatasheetGenerator(seed=0, chunk_size=n_modules)
+    datasheets = next(generator.iter_chunks(n_modules))
+    catalog = {item: datasheets[item] for item in generator.datasheet_items}
+    catalog["model"] = np.array(["type " + str(index % 50) for index in range(n_modules)])
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension in [".arrow", ".parquet"]:
+            input_path = os.path.join(directory, "catalog" + extension)
+            output_path = os.path.join(directory, "parameters" + extension)
+            start_time = time.perf_counter()
+            write_table(input_path, catalog)
+            write_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            columns = read_table(input_path)
+            read_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            n_rows = extract_table(input_path, output_path)
+            extract_time = time.perf_counter() - start_time
+            print(extension + ": " + str(n_rows) + " rows, write " + "{:.2f}".format(write_time) + " s, read "
+                + "{:.2f}".format(read_time) + " s, extract and write parameters " + "{:.2f}".format(extract_time)
+                + " s, converged: " + str(int(read_table(output_path, ["converged"])["converged"].sum())))